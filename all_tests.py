@@ -15,40 +15,54 @@
 # limitations under the License.
 
 
+"""Run the tests of all (or the given) *_test.py modules.
+
+The tests run with a temporary cache directory, so that the builtins they load
+don't leave snapshots in the user's cache. (See parse/builtins.py.) Run this
+instead of single test modules, e.g.:
+  python -B all_tests.py optimize_test parse.builtins_test
+"""
+
+import glob
+import os
+import shutil
+import sys
+import tempfile
 import unittest
-import checker_classes_test
-import checker_generics_test
-import checker_overloading_test
-import checker_test
-import checker_union_test
-from parse import ast_test
 
+from pytypedecl.parse import builtins
+
+
+# Modules that aren't run: The parser doesn't support checker_interface_test's
+# declarations, and inference_test is a base class for testing type inference.
+_SKIPPED = frozenset(["checker_interface_test", "inference_test"])
 
-def suite():
 
-  # ast tests
-  # TODO: can this be simplified using test discovery?
+def TestModuleNames():
+  """Names of all the *_test.py modules, relative to this directory."""
+  directory = os.path.dirname(os.path.abspath(__file__))
+  names = []
+  for pattern in ("*_test.py", os.path.join("parse", "*_test.py")):
+    for filename in sorted(glob.glob(os.path.join(directory, pattern))):
+      name = os.path.relpath(filename, directory)[:-len(".py")]
+      names.append(name.replace(os.sep, "."))
+  return [name for name in names if name not in _SKIPPED]
 
-  ast_generation = unittest.TestLoader().loadTestsFromTestCase(
-      ast_test.TestASTGeneration)
-  tuple_eq = unittest.TestLoader().loadTestsFromTestCase(ast_test.TestTupleEq)
 
-  # checker tests
-  classes = unittest.TestLoader().loadTestsFromTestCase(
-      checker_classes_test.TestCheckerClasses)
-  generics = unittest.TestLoader().loadTestsFromTestCase(
-      checker_generics_test.TestCheckerGenerics)
-  overloading = unittest.TestLoader().loadTestsFromTestCase(
-      checker_overloading_test.TestCheckerOverloading)
-  simple = unittest.TestLoader().loadTestsFromTestCase(checker_test.TestChecker)
-  union = unittest.TestLoader().loadTestsFromTestCase(
-      checker_union_test.TestCheckerUnion)
+def suite(names=None):
+  """Load the tests of the given test modules, or all of them."""
+  return unittest.TestLoader().loadTestsFromNames(names or TestModuleNames())
 
-  all_tests = [ast_generation, tuple_eq, classes, generics, overloading,
-               simple, union]
 
-  return unittest.TestSuite(all_tests)
+def main(argv):
+  cache_dir = tempfile.mkdtemp()
+  os.environ[builtins.CACHE_DIR_VARIABLE] = cache_dir
+  try:
+    result = unittest.TextTestRunner().run(suite(argv[1:]))
+  finally:
+    shutil.rmtree(cache_dir)
+  return 0 if result.wasSuccessful() else 1
 
 
 if __name__ == "__main__":
-  unittest.TextTestRunner().run(suite())
+  sys.exit(main(sys.argv))
@@ -0,0 +1,286 @@
+# -*- coding:utf-8; python-indent:2; indent-tabs-mode:nil -*-
+
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Index of a class hierarchy, for answering subclass queries quickly.
+
+Example:
+  hierarchy = GetClassHierarchy(use_abcs=True)
+  hierarchy.IsSubclass("bool", "Integral")  # True
+  hierarchy.LeastCommonAncestors(["list", "tuple"])  # ["Sequence"]
+"""
+
+from pytypedecl import abc_hierarchy
+from pytypedecl import pytd
+from pytypedecl.parse import builtins
+
+
+class ClassHierarchy(object):
+  """Answers subclass queries about a (named) class hierarchy.
+
+  Every class gets an integer ID, and the transitive closures of its
+  superclasses and subclasses are stored as bitsets: Python longs, with bit i
+  set for the class with ID i. That makes set operations on them (e.g.,
+  intersecting the superclasses of several classes) very fast. The closures are
+  computed when they're first needed.
+
+  Classes are identified by their name. Names this hierarchy doesn't know are
+  treated as classes without superclasses and subclasses.
+  """
+
+  def __init__(self, superclasses, subclasses=None):
+    """Create an index.
+
+    Args:
+      superclasses: A dictionary mapping class names to lists of the names of
+        their direct superclasses, like builtins.GetBuiltinsHierarchy(). Only
+        get() and "in" are used on it.
+      subclasses: The inverse mapping, from class names to lists of the names
+        of their direct subclasses. Computed from superclasses if not given.
+    """
+    self._superclasses = superclasses
+    if subclasses is None:
+      subclasses = abc_hierarchy.Invert(superclasses)
+    self._subclasses = subclasses
+    self._ids = {}  # name -> ID
+    self._names = []  # ID -> name
+    self._ancestors = {}  # ID -> bitset
+    self._descendants = {}  # ID -> bitset
+
+  def __contains__(self, name):
+    return name in self._superclasses or name in self._subclasses
+
+  def _Id(self, name):
+    i = self._ids.get(name)
+    if i is None:
+      i = self._ids[name] = len(self._names)
+      self._names.append(name)
+    return i
+
+  def _Closure(self, name, closures, edges):
+    i = self._Id(name)
+    bits = closures.get(i)
+    if bits is not None:
+      return bits
+    # Depth-first search with an explicit stack, so that long chains of classes
+    # don't exceed the recursion limit. Classes on the stack have a preliminary
+    # value, so that cycles terminate.
+    closures[i] = 1 << i
+    stack = [(i, name, iter(edges.get(name, ())))]
+    try:
+      while stack:
+        j, current, others = stack[-1]
+        for other in others:
+          k = self._Id(other)
+          if k not in closures:
+            closures[k] = 1 << k
+            stack.append((k, other, iter(edges.get(other, ()))))
+            break
+        else:
+          stack.pop()
+          bits = 1 << j
+          for other in edges.get(current, ()):
+            bits |= closures[self._ids[other]]
+          closures[j] = bits
+    except:
+      for j, _, _ in stack:
+        del closures[j]
+      raise
+    return closures[i]
+
+  def _AncestorBits(self, name):
+    return self._Closure(name, self._ancestors, self._superclasses)
+
+  def _DescendantBits(self, name):
+    return self._Closure(name, self._descendants, self._subclasses)
+
+  def _Names(self, bits, first=None):
+    """Convert a bitset to a list of names, ordered by ID.
+
+    Args:
+      bits: A bitset.
+      first: Optionally, the name to put first, if it's in the set.
+
+    Returns:
+      A list of class names.
+    """
+    names = []
+    while bits:
+      lowest = bits & -bits
+      names.append(self._names[lowest.bit_length() - 1])
+      bits ^= lowest
+    if first is not None and first in names:
+      names.remove(first)
+      names.insert(0, first)
+    return names
+
+  def IsSubclass(self, name, base):
+    """Whether name is base, or (indirectly) derives from it."""
+    if name not in self or base not in self:
+      return name == base
+    return bool(self._AncestorBits(name) >> self._Id(base) & 1)
+
+  def GetAncestors(self, name):
+    """Get the names of a class and all its (direct and indirect) superclasses.
+
+    Args:
+      name: A class name.
+
+    Returns:
+      A list of class names, starting with name itself.
+    """
+    if name not in self:
+      return [name]
+    return self._Names(self._AncestorBits(name), first=name)
+
+  def GetDescendants(self, name):
+    """Get the names of a class and all its (direct and indirect) subclasses.
+
+    Args:
+      name: A class name.
+
+    Returns:
+      A list of class names, starting with name itself.
+    """
+    if name not in self:
+      return [name]
+    return self._Names(self._DescendantBits(name), first=name)
+
+  def _LeafBits(self, bits):
+    """Remove the classes that have a subclass in the set from a bitset."""
+    leaves = bits
+    remaining = bits
+    while remaining:
+      lowest = remaining & -remaining
+      remaining ^= lowest
+      name = self._names[lowest.bit_length() - 1]
+      if self._DescendantBits(name) & bits != lowest:
+        leaves ^= lowest
+    return leaves
+
+  def LeastCommonAncestors(self, names):
+    """Find the most specific classes that all the given classes derive from.
+
+    E.g., for "bool" and "float" (and abstract base classes), this is "Real".
+
+    Args:
+      names: A non-empty list of class names.
+
+    Returns:
+      A list of class names. Each is a superclass of (or one of) all the given
+      classes, and none is a superclass of another one.
+    """
+    if not all(name in self for name in names):
+      # Names we don't know have no superclasses, so they have only
+      # themselves in common.
+      return names[:1] if len(set(names)) == 1 else []
+    common = -1
+    for name in names:
+      common &= self._AncestorBits(name)
+    return self._Names(self._LeafBits(common))
+
+  def Leaves(self, names):
+    """Remove the classes that have a subclass in the given list.
+
+    Args:
+      names: A list of class names.
+
+    Returns:
+      The names in the given list that have no (direct or indirect) subclass in
+      the list, in their original order.
+    """
+    known = [name for name in names if name in self]
+    bits = 0
+    for name in known:
+      bits |= 1 << self._Id(name)
+    leaves = self._LeafBits(bits)
+    return [name for name in names
+            if name not in self or leaves >> self._ids[name] & 1]
+
+
+def GetSuperClasses(superclasses=None, use_abcs=True):
+  """Get the superclasses of the builtins, plus the given ones.
+
+  Args:
+    superclasses: Optionally, a dictionary mapping class names to lists of
+      superclass names, to add to (or override) the ones of the builtins.
+    use_abcs: Whether to also add the abstract base classes, like "Sequence",
+      from abc_hierarchy.
+
+  Returns:
+    A new dictionary mapping class names to lists of superclass names.
+  """
+  result = builtins.GetBuiltinsHierarchy()
+  result.update(superclasses or {})
+  if use_abcs:
+    result.update(abc_hierarchy.GetSuperClasses())
+  return result
+
+
+def GetSuperClassesByName(unit, prefix=""):
+  """Like visitors.ExtractSuperClassesByName, without visiting every node.
+
+  Args:
+    unit: A pytd.TypeDeclUnit.
+    prefix: A prefix for the class names, like "os.path.".
+
+  Returns:
+    A dictionary mapping the (dotted) names of the classes of unit and its
+    submodules to lists of the names of their superclasses.
+  """
+  superclasses = {}
+  for cls in unit.classes:
+    names = superclasses[prefix + cls.name] = []
+    for parent in cls.parents:
+      if isinstance(parent, pytd.GenericType):
+        # Also a HomogeneousContainerType. E.g. "class B(A<int>)" derives
+        # from A.
+        parent = parent.base_type
+      if isinstance(parent, (pytd.NamedType, pytd.ClassType)):
+        names.append(parent.name)
+  for module in unit.modules:
+    superclasses.update(
+        GetSuperClassesByName(module, prefix + module.name + "."))
+  return superclasses
+
+
+_cached_hierarchies = {}
+
+
+def GetClassHierarchy(unit=None, use_abcs=True):
+  """Get the hierarchy of the builtins, and of the classes in a module.
+
+  This is cached: There's one instance per (unit, use_abcs).
+
+  Args:
+    unit: Optionally, a pytd.TypeDeclUnit whose classes to add.
+    use_abcs: See GetSuperClasses().
+
+  Returns:
+    A ClassHierarchy.
+  """
+  if unit is None:
+    cache = _cached_hierarchies
+  else:
+    cache = unit.__dict__.setdefault("_class_hierarchies", {})
+  use_abcs = bool(use_abcs)
+  hierarchy = cache.get(use_abcs)
+  if hierarchy is None:
+    superclasses = None
+    if unit is not None:
+      superclasses = GetSuperClassesByName(unit)
+    hierarchy = ClassHierarchy(GetSuperClasses(superclasses, use_abcs))
+    cache[use_abcs] = hierarchy
+  return hierarchy
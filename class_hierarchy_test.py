@@ -0,0 +1,114 @@
+"""Tests for class_hierarchy.py."""
+
+import textwrap
+import unittest
+
+
+from pytypedecl import class_hierarchy
+from pytypedecl.parse import parser_test
+
+
+class TestClassHierarchy(parser_test.ParserTest):
+  """Test the ClassHierarchy index."""
+
+  def setUp(self):
+    super(TestClassHierarchy, self).setUp()
+    # A diamond, plus a cycle (which is invalid, but shouldn't hang).
+    self.hierarchy = class_hierarchy.ClassHierarchy({
+        "object": [],
+        "A": ["object"],
+        "B": ["A"],
+        "C": ["A"],
+        "D": ["B", "C"],
+        "X": ["Y"],
+        "Y": ["X"],
+    })
+
+  def testIsSubclass(self):
+    self.assertTrue(self.hierarchy.IsSubclass("D", "A"))
+    self.assertTrue(self.hierarchy.IsSubclass("D", "D"))
+    self.assertTrue(self.hierarchy.IsSubclass("B", "object"))
+    self.assertFalse(self.hierarchy.IsSubclass("A", "D"))
+    self.assertFalse(self.hierarchy.IsSubclass("B", "C"))
+    self.assertTrue(self.hierarchy.IsSubclass("X", "Y"))
+    self.assertTrue(self.hierarchy.IsSubclass("unknown", "unknown"))
+    self.assertFalse(self.hierarchy.IsSubclass("unknown", "A"))
+
+  def testGetAncestors(self):
+    ancestors = self.hierarchy.GetAncestors("D")
+    self.assertEquals("D", ancestors[0])
+    self.assertItemsEqual(["D", "B", "C", "A", "object"], ancestors)
+    self.assertItemsEqual(["X", "Y"], self.hierarchy.GetAncestors("X"))
+    self.assertEquals(["unknown"], self.hierarchy.GetAncestors("unknown"))
+
+  def testGetDescendants(self):
+    descendants = self.hierarchy.GetDescendants("A")
+    self.assertEquals("A", descendants[0])
+    self.assertItemsEqual(["A", "B", "C", "D"], descendants)
+    self.assertEquals(["D"], self.hierarchy.GetDescendants("D"))
+    self.assertEquals(["unknown"], self.hierarchy.GetDescendants("unknown"))
+
+  def testLeastCommonAncestors(self):
+    lca = self.hierarchy.LeastCommonAncestors
+    self.assertEquals(["A"], lca(["B", "C"]))
+    self.assertEquals(["D"], lca(["D", "D"]))
+    self.assertEquals(["B"], lca(["B", "D"]))
+    self.assertEquals(["object"], lca(["object", "D"]))
+    self.assertEquals([], lca(["A", "unknown"]))
+    self.assertEquals(["unknown"], lca(["unknown", "unknown"]))
+
+  def testLeaves(self):
+    self.assertEquals(["D"], self.hierarchy.Leaves(["A", "D", "B"]))
+    self.assertEquals(["C", "B"], self.hierarchy.Leaves(["C", "B", "A"]))
+    self.assertEquals(["unknown", "D"],
+                      self.hierarchy.Leaves(["unknown", "D", "object"]))
+
+  def testBuiltins(self):
+    hierarchy = class_hierarchy.GetClassHierarchy(use_abcs=True)
+    self.assertTrue(hierarchy.IsSubclass("bool", "int"))
+    self.assertTrue(hierarchy.IsSubclass("bool", "Integral"))
+    self.assertEquals(["Real"],
+                      hierarchy.LeastCommonAncestors(["bool", "float"]))
+    self.assertIn("Sequence", hierarchy.LeastCommonAncestors(["list", "tuple"]))
+    no_abcs = class_hierarchy.GetClassHierarchy(use_abcs=False)
+    self.assertFalse(no_abcs.IsSubclass("bool", "Integral"))
+
+  def testCache(self):
+    unit = self.Parse(textwrap.dedent("""
+        class A(int):
+            pass
+    """))
+    hierarchy = class_hierarchy.GetClassHierarchy(unit)
+    self.assertIs(hierarchy, class_hierarchy.GetClassHierarchy(unit))
+    self.assertIsNot(hierarchy,
+                     class_hierarchy.GetClassHierarchy(unit, use_abcs=False))
+    self.assertIsNot(hierarchy, class_hierarchy.GetClassHierarchy())
+    self.assertTrue(hierarchy.IsSubclass("A", "object"))
+    self.assertNotIn("A", class_hierarchy.GetClassHierarchy())
+
+  def testGenericParents(self):
+    unit = self.Parse(textwrap.dedent("""
+        class A<T>(object):
+            pass
+        class B(A<int>):
+            pass
+        class C(A<int, float>, list<int>):
+            pass
+    """))
+    self.assertEquals({"A": ["object"], "B": ["A"], "C": ["A", "list"]},
+                      class_hierarchy.GetSuperClassesByName(unit))
+    hierarchy = class_hierarchy.GetClassHierarchy(unit)
+    self.assertItemsEqual(["A", "B", "C"], hierarchy.GetDescendants("A"))
+    self.assertTrue(hierarchy.IsSubclass("C", "list"))
+
+  def testDeepHierarchy(self):
+    depth = 5000
+    hierarchy = class_hierarchy.ClassHierarchy(
+        {"C%d" % i: ["C%d" % (i - 1)] if i else [] for i in range(depth)})
+    self.assertEquals(depth, len(hierarchy.GetAncestors("C%d" % (depth - 1))))
+    self.assertEquals(depth, len(hierarchy.GetDescendants("C0")))
+    self.assertTrue(hierarchy.IsSubclass("C%d" % (depth - 1), "C0"))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -23,14 +23,20 @@
    redundancies.
 """
 
+import argparse
 import collections
+import hashlib
 import itertools
 import logging
+import multiprocessing
+import sys
+import time
 
-from pytypedecl import abc_hierarchy
+from pytypedecl import class_hierarchy
 from pytypedecl import pytd
 from pytypedecl import utils
 from pytypedecl.parse import builtins
+from pytypedecl.parse import parser
 from pytypedecl.parse import visitors
 
 log = logging.getLogger(__name__)
@@ -68,7 +74,7 @@ class SimplifyUnions(object):
   """
 
   def VisitUnionType(self, union):
-    return utils.JoinTypes(union.type_list)
+    return utils.JoinTypes([union])
 
 
 class _ReturnsAndExceptions(object):
@@ -207,6 +213,59 @@ class CombineContainers(object):
     return result
 
 
+class ExpansionLimitError(Exception):
+  """Raised if a signature would expand to too many signatures."""
+
+  def __init__(self, sig, count, max_signatures):
+    super(ExpansionLimitError, self).__init__(
+        "Signature would expand to %d signatures, more than %d" % (
+            count, max_signatures))
+    self.sig = sig
+    self.count = count
+
+
+def ExpandSignature(sig, max_signatures=None, keep_unions=False):
+  """Lazily expand a signature to the Cartesian product of its parameter types.
+
+  See ExpandSignatures. The signatures are created one at a time, as they are
+  requested, so callers that stop early don't pay for the rest.
+
+  Arguments:
+    sig: A pytd.Signature instance.
+    max_signatures: The maximum number of signatures to expand to, or None.
+    keep_unions: What to do if sig would expand to more than max_signatures.
+      If True, only expand the parameters (from left to right) that still fit
+      and keep the unions of the others. If False, raise ExpansionLimitError.
+
+  Yields:
+    pytd.Signature instances. The expansion is done right to left, like in
+    ExpandSignatures.
+
+  Raises:
+    ExpansionLimitError: If sig expands to more than max_signatures signatures
+      and keep_unions is False. Since this is a generator, this happens when
+      the first signature is requested.
+  """
+  options = [param.type.type_list if isinstance(param.type, pytd.UnionType)
+             else (param.type,) for param in sig.params]
+  count = 1
+  for types in options:
+    count *= len(types)
+  if max_signatures is not None and count > max_signatures:
+    if not keep_unions:
+      raise ExpansionLimitError(sig, count, max_signatures)
+    count = 1
+    for i, types in enumerate(options):
+      if count * len(types) <= max_signatures:
+        count *= len(types)
+      else:
+        options[i] = (sig.params[i].type,)
+  for combination in itertools.product(*options):
+    # To make this work with MutableParameter, we only use the parameter names.
+    yield sig.Replace(params=tuple(pytd.Parameter(param.name, t) for param, t
+                                   in zip(sig.params, combination)))
+
+
 class ExpandSignatures(object):
   """Expand to Cartesian product of parameter types.
 
@@ -224,6 +283,19 @@ class ExpandSignatures(object):
   inferencer.
   """
 
+  def __init__(self, max_signatures=None, keep_unions=False):
+    """Create this visitor.
+
+    Args:
+      max_signatures: The maximum number of signatures to expand a single
+        signature to, or None. See ExpandSignature.
+      keep_unions: If True, keep some of the unions of signatures that would
+        otherwise expand to more than max_signatures. If False, raise
+        ExpansionLimitError for those.
+    """
+    self.max_signatures = max_signatures
+    self.keep_unions = keep_unions
+
   def VisitFunction(self, f):
     """Rebuild the function with the new signatures.
 
@@ -239,7 +311,7 @@ class ExpandSignatures(object):
     """
 
     # concatenate return value(s) from VisitSignature
-    new_signatures = tuple(sum(f.signatures, []))
+    new_signatures = tuple(itertools.chain.from_iterable(f.signatures))
 
     return f.Replace(signatures=new_signatures)
 
@@ -257,22 +329,106 @@ class ExpandSignatures(object):
     Returns:
       A list. The visit function of the parent of this node (VisitFunction) will
       process this list further.
+
+    Raises:
+      ExpansionLimitError: If the signature expands to too many signatures.
     """
-    params = []
+    return list(ExpandSignature(sig, self.max_signatures, self.keep_unions))
+
+
+# Encoded type of a parameter that can't be factorized (see _SignatureTable).
+_NO_TYPE = -1
+
+
+class _SignatureTable(object):
+  """Encodes signatures as tuples of small integers, for Factorize.
+
+  A signature is encoded as (rest, label_0, type_0, label_1, type_1, ...):
+  "rest" stands for everything except the parameters, label_i for the name of
+  parameter i (or, for a MutableParameter, the whole parameter), and type_i for
+  its type. Equal nodes get equal IDs, so encoded signatures are equal iff the
+  signatures are, and grouping them doesn't need to create any nodes.
+  """
+
+  def __init__(self):
+    self._ids = ({}, {}, {})  # rests, labels, types -> ID
+    self._values = ([], [], [])  # ID -> rests, labels, types
+    self._joined = {}  # tuple of type IDs -> ID of their union
+    self._originals = {}  # encoded signature -> signature
+
+  def _Id(self, table, value):
+    ids = self._ids[table]
+    i = ids.get(value)
+    if i is None:
+      i = ids[value] = len(self._values[table])
+      self._values[table].append(value)
+    return i
+
+  def Encode(self, sig):
+    items = [self._Id(0, (sig.return_type, sig.exceptions, sig.template,
+                          sig.has_optional))]
     for param in sig.params:
-      # To make this work with MutableParameter
-      name, param_type = param.name, param.type
-      if isinstance(param_type, pytd.UnionType):
-        # multiple types
-        params.append([pytd.Parameter(name, t) for t in param_type.type_list])
+      if isinstance(param, pytd.MutableParameter):
+        # We can't group mutable parameters.
+        items += (self._Id(1, param), _NO_TYPE)
       else:
-        # single type
-        params.append([pytd.Parameter(name, param_type)])
+        items += (self._Id(1, param.name), self._Id(2, param.type))
+    encoded = tuple(items)
+    self._originals.setdefault(encoded, sig)
+    return encoded
+
+  def Decode(self, encoded):
+    sig = self._originals.get(encoded)
+    if sig is None:
+      rests, labels, types = self._values
+      return_type, exceptions, template, has_optional = rests[encoded[0]]
+      params = tuple(
+          labels[label] if t == _NO_TYPE else
+          pytd.Parameter(labels[label], types[t])
+          for label, t in zip(encoded[1::2], encoded[2::2]))
+      sig = pytd.Signature(params, return_type, exceptions, template,
+                           has_optional)
+    return sig
 
-    new_signatures = [sig.Replace(params=tuple(combination))
-                      for combination in itertools.product(*params)]
+  def Join(self, type_ids):
+    """Return the ID of the union of the given types."""
+    key = tuple(type_ids)
+    i = self._joined.get(key)
+    if i is None:
+      types = self._values[2]
+      i = self._joined[key] = self._Id(2, utils.JoinTypes(
+          types[t] for t in type_ids))
+    return i
 
-    return new_signatures  # Hand list over to VisitFunction
+  def GroupByOmittedArg(self, encoded, i):
+    """Merge signatures that are identical if you ignore one of the arguments.
+
+    Arguments:
+      encoded: A list of encoded signatures.
+      i: The index of the argument to ignore during comparison.
+
+    Returns:
+      A list of encoded signatures, with the type of argument i of each group
+      replaced by the union of the group's types. Signatures that don't have
+      argument i, or can't be grouped by it, are kept as they are. The order
+      is the order in which the groups first occur.
+    """
+    slot = 2 + 2 * i
+    groups = {}
+    keys = []
+    for sig in encoded:
+      if slot >= len(sig) or sig[slot] == _NO_TYPE:
+        key, t = sig, None
+      else:
+        key, t = sig[:slot] + (_NO_TYPE,) + sig[slot + 1:], sig[slot]
+      if key not in groups:
+        keys.append(key)
+        groups[key] = None if t is None else [t]
+      elif t is not None:
+        groups[key].append(t)
+    return [key if groups[key] is None else
+            key[:slot] + (self.Join(groups[key]),) + key[slot + 1:]
+            for key in keys]
 
 
 class Factorize(object):
@@ -287,50 +443,51 @@ class Factorize(object):
     def f(x: int or float, y: int or float)
   """
 
-  def _GroupByOmittedArg(self, signatures, i):
-    """Group functions that are identical if you ignore one of the arguments.
+  def __init__(self, budget=100000):
+    """Create this visitor.
+
+    Args:
+      budget: How much work to spend, per function, on looking for a better
+        factorization than the greedy one, counted in signatures visited. This
+        is deliberately not a time limit, so that the result doesn't depend on
+        the speed (or load) of the machine.
+    """
+    self.budget = budget
+
+  def _Factorize(self, table, encoded, order, budget, fixpoint):
+    """Group signatures by the arguments in the given order.
 
     Arguments:
-      signatures: A list of function signatures
-      i: The index of the argument to ignore during comparison.
+      table: The _SignatureTable the signatures were encoded with.
+      encoded: A list of encoded signatures.
+      order: The argument indices, in the order in which to group by them.
+      budget: The maximum number of signatures to visit.
+      fixpoint: Whether to repeat grouping until the result stops shrinking.
 
     Returns:
-      A list of tuples (signature, types). "signature" is a signature with
-      argument i omitted, "types" is the list of types that argument was
-      found to have. signatures that don't have argument i are represented
-      as (original, None).
+      A tuple (encoded signatures, number of signatures visited). The first
+      element is None if we ran out of budget.
     """
-    groups = collections.OrderedDict()
-    for sig in signatures:
-      if i >= len(sig.params):
-        # We can't omit argument i, because this signature has too few
-        # arguments. Represent this signature as (original, None).
-        groups[sig] = None
-        continue
-      if isinstance(sig.params[i], pytd.MutableParameter):
-        # We can't group mutable parameters. Leave this signature alone.
-        groups[sig] = None
-        continue
-
-      # Set type of parameter i to None
-      params = list(sig.params)
-      param_i = params[i]
-      params[i] = pytd.Parameter(param_i.name, None)
-
-      stripped_signature = sig.Replace(params=tuple(params))
-      existing = groups.get(stripped_signature)
-      if existing:
-        existing.append(param_i.type)
-      else:
-        groups[stripped_signature] = [param_i.type]
-    return groups.items()
+    steps = 0
+    while True:
+      size = len(encoded)
+      for i in order:
+        steps += len(encoded)
+        if steps > budget:
+          return None, steps
+        encoded = table.GroupByOmittedArg(encoded, i)
+      if not fixpoint or len(encoded) == size or len(encoded) == 1:
+        return encoded, steps
 
   def VisitFunction(self, f):
     """Shrink a function, by factorizing cartesian products of arguments.
 
-    Greedily groups signatures, looking at the arguments from left to right.
-    This algorithm is *not* optimal. But it does the right thing for the
-    typical cases.
+    First greedily groups signatures, looking at the arguments from left to
+    right. This does the right thing for the typical cases, but isn't optimal,
+    so we then try the other orders of the arguments, repeating each until
+    nothing changes, until we find a factorization that can't be improved upon
+    or run out of budget. If that doesn't find anything smaller, the greedy
+    result is used.
 
     Arguments:
       f: An instance of pytd.Function. If this function has more than one
@@ -340,25 +497,28 @@ class Factorize(object):
     Returns:
       A new, potentially optimized, instance of pytd.Function.
     """
-    max_argument_count = max(len(s.params) for s in f.signatures)
-    signatures = f.signatures
-
-    for i in xrange(max_argument_count):
-      new_sigs = []
-      for sig, types in self._GroupByOmittedArg(signatures, i):
-        if types:
-          # One or more options for argument <i>:
-          new_params = list(sig.params)
-          new_params[i] = pytd.Parameter(sig.params[i].name,
-                                         utils.JoinTypes(types))
-          sig = sig.Replace(params=tuple(new_params))
-          new_sigs.append(sig)
-        else:
-          # Signature doesn't have argument <i>, so we store the original:
-          new_sigs.append(sig)
-      signatures = new_sigs
-
-    return f.Replace(signatures=tuple(signatures))
+    if len(f.signatures) < 2:
+      return f
+    table = _SignatureTable()
+    encoded = [table.Encode(sig) for sig in f.signatures]
+    arguments = range(max(len(s.params) for s in f.signatures))
+    best, steps = self._Factorize(table, encoded, arguments, float("inf"),
+                                  fixpoint=False)
+    # Signatures that differ in anything but their argument types can't be
+    # merged.
+    lower_bound = len(set((sig[0],) + sig[1::2] for sig in encoded))
+    budget = self.budget
+    for order in itertools.permutations(arguments):
+      if len(best) <= lower_bound:
+        break
+      candidate, steps = self._Factorize(table, encoded, order, budget,
+                                         fixpoint=True)
+      if candidate is None:
+        break
+      budget -= steps
+      if len(candidate) < len(best):
+        best = candidate
+    return f.Replace(signatures=tuple(table.Decode(sig) for sig in best))
 
 
 class ApplyOptionalArguments(object):
@@ -421,56 +581,175 @@ class ApplyOptionalArguments(object):
     return f.Replace(signatures=tuple(new_signatures))
 
 
-class FindCommonSuperClasses(object):
-  """Find common super classes. Optionally also uses abstract base classes.
+class RemoveSubsumedSignatures(object):
+  """Removes signatures that are covered by another signature.
 
-  E.g., this changes
-    def f(x: list or tuple, y: frozenset or set) -> int or float
-  to
-    def f(x: Sequence, y: Set) -> Real
+  For example, this reduces
+    def f(x: bool, y: int) -> str    # [1]
+    def f(x: int, y: int) -> str     # [2]
+  to just
+    def f(x: int, y: int) -> str
+  because every call that matches [1] also matches [2], with the same result.
+
+  Only signatures with the same parameter names and "..." are compared. To be
+  on the safe side, signatures with templates or mutable parameters are kept,
+  and "?" only covers "?".
   """
 
-  def __init__(self, superclasses=None, use_abcs=True):
-    self._superclasses = builtins.GetBuiltinsHierarchy()
-    self._superclasses.update(superclasses or {})
-    if use_abcs:
-      self._superclasses.update(abc_hierarchy.GetSuperClasses())
-    self._subclasses = abc_hierarchy.Invert(self._superclasses)
+  def __init__(self, use_abcs=False, narrower_returns=False, hierarchy=None):
+    """Create this visitor.
 
-  def _CollectSuperclasses(self, node, collect):
-    """Recursively collect super classes for a type.
+    Args:
+      use_abcs: Whether to use abstract base classes, like "Sequence".
+      narrower_returns: Whether to also remove signatures whose return type
+        and exceptions are narrower than those of the signature covering them.
+        This loses precision, so it's a lossy optimization.
+      hierarchy: Optionally, a class_hierarchy.ClassHierarchy to use, instead
+        of the one of the builtins.
+    """
+    if hierarchy is None:
+      hierarchy = class_hierarchy.GetClassHierarchy(use_abcs=use_abcs)
+    self._hierarchy = hierarchy
+    self.narrower_returns = narrower_returns
+
+  def _IsSubtype(self, t1, t2):
+    """Whether all values of type t1 are also of type t2."""
+    if t1 == t2:
+      return True
+    elif isinstance(t1, pytd.UnionType):
+      return all(self._IsSubtype(t, t2) for t in t1.type_list)
+    elif isinstance(t2, pytd.UnionType):
+      return any(self._IsSubtype(t1, t) for t in t2.type_list)
+    elif (isinstance(t1, (pytd.NamedType, pytd.ClassType)) and
+          isinstance(t2, (pytd.NamedType, pytd.ClassType))):
+      return self._hierarchy.IsSubclass(t1.name, t2.name)
+    else:
+      return False
+
+  def _Covers(self, sig1, sig2):
+    """Whether every call of sig2 is also a call of sig1, with the same result.
 
     Arguments:
-      node: A type node.
-      collect: A set(), modified to contain all superclasses.
+      sig1: A pytd.Signature.
+      sig2: A pytd.Signature with the same parameter names and "..." as sig1.
+
+    Returns:
+      True if sig1 makes sig2 redundant.
     """
-    collect.add(node)
-    superclasses = [pytd.NamedType(name)
-                    for name in self._superclasses.get(str(node), [])]
+    if self.narrower_returns:
+      if not (self._IsSubtype(sig2.return_type, sig1.return_type) and
+              set(sig2.exceptions) <= set(sig1.exceptions)):
+        return False
+    elif not (sig2.return_type == sig1.return_type and
+              set(sig2.exceptions) == set(sig1.exceptions)):
+      return False
+    return all(self._IsSubtype(p2.type, p1.type)
+               for p1, p2 in zip(sig1.params, sig2.params))
+
+  def _KeyParameter(self, sig):
+    """The first parameter that isn't "self", or None."""
+    for param in sig.params:
+      if param.name != "self":
+        return param
+    return None
+
+  def _IndexKeys(self, t):
+    """The keys to store a signature under, given its key parameter type."""
+    if isinstance(t, pytd.UnionType):
+      return set(itertools.chain.from_iterable(
+          self._IndexKeys(u) for u in t.type_list))
+    elif isinstance(t, (pytd.NamedType, pytd.ClassType)):
+      return [t.name]
+    else:
+      return [t]
+
+  def _LookupKeys(self, t):
+    """The keys under which signatures covering this type can be found."""
+    if isinstance(t, pytd.UnionType):
+      # Covering the union means covering its first member, too.
+      t = t.type_list[0]
+    if isinstance(t, (pytd.NamedType, pytd.ClassType)):
+      return self._hierarchy.GetAncestors(t.name)
+    else:
+      return [t]
 
-    # The superclasses might have superclasses of their own, so recurse.
-    for superclass in superclasses:
-      self._CollectSuperclasses(superclass, collect)
+  def VisitFunction(self, f):
+    """Remove all signatures that are covered by another one.
 
-  def _Expand(self, t):
-    """Generate a list of all (known) superclasses for a type.
+    Signatures are put into buckets by their parameter names and the type of
+    their first parameter (other than "self"), so that we only need to compare
+    each signature against the ones in the buckets of the supertypes of its
+    first parameter type.
 
     Arguments:
-      t: A type. E.g. NamedType("int").
+      f: An instance of pytd.Function
 
     Returns:
-      A set of types. This set includes t as well as all its superclasses. For
-      example, this will return "bool", "int" and "object" for "bool".
+      A potentially simplified instance of pytd.Function.
     """
-    superclasses = set()
-    self._CollectSuperclasses(t, superclasses)
-    return superclasses
+    if len(f.signatures) < 2:
+      return f
+    buckets = collections.defaultdict(list)  # key -> list of indices
+    candidates = []
+    for i, sig in enumerate(f.signatures):
+      if sig.template or any(isinstance(p, pytd.MutableParameter)
+                             for p in sig.params):
+        candidates.append(None)
+        continue
+      names = (tuple(p.name for p in sig.params), sig.has_optional)
+      param = self._KeyParameter(sig)
+      if param is None:
+        buckets[names].append(i)
+        candidates.append([names])
+      else:
+        for key in self._IndexKeys(param.type):
+          buckets[names, key].append(i)
+        candidates.append([(names, key)
+                           for key in self._LookupKeys(param.type)])
+    removed = set()
+    for i, keys in enumerate(candidates):
+      if keys is None:
+        continue
+      sig = f.signatures[i]
+      for key in keys:
+        if any(j != i and j not in removed and
+               self._Covers(f.signatures[j], sig) and
+               (j < i or not self._Covers(sig, f.signatures[j]))
+               for j in buckets.get(key, ())):
+          removed.add(i)
+          break
+    if not removed:
+      return f
+    return f.Replace(signatures=tuple(
+        sig for i, sig in enumerate(f.signatures) if i not in removed))
+
+
+class FindCommonSuperClasses(object):
+  """Find common super classes. Optionally also uses abstract base classes.
+
+  E.g., this changes
+    def f(x: list or tuple, y: frozenset or set) -> int or float
+  to
+    def f(x: Sequence, y: Set) -> Real
+  """
 
-  def _HasSubClassInSet(self, cls, known):
-    """Queries whether a subclass of a type is present in a given set."""
+  def __init__(self, superclasses=None, use_abcs=True, hierarchy=None):
+    """Create this visitor.
 
-    return any(pytd.NamedType(sub) in known
-               for sub in self._subclasses[str(cls)])
+    Args:
+      superclasses: Optionally, a dictionary mapping class names to lists of
+        superclass names, in addition to the ones of the builtins.
+      use_abcs: Whether to use abstract base classes, like "Sequence".
+      hierarchy: Optionally, a class_hierarchy.ClassHierarchy to use, instead
+        of building one from the above.
+    """
+    if hierarchy is None:
+      if superclasses:
+        hierarchy = class_hierarchy.ClassHierarchy(
+            class_hierarchy.GetSuperClasses(superclasses, use_abcs))
+      else:
+        hierarchy = class_hierarchy.GetClassHierarchy(use_abcs=use_abcs)
+    self._hierarchy = hierarchy
 
   def VisitUnionType(self, union):
     """Given a union type, try to find a simplification by using superclasses.
@@ -485,18 +764,11 @@ class FindCommonSuperClasses(object):
     Returns:
       A simplified type, if available.
     """
-    intersection = self._Expand(union.type_list[0])
-
-    for t in union.type_list[1:]:
-      intersection.intersection_update(self._Expand(t))
-
-    # Remove "redundant" superclasses, by removing everything from the tree
-    # that's not a leaf. I.e., we don't need "object" if we have more
-    # specialized types.
-    new_type_list = tuple(cls for cls in intersection
-                          if not self._HasSubClassInSet(cls, intersection))
-
-    return utils.JoinTypes(new_type_list)
+    # Of the classes all types have in common, we only keep the most
+    # specialized ones. E.g., we don't need "object" if we have "Sequence".
+    common = self._hierarchy.LeastCommonAncestors(
+        [str(t) for t in union.type_list])
+    return utils.JoinTypes(pytd.NamedType(name) for name in common)
 
 
 class CollapseLongUnions(object):
@@ -521,7 +793,7 @@ class CollapseLongUnions(object):
   def VisitUnionType(self, union):
     if len(union.type_list) > self.max_length:
       return self.generic_type
-    elif pytd.NamedType("object") in union.type_list:
+    elif pytd.NamedType("object") in union:
       return pytd.NamedType("object")
     else:
       return union
@@ -580,6 +852,38 @@ class CollapseLongReturnUnions(object):
         CollapseLongUnions(self.max_length, pytd.AnythingType())))
 
 
+class CollapseDeepGenerics(object):
+  """Replaces deeply nested generic types with ?.
+
+  This is a lossy optimization. E.g., with max_depth=2, this changes
+    def f(x: list<list<list<int>>>)
+  to
+    def f(x: list<list<?>>)
+
+  Attributes:
+    max_depth: The maximum number of generic types to allow inside each other.
+  """
+
+  def __init__(self, max_depth=4):
+    self.max_depth = max_depth
+    self._depth = 0
+
+  def EnterGenericType(self, unused_node):
+    self._depth += 1
+
+  def LeaveGenericType(self, unused_node):
+    self._depth -= 1
+
+  def VisitGenericType(self, t):
+    if self._depth > self.max_depth:
+      return pytd.AnythingType()
+    return t
+
+  EnterHomogeneousContainerType = EnterGenericType
+  LeaveHomogeneousContainerType = LeaveGenericType
+  VisitHomogeneousContainerType = VisitGenericType
+
+
 class AddInheritedMethods(object):
   """Copy methods and constants from base classes into their derived classes.
 
@@ -684,14 +988,18 @@ class RemoveInheritedMethods(object):
 
   def _FindSigAndName(self, t, sig_and_name):
     """Find a tuple(name, signature) in all methods of a type/class."""
-    if t not in self.class_to_stripped_signatures:
-      self.class_to_stripped_signatures[t] = self._StrippedSignatures(t)
-    if sig_and_name in self.class_to_stripped_signatures[t]:
-      return True
-    if isinstance(t, pytd.ClassType):
-      for base in t.cls.parents:
-        if self._FindSigAndName(base, sig_and_name):
-          return True
+    # Iterative, since chains of base classes can be long.
+    stack = [t]
+    seen = set()
+    while stack:
+      t = stack.pop()
+      if t not in self.class_to_stripped_signatures:
+        self.class_to_stripped_signatures[t] = self._StrippedSignatures(t)
+      if sig_and_name in self.class_to_stripped_signatures[t]:
+        return True
+      if isinstance(t, pytd.ClassType) and t not in seen:
+        seen.add(t)
+        stack.extend(reversed(t.cls.parents))
     return False
 
   def VisitSignature(self, sig):
@@ -907,15 +1215,18 @@ class MergeTypeParameters(TypeParameterScope):
         self.type_param_union[id(t)].update(type_params)
     return u
 
-  def _AllContaining(self, type_param, seen=None):
+  def _AllContaining(self, type_param):
     """Gets all type parameters that are in a union with the passed one."""
-    seen = seen or set()
+    # Iterative, since chains of unions (T1 or T2, T2 or T3, ...) can be long.
     result = set([type_param])
-    for other in self.type_param_union[id(type_param)]:
-      if other in seen:
-        continue  # break cycles
-      seen.add(other)
-      result.update(self._AllContaining(other, seen) or [other])
+    seen = set()
+    stack = [type_param]
+    while stack:
+      for other in self.type_param_union[id(stack.pop())]:
+        if other not in seen:  # break cycles
+          seen.add(other)
+          result.add(other)
+          stack.append(other)
     return result
 
   def _ReplaceByOuterIfNecessary(self, item, substitutions):
@@ -964,7 +1275,486 @@ OptimizeFlags = collections.namedtuple("_",
                                         "remove_mutable"])
 
 
-def Optimize(node, flags=None):
+_SECTIONS = ("constants", "functions", "classes", "modules")
+
+# Increase this if the optimizations change, to invalidate cached results.
+_CACHE_VERSION = 2
+
+
+class OptimizeBudget(collections.namedtuple(
+    "OptimizeBudget", ["seconds", "max_signatures", "max_union", "max_depth"])):
+  """Limits for optimizing a single definition. None means "no limit".
+
+  The limits are checked before every pass. A pass that has started isn't
+  interrupted.
+
+  Attributes:
+    seconds: How long to spend on the passes. After that, the remaining passes
+      are skipped.
+    max_signatures: The maximum number of signatures. If there are more, the
+      remaining passes are skipped.
+    max_union: The maximum number of types in a union. Longer unions are
+      replaced with "?".
+    max_depth: The maximum number of generic types nested inside each other.
+      Deeper ones are replaced with "?". This only limits the nesting of
+      generic types, not e.g. chains of base classes or of type parameters, so
+      it doesn't guarantee that the passes stay within the recursion limit.
+  """
+  __slots__ = ()
+
+  def __new__(cls, seconds=None, max_signatures=None, max_union=None,
+              max_depth=None):
+    return super(OptimizeBudget, cls).__new__(
+        cls, seconds, max_signatures, max_union, max_depth)
+
+
+# Records that a definition exceeded the limit (a field name of OptimizeBudget)
+# before the pass with the given name.
+BudgetEvent = collections.namedtuple(
+    "BudgetEvent", ["definition", "limit", "pass_name"])
+
+
+PassStats = collections.namedtuple(
+    "PassStats", ["name", "iterations", "seconds",
+                  "nodes_before", "nodes_after",
+                  "signatures_before", "signatures_after",
+                  "max_union_before", "max_union_after"])
+
+
+def _TreeSize(node):
+  """Count the nodes and signatures of a tree, and find its widest union.
+
+  Args:
+    node: A pytd node.
+
+  Returns:
+    A tuple (number of nodes, number of signatures, maximum union width,
+    maximum number of generic types nested inside each other).
+  """
+  nodes = signatures = max_union = max_depth = 0
+  stack = [(node, 0)]
+  while stack:
+    n, depth = stack.pop()
+    if isinstance(n, tuple):
+      if hasattr(n, "_fields"):
+        nodes += 1
+        if isinstance(n, pytd.Signature):
+          signatures += 1
+        elif isinstance(n, pytd.UnionType):
+          max_union = max(max_union, len(n.type_list))
+        elif isinstance(n, pytd.GenericType):
+          depth += 1
+          max_depth = max(max_depth, depth)
+        elif isinstance(n, pytd.ClassType):
+          continue  # Don't follow the pointer to the class.
+      stack.extend((child, depth) for child in n)
+    elif isinstance(n, list):
+      stack.extend((child, depth) for child in n)
+  return nodes, signatures, max_union, max_depth
+
+
+def _Unchanged(old, new):
+  """Whether a pass left a tree unchanged, for running it to a fixpoint."""
+  if old is new:
+    return True
+  elif isinstance(old, pytd.TypeDeclUnit):
+    # TypeDeclUnit compares by identity.
+    return (isinstance(new, pytd.TypeDeclUnit) and
+            (old.name, old.constants, old.functions, old.classes) ==
+            (new.name, new.constants, new.functions, new.classes) and
+            len(old.modules) == len(new.modules) and
+            all(_Unchanged(m1, m2) for m1, m2 in zip(old.modules, new.modules)))
+  else:
+    return old == new
+
+
+class _Pass(object):
+  """A pass of an OptimizationPipeline."""
+
+  def __init__(self, name, function, enabled, fixpoint):
+    self.name = name
+    self.function = function
+    self.enabled = enabled
+    self.fixpoint = fixpoint
+
+
+class OptimizationPipeline(object):
+  """A configurable sequence of passes over a pytd tree.
+
+  A pass is a function that takes a node and returns a new node. Passes have
+  unique names, by which they can be enabled, disabled or removed. A pass can
+  also be repeated until it doesn't change the tree anymore. Run() records
+  statistics for every pass.
+
+  Example:
+    pipeline = CreatePipeline(flags)
+    pipeline.Disable("Factorize")
+    unit = pipeline.Run(unit, measure=True)
+    print pipeline.FormatReport()
+
+  Attributes:
+    stats: A list of PassStats, one for every pass the last Run() executed.
+    budget_events: A list of (limit, pass name) tuples, for every time the
+      last Run() exceeded a limit of its OptimizeBudget. See BudgetEvent.
+  """
+
+  # Stop repeating a pass after this many iterations, even if it still changes
+  # the tree.
+  MAX_ITERATIONS = 10
+
+  def __init__(self):
+    self._passes = []
+    self.stats = []
+    self.budget_events = []
+
+  def _Index(self, name):
+    for i, p in enumerate(self._passes):
+      if p.name == name:
+        return i
+    raise KeyError(name)
+
+  def Add(self, name, function, enabled=True, fixpoint=False, before=None,
+          after=None):
+    """Add a pass.
+
+    Args:
+      name: A name for the pass. Must be unique within this pipeline.
+      function: A function that takes a node and returns a new node. Use
+        VisitorPass() to make one from a visitor class.
+      enabled: Whether Run() should run this pass.
+      fixpoint: Whether Run() should repeat this pass until the tree doesn't
+        change anymore.
+      before: Optionally, the name of the pass to insert this pass in front of.
+      after: Optionally, the name of the pass to insert this pass after.
+        Without before or after, the pass is added at the end.
+
+    Raises:
+      ValueError: If there's already a pass with this name.
+      KeyError: If the pass given as before or after doesn't exist.
+    """
+    if name in self.Names():
+      raise ValueError("Duplicate pass %r" % name)
+    if before is not None:
+      index = self._Index(before)
+    elif after is not None:
+      index = self._Index(after) + 1
+    else:
+      index = len(self._passes)
+    self._passes.insert(index, _Pass(name, function, enabled, fixpoint))
+
+  def Remove(self, name):
+    del self._passes[self._Index(name)]
+
+  def Enable(self, name, enabled=True):
+    self._passes[self._Index(name)].enabled = enabled
+
+  def Disable(self, name):
+    self.Enable(name, False)
+
+  def SetFixpoint(self, name, fixpoint=True):
+    self._passes[self._Index(name)].fixpoint = fixpoint
+
+  def Names(self, enabled_only=False):
+    """Return the names of the passes, in the order they run in."""
+    return [p.name for p in self._passes if p.enabled or not enabled_only]
+
+  def _ApplyBudget(self, node, budget, pass_name, start):
+    """Check the limits of an OptimizeBudget before running a pass.
+
+    Args:
+      node: The current pytd node.
+      budget: An OptimizeBudget.
+      pass_name: The name of the pass that is about to run.
+      start: When Run() started.
+
+    Returns:
+      A tuple (node, stop). "node" might have been simplified to fit the
+      budget. If "stop" is True, the remaining passes should be skipped.
+    """
+    if budget.seconds is not None and time.time() - start > budget.seconds:
+      self.budget_events.append(("seconds", pass_name))
+      return node, True
+    if (budget.max_signatures, budget.max_union, budget.max_depth) == (
+        None, None, None):
+      return node, False
+    _, signatures, max_union, max_depth = _TreeSize(node)
+    if budget.max_signatures is not None and signatures > budget.max_signatures:
+      self.budget_events.append(("max_signatures", pass_name))
+      return node, True
+    if budget.max_union is not None and max_union > budget.max_union:
+      self.budget_events.append(("max_union", pass_name))
+      node = node.Visit(CollapseLongUnions(budget.max_union,
+                                           pytd.AnythingType()))
+    if budget.max_depth is not None and max_depth > budget.max_depth:
+      self.budget_events.append(("max_depth", pass_name))
+      node = node.Visit(CollapseDeepGenerics(budget.max_depth))
+    return node, False
+
+  def Run(self, node, measure=False, budget=None):
+    """Run all enabled passes, in order.
+
+    Args:
+      node: The pytd node to process.
+      measure: Whether to also record the sizes of the trees before and after
+        each pass, in self.stats. That takes an extra traversal of the tree per
+        pass. The run time is always recorded.
+      budget: Optionally, an OptimizeBudget for node. What happens when node
+        exceeds it is recorded in self.budget_events.
+
+    Returns:
+      The new node.
+    """
+    self.stats = []
+    self.budget_events = []
+    run_start = time.time()
+    size = _TreeSize(node) if measure else (None, None, None)
+    for p in self._passes:
+      if not p.enabled:
+        continue
+      if budget is not None:
+        node, stop = self._ApplyBudget(node, budget, p.name, run_start)
+        if stop:
+          break
+      start = time.time()
+      iterations = 0
+      while True:
+        iterations += 1
+        new_node = p.function(node)
+        done = (not p.fixpoint or iterations >= self.MAX_ITERATIONS or
+                _Unchanged(node, new_node))
+        node = new_node
+        if done:
+          break
+      seconds = time.time() - start
+      new_size = _TreeSize(node) if measure else (None, None, None)
+      self.stats.append(PassStats(p.name, iterations, seconds,
+                                  size[0], new_size[0], size[1], new_size[1],
+                                  size[2], new_size[2]))
+      size = new_size
+    return node
+
+  def Report(self):
+    """Return the statistics of the last Run(), as a list of dictionaries."""
+    return [dict(stats._asdict()) for stats in self.stats]
+
+  def FormatReport(self):
+    """Return the statistics of the last Run(), as a human-readable table."""
+    lines = ["%-30s %5s %9s %15s %15s %9s" % (
+        "pass", "iter", "seconds", "nodes", "signatures", "max union")]
+    for stats in self.stats:
+      lines.append("%-30s %5d %9.3f %15s %15s %9s" % (
+          stats.name, stats.iterations, stats.seconds,
+          "%s->%s" % (stats.nodes_before, stats.nodes_after),
+          "%s->%s" % (stats.signatures_before, stats.signatures_after),
+          "%s->%s" % (stats.max_union_before, stats.max_union_after)))
+    lines.append("%-30s %5s %9.3f" % (
+        "total", "", sum(stats.seconds for stats in self.stats)))
+    return "\n".join(lines)
+
+
+def VisitorPass(visitor_class, *args, **kwargs):
+  """Make a pass for an OptimizationPipeline, from a visitor class.
+
+  Args:
+    visitor_class: The visitor class. A new instance is created for every run
+      of the pass.
+    *args: Passed to the constructor of visitor_class.
+    **kwargs: Passed to the constructor of visitor_class.
+
+  Returns:
+    A function that takes a node and returns a new node.
+  """
+  return lambda node: node.Visit(visitor_class(*args, **kwargs))
+
+
+def _AddLocalPasses(pipeline, flags, hierarchy=None):
+  """Add the passes of Optimize() that only look at one definition at a time.
+
+  Passes that flags don't ask for are added, too, but are disabled.
+
+  Args:
+    pipeline: An OptimizationPipeline.
+    flags: See Optimize().
+    hierarchy: The class_hierarchy.ClassHierarchy for FindCommonSuperClasses
+      and RemoveSubsumedSignatures. If None, the one of the tree being
+      processed (if it's a TypeDeclUnit) or of the builtins is used.
+  """
+  lossy = bool(flags and flags.lossy)
+  use_abcs = bool(flags and flags.use_abcs)
+  max_union = flags and flags.max_union
+  remove_mutable = bool(flags and flags.remove_mutable)
+
+  def GetHierarchy(node):
+    if hierarchy is not None:
+      return hierarchy
+    elif isinstance(node, pytd.TypeDeclUnit):
+      return class_hierarchy.GetClassHierarchy(node, use_abcs)
+    else:
+      return class_hierarchy.GetClassHierarchy(use_abcs=use_abcs)
+
+  def RemoveSubsumedSignaturesPass(node):
+    return node.Visit(RemoveSubsumedSignatures(
+        narrower_returns=lossy, hierarchy=GetHierarchy(node)))
+
+  def FindCommonSuperClassesPass(node):
+    return node.Visit(FindCommonSuperClasses(hierarchy=GetHierarchy(node)))
+
+  pipeline.Add("RemoveDuplicates", VisitorPass(RemoveDuplicates))
+  pipeline.Add("CombineReturnsAndExceptions",
+               VisitorPass(CombineReturnsAndExceptions))
+  pipeline.Add("Factorize", VisitorPass(Factorize))
+  pipeline.Add("ApplyOptionalArguments", VisitorPass(ApplyOptionalArguments))
+  pipeline.Add("RemoveSubsumedSignatures", RemoveSubsumedSignaturesPass,
+               enabled=lossy)
+  pipeline.Add("CombineContainers", VisitorPass(CombineContainers))
+  pipeline.Add("FindCommonSuperClasses", FindCommonSuperClassesPass,
+               enabled=lossy)
+  pipeline.Add("CollapseLongParameterUnions",
+               VisitorPass(CollapseLongParameterUnions, max_union or 4),
+               enabled=bool(max_union))
+  pipeline.Add("CollapseLongReturnUnions",
+               VisitorPass(CollapseLongReturnUnions, max_union or 8),
+               enabled=bool(max_union))
+  pipeline.Add("AbsorbMutableParameters", VisitorPass(AbsorbMutableParameters),
+               enabled=remove_mutable)
+  pipeline.Add("CombineAbsorbedContainers", VisitorPass(CombineContainers),
+               enabled=remove_mutable)
+  pipeline.Add("MergeTypeParameters", VisitorPass(MergeTypeParameters),
+               enabled=remove_mutable)
+  pipeline.Add("AdjustSelf", VisitorPass(visitors.AdjustSelf, force=True),
+               enabled=remove_mutable)
+
+
+def _AddCrossDefinitionPasses(pipeline):
+  """Add the passes of Optimize() that look at the whole tree."""
+  pipeline.Add("LookupClasses", lambda node: visitors.LookupClasses(
+      node, builtins.GetBuiltins()))
+  pipeline.Add("RemoveInheritedMethods", VisitorPass(RemoveInheritedMethods))
+
+
+def CreatePipeline(flags=None):
+  """Create an OptimizationPipeline with the passes of Optimize().
+
+  Args:
+    flags: See Optimize(). Passes that these don't ask for are in the pipeline,
+      but disabled.
+
+  Returns:
+    An OptimizationPipeline.
+  """
+  pipeline = OptimizationPipeline()
+  _AddLocalPasses(pipeline, flags)
+  _AddCrossDefinitionPasses(pipeline)
+  return pipeline
+
+
+def _OptimizeLocally(node, flags, hierarchy=None):
+  """Apply the optimizations of Optimize() that only look at node itself.
+
+  Args:
+    node: A pytd node, e.g. a TypeDeclUnit, or one of its definitions.
+    flags: See Optimize().
+    hierarchy: The class_hierarchy.ClassHierarchy that FindCommonSuperClasses
+      and RemoveSubsumedSignatures use if flags.lossy is set. If None, the one
+      of node (if it's a TypeDeclUnit) or of the builtins is used.
+
+  Returns:
+    A new node, with unresolved types.
+  """
+  pipeline = OptimizationPipeline()
+  _AddLocalPasses(pipeline, flags, hierarchy)
+  return pipeline.Run(node)
+
+
+def _OptimizeChunk(args):
+  """Run _OptimizeLocally() on a list of definitions, e.g. in a worker process.
+
+  Args:
+    args: A tuple (definitions, flags, hierarchy, budget). flags is an
+      OptimizeFlags converted to a plain tuple, since OptimizeFlags can't be
+      pickled (its class is called "_"). budget is an OptimizeBudget, or None.
+
+  Returns:
+    A list of tuples (optimized definition, seconds it took, budget events),
+    where "budget events" is a list of (limit, pass name) tuples.
+  """
+  definitions, flags, hierarchy, budget = args
+  pipeline = OptimizationPipeline()
+  _AddLocalPasses(pipeline, flags and OptimizeFlags(*flags), hierarchy)
+  results = []
+  for item in definitions:
+    start = time.time()
+    item = pipeline.Run(item, budget=budget)
+    results.append((item, time.time() - start, pipeline.budget_events))
+  return results
+
+
+def _OptimizeDefinitions(unit, flags, jobs=1, cache=None, budget=None,
+                         budget_events=None):
+  """Like _OptimizeLocally(unit, flags), but per top-level definition.
+
+  Args:
+    unit: A pytd.TypeDeclUnit.
+    flags: See Optimize().
+    jobs: The number of worker processes to use.
+    cache: Optionally, a result_cache.ResultCache for the optimized version of
+      each definition.
+    budget: Optionally, an OptimizeBudget for each definition.
+    budget_events: Optionally, a list to append BudgetEvent tuples to.
+
+  Returns:
+    A new pytd.TypeDeclUnit.
+  """
+  hierarchy = None
+  if flags and flags.lossy:
+    # Computed once, here, instead of in every worker.
+    hierarchy = class_hierarchy.GetClassHierarchy(unit, flags.use_abcs)
+  definitions = [item for section in _SECTIONS
+                 for item in getattr(unit, section)]
+  results = [None] * len(definitions)
+  if cache is not None:
+    # Everything that can change the result, other than the definition itself.
+    prefix = repr((_CACHE_VERSION, flags and tuple(flags),
+                   budget and tuple(budget), builtins.GetBuiltinsVersion(),
+                   hierarchy and pytd.Fingerprint(
+                       class_hierarchy.GetSuperClassesByName(unit))))
+    memo = {}
+    keys = [hashlib.sha1(prefix + pytd.Fingerprint(item, memo)).hexdigest()
+            for item in definitions]
+    results = [cache.Get(key) for key in keys]
+  todo = [i for i, result in enumerate(results) if result is None]
+  flags_tuple = flags and tuple(flags)
+  if jobs > 1 and len(todo) > 1:
+    # A few chunks per worker, so that they finish at about the same time.
+    size = max(1, len(todo) // (4 * jobs))
+    chunks = [([definitions[i] for i in todo[j:j + size]], flags_tuple,
+               hierarchy, budget) for j in range(0, len(todo), size)]
+    pool = multiprocessing.Pool(jobs)
+    try:
+      chunk_results = pool.map(_OptimizeChunk, chunks)
+    finally:
+      pool.terminate()
+  else:
+    chunk_results = [_OptimizeChunk(
+        ([definitions[i] for i in todo], flags_tuple, hierarchy, budget))]
+  for i, (result, seconds, events) in zip(
+      todo, itertools.chain.from_iterable(chunk_results)):
+    results[i] = result
+    for limit, pass_name in events:
+      log.info("%s exceeded %s before %s", result.name, limit, pass_name)
+      if budget_events is not None:
+        budget_events.append(BudgetEvent(result.name, limit, pass_name))
+    # Running out of time depends on the machine, so don't remember that.
+    if cache is not None and all(limit != "seconds" for limit, _ in events):
+      cache.Put(keys[i], result, seconds)
+  results = iter(results)
+  return unit.Replace(**{
+      section: tuple(itertools.islice(results, len(getattr(unit, section))))
+      for section in _SECTIONS})
+
+
+def Optimize(node, flags=None, jobs=1, cache=None, budget=None,
+             budget_events=None):
   """Optimize a PYTD tree.
 
   Tries to shrink a PYTD tree by applying various optimizations.
@@ -974,29 +1764,295 @@ def Optimize(node, flags=None):
         return a new node.
     flags: An instance of OptimizeFlags, to control which optimizations
         happen and what parameters to use for the ones that take parameters. Can
-        be None, in which case defaults will be applied.
+        be None, in which case defaults will be applied. See CreatePipeline(),
+        for finer control.
+    jobs: How many processes to use. If this is more than one, and node is a
+        TypeDeclUnit, the optimizations that only look at one definition at a
+        time run in worker processes, on chunks of the top-level definitions.
+        Resolving the classes, and RemoveInheritedMethods, happen in this
+        process. The result is the same.
+    cache: Optionally, a result_cache.ResultCache. If node is a TypeDeclUnit,
+        the results of those same optimizations are stored in it, for every
+        top-level definition, and reused by later calls. The cache key is the
+        fingerprint of the definition, the flags, the budget, the version of
+        the builtins and (for flags.lossy) the class hierarchy. Results that
+        ran out of time aren't stored.
+    budget: Optionally, an OptimizeBudget. If node is a TypeDeclUnit, it
+        applies to each top-level definition, for the same optimizations.
+        Definitions that exceed it are optimized less, or simplified.
+    budget_events: Optionally, a list. For every time a definition exceeds the
+        budget, a BudgetEvent is appended to it.
 
   Returns:
     An optimized node.
   """
-  node = node.Visit(RemoveDuplicates())
-  node = node.Visit(CombineReturnsAndExceptions())
-  node = node.Visit(Factorize())
-  node = node.Visit(ApplyOptionalArguments())
-  node = node.Visit(CombineContainers())
-  if flags and flags.lossy:
-    hierarchy = node.Visit(visitors.ExtractSuperClassesByName())
-    node = node.Visit(
-        FindCommonSuperClasses(hierarchy, flags and flags.use_abcs)
-    )
-  if flags and flags.max_union:
-    node = node.Visit(CollapseLongParameterUnions(flags.max_union))
-    node = node.Visit(CollapseLongReturnUnions(flags.max_union))
-  if flags and flags.remove_mutable:
-    node = node.Visit(AbsorbMutableParameters())
-    node = node.Visit(CombineContainers())
-    node = node.Visit(MergeTypeParameters())
-    node = node.Visit(visitors.AdjustSelf(force=True))
-  node = visitors.LookupClasses(node, builtins.GetBuiltins())
-  node = node.Visit(RemoveInheritedMethods())
-  return node
+  if ((jobs > 1 or cache is not None or budget is not None) and
+      isinstance(node, pytd.TypeDeclUnit)):
+    node = _OptimizeDefinitions(node, flags, jobs, cache, budget,
+                                budget_events)
+    pipeline = OptimizationPipeline()
+    _AddCrossDefinitionPasses(pipeline)
+  elif budget is not None:
+    pipeline = OptimizationPipeline()
+    _AddLocalPasses(pipeline, flags)
+    node = pipeline.Run(node, budget=budget)
+    if budget_events is not None:
+      budget_events.extend(BudgetEvent(getattr(node, "name", None), limit,
+                                       pass_name)
+                           for limit, pass_name in pipeline.budget_events)
+    pipeline = OptimizationPipeline()
+    _AddCrossDefinitionPasses(pipeline)
+  else:
+    pipeline = CreatePipeline(flags)
+  return pipeline.Run(node)
+
+
+class _Scope(object):
+  """Looks up a name in several modules, in order."""
+
+  def __init__(self, *modules):
+    self.modules = modules
+
+  def Lookup(self, name):
+    for module in self.modules:
+      try:
+        return module.Lookup(name)
+      except KeyError:
+        pass
+    raise KeyError(name)
+
+
+class _CollectReferencedNames(object):
+  """Visitor for collecting the top-level names that ClassType nodes use."""
+
+  def __init__(self):
+    self.names = set()
+
+  def VisitClassType(self, t):
+    self.names.add(t.name.split(".")[0])
+
+
+class Optimizer(object):
+  """Optimizes successive versions of a module, reusing earlier results.
+
+  Update() returns the same tree as Optimize() would. But it remembers the
+  optimized version of every top-level constant, function, class and submodule,
+  keyed by its contents, and only redoes the ones that changed, or that depend
+  on ones that changed: A class is redone if one of its ancestors in the module
+  changed, since RemoveInheritedMethods looks at those, and if flags.lossy is
+  set, everything is redone once the class hierarchy changes, since
+  FindCommonSuperClasses and RemoveSubsumedSignatures use that.
+
+  The ClassType nodes of the results refer to their classes by name, through a
+  pytd.ResolutionContext, so that unchanged definitions don't need to be
+  resolved again. They resolve to the classes of the latest result. Keep the
+  Optimizer alive while you use them.
+
+  Attributes:
+    optimized: How many definitions the last Update() had to process.
+    reused: How many definitions the last Update() took from earlier results.
+  """
+
+  def __init__(self, flags=None):
+    self.flags = flags
+    self._builtins = builtins.GetBuiltins()
+    self._context = pytd.ResolutionContext()
+    self._module_contexts = {}  # submodule name -> pytd.ResolutionContext
+    self._superclasses = None
+    self._hierarchy = None
+    self._names = frozenset()  # names defined by the last module
+    self._local = {}  # fingerprint -> locally optimized definition
+    self._resolved = {}  # id(local) -> (local, resolved, referenced names)
+    self._final = {}  # name -> (resolved, final)
+    self.optimized = 0
+    self.reused = 0
+
+  def _OptimizeDefinitions(self, unit):
+    """Run _OptimizeLocally() on every definition we haven't seen yet."""
+    flags = self.flags
+    if flags and flags.lossy:
+      superclasses = class_hierarchy.GetSuperClassesByName(unit)
+      if superclasses != self._superclasses:
+        self._superclasses = superclasses
+        self._hierarchy = class_hierarchy.ClassHierarchy(
+            class_hierarchy.GetSuperClasses(superclasses, flags.use_abcs))
+        self._local = {}
+    local = {}
+    sections = {}
+    memo = {}
+    for section in _SECTIONS:
+      new_items = []
+      for item in getattr(unit, section):
+        # Not keyed by the item itself: Definitions that only differ in the
+        # order of a union compare equal, but optimize to different trees.
+        key = pytd.Fingerprint(item, memo)
+        new_item = self._local.get(key)
+        if new_item is None:
+          new_item = _OptimizeLocally(item, flags, self._hierarchy)
+        local[key] = new_item
+        new_items.append(new_item)
+      sections[section] = tuple(new_items)
+    self._local = local
+    return unit.Replace(**sections)
+
+  def _Resolve(self, unit, changed_names):
+    """Resolve the definitions that are new, or use a name that changed."""
+    resolver = visitors.Resolver(_Scope(unit, self._builtins))
+    module_scope = _Scope(self._builtins, unit)
+    resolved = {}
+    sections = {}
+    for section in _SECTIONS:
+      new_items = []
+      for item in getattr(unit, section):
+        entry = self._resolved.get(id(item))
+        if entry is None or entry[2] & changed_names:
+          if section == "modules":
+            context = self._module_contexts.setdefault(
+                item.name, pytd.ResolutionContext())
+            new_item = visitors.Resolver(module_scope).Resolve(
+                item, context=context)
+          else:
+            new_item = resolver.Resolve(item, context=self._context)
+          collector = _CollectReferencedNames()
+          new_item.Visit(collector)
+          entry = (item, new_item, collector.names)
+        resolved[id(item)] = entry
+        new_items.append(entry[1])
+      sections[section] = tuple(new_items)
+    self._resolved = resolved
+    return unit.Replace(**sections)
+
+  def _Bind(self, unit):
+    """Make the ClassType nodes refer to the classes of the given module."""
+    self._context.Bind(None, _Scope(unit, self._builtins))
+    module_scope = _Scope(self._builtins, unit)
+    contexts = {}
+    for module in unit.modules:
+      contexts[module.name] = self._module_contexts[module.name]
+      contexts[module.name].Bind(module, module_scope)
+    self._module_contexts = contexts
+
+  def Update(self, unit):
+    """Optimize a new version of the module.
+
+    Args:
+      unit: A pytd.TypeDeclUnit.
+
+    Returns:
+      The optimized pytd.TypeDeclUnit. This is equal to Optimize(unit, flags).
+
+    Raises:
+      visitors.UnresolvedNameError: If we can't find a class.
+    """
+    names = frozenset(item.name for section in _SECTIONS
+                      for item in getattr(unit, section))
+    old_modules = {id(entry[0]) for entry in self._resolved.values()}
+    local_unit = self._OptimizeDefinitions(unit)
+    # Definitions that use a name that doesn't exist anymore need to be
+    # resolved again, to report it. Names in submodules might be gone, too.
+    changed_names = (self._names - names) | {
+        module.name for module in local_unit.modules
+        if id(module) not in old_modules}
+    resolved_unit = self._Resolve(local_unit, changed_names)
+    # Classes inherit from their ancestors in RemoveInheritedMethods.
+    changed_classes = changed_names | {
+        item.name for section in _SECTIONS
+        for item in getattr(resolved_unit, section)
+        if self._final.get(item.name, (None,))[0] is not item}
+    hierarchy = class_hierarchy.ClassHierarchy(
+        class_hierarchy.GetSuperClassesByName(
+            resolved_unit.Replace(modules=())))
+    affected = set()
+    for name in changed_classes:
+      affected.update(hierarchy.GetDescendants(name))
+    self._Bind(resolved_unit)
+    remove_inherited_methods = RemoveInheritedMethods()
+    final = {}
+    sections = {}
+    self.optimized = self.reused = 0
+    for section in _SECTIONS:
+      new_items = []
+      for item in getattr(resolved_unit, section):
+        entry = self._final.get(item.name)
+        if (entry is None or entry[0] is not item or item.name in affected or
+            section == "modules" and changed_classes):
+          entry = (item, item.Visit(remove_inherited_methods))
+          self.optimized += 1
+        else:
+          self.reused += 1
+        final[item.name] = entry
+        if entry[1] is not None:
+          new_items.append(entry[1])
+      sections[section] = tuple(new_items)
+    self._final = final
+    self._names = names
+    result = unit.Replace(**sections)
+    self._Bind(result)
+    visitors.MarkResolved(result)
+    return result
+
+
+def main(argv=None):
+  """Optimize a .pytd file, and print the result."""
+  argument_parser = argparse.ArgumentParser(
+      description="Optimize a .pytd file.")
+  argument_parser.add_argument("input", metavar="FILE", help="a .pytd file")
+  argument_parser.add_argument(
+      "-o", "--output", default=None,
+      help="Where to write the optimized .pytd file. Default: stdout")
+  argument_parser.add_argument(
+      "--lossy", action="store_true",
+      help="Replace unions of classes by their common superclasses")
+  argument_parser.add_argument(
+      "--use-abcs", action="store_true",
+      help="With --lossy, also use abstract base classes like Sequence")
+  argument_parser.add_argument(
+      "--max-union", type=int, default=0,
+      help="Replace unions with more types than this by \"?\" (or object)")
+  argument_parser.add_argument(
+      "--remove-mutable", action="store_true",
+      help="Turn mutable parameters into unions")
+  argument_parser.add_argument(
+      "--enable", action="append", default=[], metavar="PASS",
+      help="Run this pass, even if the other flags don't ask for it")
+  argument_parser.add_argument(
+      "--disable", action="append", default=[], metavar="PASS",
+      help="Don't run this pass")
+  argument_parser.add_argument(
+      "--fixpoint", action="append", default=[], metavar="PASS",
+      help="Repeat this pass until it doesn't change anything anymore")
+  argument_parser.add_argument(
+      "--stats", action="store_true",
+      help="Print the run time of every pass, and the size of the tree after "
+      "it, to stderr")
+  args = argument_parser.parse_args(argv)
+
+  pipeline = CreatePipeline(OptimizeFlags(
+      lossy=args.lossy, use_abcs=args.use_abcs, max_union=args.max_union,
+      remove_mutable=args.remove_mutable))
+  try:
+    for name in args.enable:
+      pipeline.Enable(name)
+    for name in args.disable:
+      pipeline.Disable(name)
+    for name in args.fixpoint:
+      pipeline.SetFixpoint(name)
+  except KeyError as e:
+    argument_parser.error("Unknown pass %s. Choose from: %s" % (
+        e, ", ".join(pipeline.Names())))
+
+  with open(args.input) as fi:
+    unit = parser.TypeDeclParser().Parse(fi.read(), filename=args.input)
+  unit = pipeline.Run(unit, measure=args.stats)
+  if args.output:
+    with open(args.output, "w") as fi:
+      fi.write(pytd.Print(unit) + "\n")
+  else:
+    print pytd.Print(unit)
+  if args.stats:
+    print >>sys.stderr, pipeline.FormatReport()
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
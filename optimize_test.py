@@ -14,10 +14,17 @@
 # limitations under the License.
 
 
+import os
+import shutil
+import StringIO
+import sys
+import tempfile
 import textwrap
+import time
 import unittest
 from pytypedecl import optimize
 from pytypedecl import pytd
+from pytypedecl import result_cache
 from pytypedecl.parse import parser_test
 from pytypedecl.parse import builtins
 from pytypedecl.parse import visitors
@@ -165,6 +172,25 @@ class TestOptimize(parser_test.ParserTest):
         self.ApplyVisitorToString(src, optimize.ExpandSignatures()),
         new_src)
 
+  def testExpandSignature(self):
+    sig = self.Parse(textwrap.dedent("""
+        def foo(a: int or float or str, b: int or float or str,
+                c: int or float or str) -> file
+    """)).Lookup("foo").signatures[0]
+    signatures = optimize.ExpandSignature(sig)
+    self.assertEquals(["int", "int", "int"],
+                      [p.type.name for p in next(signatures).params])
+    self.assertEquals(["int", "int", "float"],
+                      [p.type.name for p in next(signatures).params])
+    self.assertEquals(27, len(list(optimize.ExpandSignature(sig, 27))))
+    self.assertRaises(optimize.ExpansionLimitError,
+                      list, optimize.ExpandSignature(sig, 26))
+    partial = list(optimize.ExpandSignature(sig, 10, keep_unions=True))
+    self.assertEquals(9, len(partial))
+    self.assertTrue(all(s.params[2] == sig.params[2] for s in partial))
+    self.assertRaises(optimize.ExpansionLimitError, sig.Visit,
+                      optimize.ExpandSignatures(max_signatures=26))
+
   def testFactorize(self):
     src = textwrap.dedent("""
         def foo(a: int) -> file
@@ -205,6 +231,29 @@ class TestOptimize(parser_test.ParserTest):
     self.AssertSourceEquals(
         self.ApplyVisitorToString(src, optimize.Factorize()), new_src)
 
+  def testFactorizeBetterThanGreedy(self):
+    src = textwrap.dedent("""
+        def foo(a: int, b: int) -> file
+        def foo(a: int, b: str) -> file
+        def foo(a: float, b: int) -> file
+        def foo(a: float, b: float) -> file
+    """)
+    greedy_src = textwrap.dedent("""
+        def foo(a: int or float, b: int) -> file
+        def foo(a: int, b: str) -> file
+        def foo(a: float, b: float) -> file
+    """)
+    new_src = textwrap.dedent("""
+        def foo(a: int, b: int or str) -> file
+        def foo(a: float, b: int or float) -> file
+    """)
+    self.AssertSourceEquals(
+        self.ApplyVisitorToString(src, optimize.Factorize()), new_src)
+    # Without a budget for searching, we get the greedy factorization.
+    self.AssertSourceEquals(
+        self.ApplyVisitorToString(src, optimize.Factorize(budget=0)),
+        greedy_src)
+
   def testOptionalArguments(self):
     src = textwrap.dedent("""
         def foo(a: A, ...) -> Z
@@ -220,6 +269,41 @@ class TestOptimize(parser_test.ParserTest):
     new_src = self.ApplyVisitorToString(src, optimize.ApplyOptionalArguments())
     self.AssertSourceEquals(new_src, expected)
 
+  def testRemoveSubsumedSignatures(self):
+    src = textwrap.dedent("""
+        def f(x: bool, y: int) -> str
+        def f(x: int or float, y: int) -> str
+        def f(x: bool, y: ?) -> str
+        def f(x: bool, z: int) -> str
+        def f(x: list<bool>, y: int) -> str:
+            x := list<int>
+        def f(x: list<bool>, y: int) -> str
+        def g(self, x: int or float) -> int
+        def g(self, x: float or int) -> int
+        def g(self, x: bool) -> int
+        def h(x: bool) -> bool
+        def h(x: int) -> int
+    """)
+    new_src = textwrap.dedent("""
+        def f(x: int or float, y: int) -> str
+        def f(x: bool, y: ?) -> str
+        def f(x: bool, z: int) -> str
+        def f(x: list<bool>, y: int) -> str:
+            x := list<int>
+        def f(x: list<bool>, y: int) -> str
+        def g(self, x: int or float) -> int
+        def h(x: bool) -> bool
+        def h(x: int) -> int
+    """)
+    self.AssertSourceEquals(
+        self.ApplyVisitorToString(src, optimize.RemoveSubsumedSignatures()),
+        new_src)
+    lossy_src = new_src.replace("def h(x: bool) -> bool\n", "")
+    self.AssertSourceEquals(
+        self.ApplyVisitorToString(
+            src, optimize.RemoveSubsumedSignatures(narrower_returns=True)),
+        lossy_src)
+
   def testABCSuperClasses(self):
     src = textwrap.dedent("""
         def f(x: list or tuple, y: frozenset or set) -> int or float
@@ -415,6 +499,34 @@ class TestOptimize(parser_test.ParserTest):
     ast = visitors.LookupClasses(ast, builtins.GetBuiltins())
     ast = ast.Visit(optimize.RemoveInheritedMethods())
     self.AssertSourceEquals(ast, expected)
+    # Same thing, with types that refer to their classes by symbol ID.
+    context = pytd.ResolutionContext()
+    ast = self.Parse(src)
+    ast = visitors.LookupClasses(ast, builtins.GetBuiltins(), context=context)
+    ast = ast.Visit(optimize.RemoveInheritedMethods())
+    self.AssertSourceEquals(ast, expected)
+
+  def testRemoveInheritedMethodsDeepHierarchy(self):
+    # A chain of classes that's longer than the recursion limit.
+    n = 1500
+    src = ["class int(nothing):\n    pass\n"
+           "class C0(nothing):\n    def f(self) -> int\n"]
+    src += ["class C%d(C%d):\n    pass\n" % (i, i - 1) for i in range(1, n)]
+    src.append("class D(C%d):\n    def f(self) -> int\n"
+               "    def g(self) -> int\n" % (n - 1))
+    ast = visitors.LookupClasses(self.Parse("".join(src)))
+    ast = ast.Visit(optimize.RemoveInheritedMethods())
+    self.assertEquals(["g"], [m.name for m in ast.Lookup("D").methods])
+
+  def testOptimizeKeepsMethodsOfBuiltinBases(self):
+    src = textwrap.dedent("""
+        class B(int):
+            def __abs__(self) -> int
+            def bit_length(self) -> int
+    """)
+    ast = self.Parse(src)
+    self.AssertSourceEquals(optimize.Optimize(ast), src)
+    self.AssertSourceEquals(optimize.Optimizer().Update(ast), src)
 
   def testAbsorbMutableParameters(self):
     src = textwrap.dedent("""
@@ -479,5 +591,237 @@ class TestOptimize(parser_test.ParserTest):
     new_tree = tree.Visit(optimize.MergeTypeParameters())
     self.AssertSourceEquals(new_tree, expected)
 
+  def testMergeTypeParametersLongChain(self):
+    # Longer than the recursion limit: T0 or T1, T1 or T2, ...
+    n = 1100
+    src = "class A<S>:\n    def f<%s>(self, x: S or T0, %s) -> ?\n" % (
+        ", ".join("T%d" % i for i in range(n)),
+        ", ".join("x%d: T%d or T%d" % (i, i, i + 1) for i in range(n - 1)))
+    new_tree = self.Parse(src).Visit(optimize.MergeTypeParameters())
+    sig = new_tree.Lookup("A").Lookup("f").signatures[0]
+    self.assertEquals((), sig.template)
+    self.assertEquals(set(["S"]), {pytd.Print(p.type) for p in sig.params[1:]})
+
+  def testPipeline(self):
+    src = textwrap.dedent("""
+        def f(x: int) -> int or float or str
+        def f(x: float) -> int or float or str
+    """)
+    tree = self.Parse(src)
+    pipeline = optimize.CreatePipeline()
+    self.AssertSourceEquals(optimize.Optimize(tree), pipeline.Run(tree))
+    self.assertEquals(pipeline.Names(enabled_only=True),
+                      [stats.name for stats in pipeline.stats])
+    self.assertIsNone(pipeline.stats[0].nodes_before)
+    pipeline = optimize.CreatePipeline(optimize.OptimizeFlags(
+        lossy=False, use_abcs=False, max_union=2, remove_mutable=False))
+    pipeline.Disable("Factorize")
+    new_tree = pipeline.Run(tree, measure=True)
+    self.AssertSourceEquals(new_tree, textwrap.dedent("""
+        def f(x: int) -> object
+        def f(x: float) -> object
+    """))
+    report = pipeline.Report()
+    self.assertNotIn("Factorize", [stats["name"] for stats in report])
+    collapse, = [stats for stats in report
+                 if stats["name"] == "CollapseLongReturnUnions"]
+    self.assertEquals((3, 0), (collapse["max_union_before"],
+                               collapse["max_union_after"]))
+    self.assertEquals(2, collapse["signatures_after"])
+    self.assertGreater(collapse["nodes_before"], collapse["nodes_after"])
+    self.assertIn("CollapseLongReturnUnions", pipeline.FormatReport())
+
+  def testPipelineOrderAndFixpoint(self):
+    calls = []
+    def Pass(node):
+      calls.append(node)
+      return min(node + 1, 3)
+    pipeline = optimize.OptimizationPipeline()
+    pipeline.Add("b", lambda node: node * 2)
+    pipeline.Add("a", Pass, before="b", fixpoint=True)
+    pipeline.Add("c", lambda node: node - 1, after="a", enabled=False)
+    self.assertEquals(["a", "c", "b"], pipeline.Names())
+    self.assertRaises(ValueError, pipeline.Add, "a", Pass)
+    self.assertRaises(KeyError, pipeline.Disable, "d")
+    self.assertEquals(6, pipeline.Run(0))
+    self.assertEquals([0, 1, 2, 3], calls)
+    self.assertEquals([4, 1], [stats.iterations for stats in pipeline.stats])
+    pipeline.Remove("a")
+    pipeline.Enable("c")
+    self.assertEquals(-2, pipeline.Run(0))
+
+  def testMain(self):
+    directory = tempfile.mkdtemp()
+    stderr = sys.stderr
+    try:
+      src = os.path.join(directory, "foo.pytd")
+      dst = os.path.join(directory, "out.pytd")
+      with open(src, "w") as fi:
+        fi.write(textwrap.dedent("""
+            def f(x: int) -> int or float or str
+            def f(x: float) -> int or float or str
+        """))
+      sys.stderr = StringIO.StringIO()
+      self.assertEquals(0, optimize.main(
+          [src, "-o", dst, "--max-union=2", "--disable=Factorize", "--stats"]))
+      self.assertIn("CollapseLongReturnUnions", sys.stderr.getvalue())
+      with open(dst) as fi:
+        self.AssertSourceEquals(fi.read(), textwrap.dedent("""
+            def f(x: int) -> object
+            def f(x: float) -> object
+        """))
+    finally:
+      sys.stderr = stderr
+      shutil.rmtree(directory)
+
+  def testOptimizeInParallel(self):
+    src = textwrap.dedent("""
+        class A:
+            def f(self, x: int) -> float
+            def f(self, x: float) -> float
+        class B(A):
+            def f(self, x: int) -> float
+            def g(self, x: int or float or complex) -> A
+        def foo(x: int) -> A raises ValueError
+        def foo(x: int) -> B raises TypeError
+        def bar(x: list<int> or list<float>) -> bool or int
+    """)
+    tree = self.Parse(src)
+    lossy = optimize.OptimizeFlags(lossy=True, use_abcs=False, max_union=2,
+                                   remove_mutable=False)
+    for flags in (None, lossy):
+      expected = optimize.Optimize(tree, flags)
+      new_tree = optimize.Optimize(tree, flags, jobs=2)
+      self.assertEquals(expected.classes, new_tree.classes)
+      self.assertEquals(expected.functions, new_tree.functions)
+      new_tree.Visit(visitors.VerifyLookup())
+
+  def testOptimizeWithCache(self):
+    src = textwrap.dedent("""
+        class A:
+            def f(self, x: int) -> float
+            def f(self, x: float) -> float
+        class B(A):
+            def f(self, x: int) -> float
+        def foo(x: int) -> A raises ValueError
+        def foo(x: int) -> B raises TypeError
+    """)
+    tree = self.Parse(src)
+    cache = result_cache.ResultCache()
+    expected = optimize.Optimize(tree)
+    self.AssertSourceEquals(expected, optimize.Optimize(tree, cache=cache))
+    self.assertEquals((0, 3), (cache.memory_hits, cache.misses))
+    new_tree = optimize.Optimize(self.Parse(src), cache=cache)
+    self.AssertSourceEquals(expected, new_tree)
+    new_tree.Visit(visitors.VerifyLookup())
+    self.assertEquals(3, cache.memory_hits)
+    # Only the changed definition is optimized again.
+    foo = tree.Lookup("foo")
+    tree = tree.Replace(functions=(foo.Replace(signatures=foo.signatures[:1]),))
+    self.AssertSourceEquals(optimize.Optimize(tree),
+                            optimize.Optimize(tree, cache=cache))
+    self.assertEquals((5, 4), (cache.memory_hits, cache.misses))
+    # The result depends on the flags.
+    flags = optimize.OptimizeFlags(lossy=True, use_abcs=False, max_union=4,
+                                   remove_mutable=False)
+    optimize.Optimize(tree, flags, cache=cache)
+    self.assertEquals((5, 7), (cache.memory_hits, cache.misses))
+
+  def testCollapseDeepGenerics(self):
+    src = textwrap.dedent("""
+        def f(x: list<list<list<int>>>) -> dict<str, list<list<int>>>
+    """)
+    new_src = textwrap.dedent("""
+        def f(x: list<list<?>>) -> dict<str, list<?>>
+    """)
+    self.AssertSourceEquals(
+        self.ApplyVisitorToString(src, optimize.CollapseDeepGenerics(2)),
+        new_src)
+
+  def testOptimizeWithBudget(self):
+    src = textwrap.dedent("""
+        def foo(x: int) -> float
+        def foo(x: str) -> float
+        def bar(x: int or float or str or list) -> list<list<list<int>>>
+    """)
+    tree = self.Parse(src)
+    events = []
+    budget = optimize.OptimizeBudget(max_union=3, max_depth=2)
+    new_tree = optimize.Optimize(tree, budget=budget, budget_events=events)
+    self.AssertSourceEquals(new_tree, textwrap.dedent("""
+        def foo(x: int or str) -> float
+        def bar(x) -> list<list<?>>
+    """))
+    self.assertEquals([("bar", "max_union", "RemoveDuplicates"),
+                       ("bar", "max_depth", "RemoveDuplicates")], events)
+    # Too many signatures: foo isn't factorized.
+    events = []
+    budget = optimize.OptimizeBudget(max_signatures=1)
+    new_tree = optimize.Optimize(tree, budget=budget, budget_events=events)
+    self.assertEquals(2, len(new_tree.Lookup("foo").signatures))
+    self.assertEquals([("foo", "max_signatures", "RemoveDuplicates")], events)
+
+  def testPipelineWithTimeBudget(self):
+    pipeline = optimize.OptimizationPipeline()
+    pipeline.Add("Sleep", lambda node: time.sleep(0.05) or node)
+    pipeline.Add("Factorize", optimize.VisitorPass(optimize.Factorize))
+    tree = self.Parse(textwrap.dedent("""
+        def foo(x: int) -> float
+        def foo(x: str) -> float
+    """))
+    new_tree = pipeline.Run(tree, budget=optimize.OptimizeBudget(seconds=0.01))
+    self.assertEquals(2, len(new_tree.Lookup("foo").signatures))
+    self.assertEquals([("seconds", "Factorize")], pipeline.budget_events)
+    self.assertEquals(["Sleep"], [stats.name for stats in pipeline.stats])
+
+  def testOptimizer(self):
+    src = textwrap.dedent("""
+        class A:
+            def f(self, x: int) -> float
+            def f(self, x: float) -> float
+        class B(A):
+            def f(self, x: int) -> float
+            def f(self, x: float) -> float
+            def g(self) -> A
+        class C:
+            def h(self) -> B
+        def foo(x: int) -> A
+        def foo(x: float) -> A
+    """)
+    tree = self.Parse(src)
+    optimizer = optimize.Optimizer()
+    new_tree = optimizer.Update(tree)
+    self.AssertSourceEquals(new_tree, optimize.Optimize(tree))
+    new_tree.Visit(visitors.VerifyLookup())
+    self.assertEquals(4, optimizer.optimized)
+    # Only the changed definition, and the classes deriving from it, are redone.
+    foo = tree.Lookup("foo")
+    tree = tree.Replace(functions=(foo.Replace(signatures=foo.signatures[:1]),))
+    new_tree = optimizer.Update(tree)
+    self.AssertSourceEquals(new_tree, optimize.Optimize(tree))
+    self.assertEquals((1, 3), (optimizer.optimized, optimizer.reused))
+    a = tree.Lookup("A")
+    tree = tree.Replace(classes=(a.Replace(methods=()),) + tree.classes[1:])
+    new_tree = optimizer.Update(tree)
+    self.AssertSourceEquals(new_tree, optimize.Optimize(tree))
+    self.assertEquals((2, 2), (optimizer.optimized, optimizer.reused))
+    # Unchanged definitions refer to the new classes.
+    self.assertIs(new_tree.Lookup("A"),
+                  new_tree.Lookup("foo").signatures[0].return_type.cls)
+    self.assertRaises(visitors.UnresolvedNameError, optimizer.Update,
+                      tree.Replace(classes=tree.classes[1:]))
+
+  def testOptimizerUnionOrder(self):
+    optimizer = optimize.Optimizer()
+    tree = self.Parse("def foo(x: int or str) -> ?")
+    optimizer.Update(tree)
+    # Only the order of the union changes. This compares equal, but prints
+    # differently.
+    tree = self.Parse("def foo(x: str or int) -> ?")
+    new_tree = optimizer.Update(tree)
+    self.assertMultiLineEqual(pytd.Print(optimize.Optimize(tree)),
+                              pytd.Print(new_tree))
+    self.assertEquals((1, 0), (optimizer.optimized, optimizer.reused))
+
 if __name__ == "__main__":
   unittest.main()
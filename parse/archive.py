@@ -0,0 +1,195 @@
+# -*- coding:utf-8; python-indent:2; indent-tabs-mode:nil -*-
+
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Random-access archives of pytd symbols.
+
+An archive stores all the classes, functions and constants of a module and,
+recursively, its submodules, as individually serialized (see pytdb.py)
+records. A sorted directory in front of the records maps qualified names
+("int", "os.stat") to records, so looking up a symbol only needs to read, and
+decode, the directory pages on the binary search path and the symbol's own
+record. The file is accessed through mmap.
+
+Archive implements Lookup() like TypeDeclUnit, so it can be passed as the
+global_module to visitors.LookupClasses or visitors.FillInClasses:
+
+  Write(builtins.GetBuiltins(), "builtins.pytda")
+  ...
+  module = visitors.LookupClasses(module, Archive("builtins.pytda"))
+
+Symbols are stored unresolved, i.e., with NamedType instead of ClassType.
+
+File layout:
+  header: MAGIC, ARCHIVE_VERSION, number of symbols
+  directory: one fixed-size entry per symbol, sorted by name:
+    (offset of name, length of name, offset of record, length of record)
+  names
+  records
+"""
+
+import collections
+import mmap
+import os
+import struct
+
+
+from pytypedecl.parse import pytdb
+from pytypedecl.parse import visitors
+
+
+MAGIC = "PYTDA"
+ARCHIVE_VERSION = 1
+
+_HEADER = struct.Struct("<5sHI")
+_ENTRY = struct.Struct("<QIQI")
+
+
+def _Symbols(unit, prefix=""):
+  """Generate (qualified name, node) for all symbols in a module."""
+  for item in unit.constants + unit.functions + unit.classes:
+    yield prefix + item.name, item
+  for module in unit.modules:
+    for symbol in _Symbols(module, prefix + module.name + "."):
+      yield symbol
+
+
+def Write(unit, filename):
+  """Write an archive containing the symbols of a module and its submodules.
+
+  Args:
+    unit: A pytd.TypeDeclUnit.
+    filename: The file to write.
+  """
+  # If a name occurs multiple times, use the same precedence as
+  # TypeDeclUnit.Lookup. (Classes win over functions win over constants.)
+  symbols = dict(_Symbols(unit))
+  names = sorted(symbols)
+  to_named_type = visitors.ClassTypeToNamedType()
+  records = [pytdb.Dump(symbols[name].Visit(to_named_type))
+             for name in names]
+
+  names_offset = _HEADER.size + _ENTRY.size * len(names)
+  records_offset = names_offset + sum(len(name) for name in names)
+  directory = []
+  for name, record in zip(names, records):
+    directory.append(_ENTRY.pack(names_offset, len(name),
+                                 records_offset, len(record)))
+    names_offset += len(name)
+    records_offset += len(record)
+
+  with open(filename, "wb") as fi:
+    fi.write(_HEADER.pack(MAGIC, ARCHIVE_VERSION, len(names)))
+    fi.write("".join(directory))
+    fi.write("".join(names))
+    fi.write("".join(records))
+
+
+class Archive(object):
+  """A symbol archive, opened for reading. See module docstring.
+
+  Attributes:
+    filename: The file this archive was read from.
+  """
+
+  def __init__(self, filename, cache_size=1024):
+    """Open an archive.
+
+    Args:
+      filename: The file to read. Written by Write().
+      cache_size: How many decoded symbols to keep around.
+
+    Raises:
+      pytdb.LoadError: If the file isn't a valid archive.
+    """
+    self.filename = filename
+    with open(filename, "rb") as fi:
+      # mmap can't map empty files, so check the size first.
+      if os.fstat(fi.fileno()).st_size < _HEADER.size:
+        raise pytdb.LoadError("Not an archive: " + filename)
+      self._data = mmap.mmap(fi.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+      magic, version, self._count = _HEADER.unpack_from(self._data)
+      if magic != MAGIC:
+        raise pytdb.LoadError("Not an archive: " + filename)
+      if version != ARCHIVE_VERSION:
+        raise pytdb.LoadError("Unsupported archive version %d" % version)
+      if _HEADER.size + self._count * _ENTRY.size > len(self._data):
+        raise pytdb.LoadError("Truncated archive: " + filename)
+    except pytdb.LoadError:
+      self._data.close()
+      raise
+    self._cache_size = cache_size
+    self._cache = collections.OrderedDict()  # least recently used first
+
+  def Close(self):
+    self._data.close()
+
+  def __len__(self):
+    return self._count
+
+  def _Entry(self, i):
+    return _ENTRY.unpack_from(self._data, _HEADER.size + i * _ENTRY.size)
+
+  def _Find(self, name):
+    """Binary search the directory. Returns the entry for name, or None."""
+    data = self._data
+    lo, hi = 0, self._count
+    while lo < hi:
+      mid = (lo + hi) // 2
+      entry = self._Entry(mid)
+      key = data[entry[0]:entry[0] + entry[1]]
+      if key < name:
+        lo = mid + 1
+      elif key > name:
+        hi = mid
+      else:
+        return entry
+    return None
+
+  def Names(self):
+    """Return all qualified names in this archive, in sorted order."""
+    data = self._data
+    names = []
+    for i in xrange(self._count):
+      name_offset, name_length, _, _ = self._Entry(i)
+      names.append(data[name_offset:name_offset + name_length])
+    return names
+
+  def Lookup(self, name):
+    """Look up a class, function or constant by its qualified name.
+
+    Args:
+      name: The name of the symbol, e.g. "int" or "os.stat".
+
+    Returns:
+      A pytd.Class, pytd.Function or pytd.Constant.
+
+    Raises:
+      KeyError: If the archive doesn't contain this name.
+    """
+    cache = self._cache
+    node = cache.pop(name, None)
+    if node is None:
+      entry = self._Find(name)
+      if entry is None:
+        raise KeyError(name)
+      _, _, record_offset, record_length = entry
+      node = pytdb.Load(
+          self._data[record_offset:record_offset + record_length])
+    cache[name] = node
+    if len(cache) > self._cache_size:
+      cache.popitem(last=False)
+    return node
@@ -0,0 +1,101 @@
+"""Tests for parse.archive."""
+
+import os
+import tempfile
+import textwrap
+import unittest
+
+
+from pytypedecl import pytd
+from pytypedecl.parse import archive
+from pytypedecl.parse import builtins
+from pytypedecl.parse import parser
+from pytypedecl.parse import pytdb
+from pytypedecl.parse import visitors
+
+
+class ArchiveTest(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    cls.builtins = builtins.GetBuiltins()
+    fd, cls.filename = tempfile.mkstemp(suffix=".pytda")
+    os.close(fd)
+    archive.Write(cls.builtins, cls.filename)
+
+  @classmethod
+  def tearDownClass(cls):
+    os.unlink(cls.filename)
+
+  def setUp(self):
+    self.archive = archive.Archive(self.filename)
+
+  def tearDown(self):
+    self.archive.Close()
+
+  def testLookup(self):
+    self.assertEquals(self.builtins.Lookup("int"), self.archive.Lookup("int"))
+    self.assertEquals(self.builtins.Lookup("os.stat"),
+                      self.archive.Lookup("os.stat"))
+    self.assertRaises(KeyError, self.archive.Lookup, "nonexistent")
+    self.assertRaises(KeyError, self.archive.Lookup, "os.nonexistent")
+
+  def testAllNames(self):
+    names = self.archive.Names()
+    self.assertEquals(sorted(names), names)
+    self.assertEquals(len(self.archive), len(names))
+    for name in names:
+      self.assertEquals(self.builtins.Lookup(name), self.archive.Lookup(name))
+
+  def testCache(self):
+    a = archive.Archive(self.filename, cache_size=2)
+    int_cls = a.Lookup("int")
+    self.assertIs(int_cls, a.Lookup("int"))
+    a.Lookup("float")
+    a.Lookup("int")  # makes "float" the least recently used
+    a.Lookup("str")
+    self.assertIs(int_cls, a.Lookup("int"))
+    self.assertEquals(["str", "int"], list(a._cache))
+    a.Close()
+
+  def testLookupClasses(self):
+    src = textwrap.dedent("""
+        def foo(x: int, y: list<float>) -> os.stat_result
+    """)
+    unit = parser.TypeDeclParser().Parse(src)
+    self.assertRaises(ValueError, visitors.LookupClasses, unit, self.archive)
+    unit = parser.TypeDeclParser().Parse(src.replace("stat_result", "stat"))
+    unit = visitors.LookupClasses(unit, self.archive)
+    x, _ = unit.Lookup("foo").signatures[0].params
+    self.assertEquals(pytd.ClassType("int"), x.type)
+    self.assertEquals(self.builtins.Lookup("int"), x.type.cls)
+    self.assertEquals(["float", "int", "list", "os.stat"],
+                      sorted(self.archive._cache))
+
+  def testNotAnArchive(self):
+    fd, filename = tempfile.mkstemp()
+    os.write(fd, pytdb.Dump(pytd.NamedType("int")))
+    os.close(fd)
+    try:
+      self.assertRaises(pytdb.LoadError, archive.Archive, filename)
+    finally:
+      os.unlink(filename)
+
+  def testEmptyOrTruncatedArchive(self):
+    with open(self.filename, "rb") as fi:
+      data = fi.read()
+    header_size = archive._HEADER.size
+    fd, filename = tempfile.mkstemp()
+    os.close(fd)
+    try:
+      # Empty, a truncated header, and a truncated directory.
+      for size in (0, 1, header_size - 1, header_size, header_size + 1):
+        with open(filename, "wb") as fi:
+          fi.write(data[:size])
+        self.assertRaises(pytdb.LoadError, archive.Archive, filename)
+    finally:
+      os.unlink(filename)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -17,10 +17,17 @@
 
 """Utilities for parsing pytd files for builtins."""
 
-import os.path
+import gc
+import hashlib
+import itertools
+import os
+import tempfile
 
+from pytypedecl import pytd
 from pytypedecl import utils
+from pytypedecl.parse import corpus
 from pytypedecl.parse import parser
+from pytypedecl.parse import pytdb
 from pytypedecl.parse import visitors
 
 
@@ -28,9 +35,162 @@ def _FindBuiltinFile(name):
   return utils.GetDataFile(os.path.join("builtins", name))
 
 
+# We list modules explicitly, because we might have to extract them out of
+# a PAR file, which doesn't have good support for listing directories.
+_STDLIB_MODULES = [
+    "array", "codecs", "errno", "fcntl", "gc", "itertools", "marshal", "os",
+    "posix", "pwd", "select", "signal", "_sre", "StringIO", "strop", "_struct",
+    "sys", "_warnings", "warnings", "_weakref"]
+
+# Increase this if the way we construct the builtins changes.
+_SNAPSHOT_VERSION = 2
+
+# Environment variable for overriding where snapshots are stored. If it's set
+# to the empty string, snapshots are disabled.
+CACHE_DIR_VARIABLE = "PYTYPEDECL_CACHE_DIR"
+
+
 # TODO: Use a memoizing decorator instead.
 # Keyed by the parameter(s) passed to GetBuiltins:
 _cached_builtins = {}
+_cached_resolved_builtins = {}
+_cached_hierarchy = None
+_cached_versions = {}
+_stdlib_interner = corpus.Interner()
+
+
+def _GetCacheDir():
+  """Return the directory to store builtins snapshots in, or None."""
+  cache_dir = os.environ.get(CACHE_DIR_VARIABLE)
+  if cache_dir is None:
+    cache_dir = os.path.join(
+        os.environ.get("XDG_CACHE_HOME") or
+        os.path.join(os.path.expanduser("~"), ".cache"), "pytypedecl")
+  return cache_dir or None
+
+
+def _SnapshotKey(sources, params):
+  """Compute the key for a builtins snapshot.
+
+  Args:
+    sources: List of (file name, contents) of all files we parse.
+    params: Anything else (with a stable repr) that influences the result.
+
+  Returns:
+    A hex string. It changes whenever any of the inputs, the parser version,
+    or the serialization format change.
+  """
+  key = hashlib.sha1()
+  key.update(repr((_SNAPSHOT_VERSION, parser.DEFAULT_VERSION,
+                   pytdb.FORMAT_VERSION, pytdb.GRAMMAR_VERSION, params)))
+  for filename, data in sources:
+    key.update("%s:%d:%s\n" % (filename, len(data),
+                                hashlib.sha1(data).hexdigest()))
+  return key.hexdigest()
+
+
+def _LoadSnapshot(filename):
+  """Load a snapshot. Returns None if it doesn't exist or is invalid."""
+  try:
+    with open(filename, "rb") as fi:
+      return pytdb.Load(fi.read())
+  except (IOError, OSError, pytdb.LoadError):
+    return None
+
+
+def _SaveSnapshot(filename, unit):
+  """Store a snapshot, atomically. Failures are silently ignored."""
+  directory = os.path.dirname(filename)
+  try:
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    fd, tmp_filename = tempfile.mkstemp(dir=directory, suffix=".tmp")
+  except (IOError, OSError):
+    return
+  try:
+    with os.fdopen(fd, "wb") as fi:
+      fi.write(pytdb.Dump(unit))
+    # Atomic on POSIX. Concurrent writers will write the same data.
+    os.rename(tmp_filename, filename)
+  except (IOError, OSError):
+    try:
+      os.unlink(tmp_filename)
+    except OSError:
+      pass
+
+
+def _Sources(stdlib, builtin_name):
+  """Return (file name, contents) of all builtins files."""
+  module_names = _STDLIB_MODULES if stdlib else []
+  return [(name + ".pytd", _FindBuiltinFile(name + ".pytd"))
+          for name in [builtin_name] + module_names]
+
+
+def _SnapshotFile(kind, sources, params):
+  """Return the file name of a snapshot, or None if snapshots are disabled."""
+  cache_dir = _GetCacheDir()
+  if cache_dir:
+    return os.path.join(cache_dir, "%s-%s.pytdb" % (
+        kind, _SnapshotKey(sources, params)))
+  else:
+    return None
+
+
+def _HasDefinitions(unit):
+  return bool(unit.constants or unit.functions or unit.classes or unit.modules)
+
+
+def _MatchesSources(unit, sources):
+  """Sanity check a unit before we store it in a snapshot.
+
+  Args:
+    unit: A pytd.TypeDeclUnit, parsed from sources[0], with submodules parsed
+      from sources[1:].
+    sources: List of (file name, contents), like _Sources() returns.
+
+  Returns:
+    False if the unit, or one of its submodules, is empty although its file
+    isn't.
+  """
+  modules = dict((module.name, module) for module in unit.modules)
+  for i, (filename, data) in enumerate(sources):
+    if i == 0:
+      module = unit
+    else:
+      module = modules.get(os.path.splitext(filename)[0])
+      if module is None:
+        return False
+    has_source = any(line.strip() and not line.lstrip().startswith("#")
+                     for line in data.splitlines())
+    if has_source and not _HasDefinitions(module):
+      return False
+  return True
+
+
+def _LoadModule(name):
+  """Parse a single builtins file, or load it from its snapshot."""
+  filename = name + ".pytd"
+  data = _FindBuiltinFile(filename)
+  sources = [(filename, data)]
+  snapshot = _SnapshotFile("module", sources, name)
+  unit = snapshot and _LoadSnapshot(snapshot)
+  if unit is not None and not _MatchesSources(unit, sources):
+    unit = None
+  if unit is None:
+    # PLY keeps its parser tables in global state, so every parser created
+    # after ours would break it. Hence, don't reuse parsers across calls.
+    unit = parser.TypeDeclParser().Parse(data, filename=filename, name=name)
+    if snapshot and _MatchesSources(unit, sources):
+      _SaveSnapshot(snapshot, unit)
+  return unit
+
+
+def _LoadStdlibModule(name):
+  """Load a standard library module, sharing definitions with other modules."""
+  # Many modules in the standard library are (partially) identical. E.g. "os"
+  # and "posix". (In our builtins, we only find duplicates between these, not
+  # with __builtin__, so we don't intern __builtin__.)
+  return _stdlib_interner.Intern(_LoadModule(name))
 
 
 def GetBuiltins(stdlib=True, builtin_name="__builtin__"):
@@ -39,6 +199,12 @@ def GetBuiltins(stdlib=True, builtin_name="__builtin__"):
   Get an AST for all Python builtins as well as the most commonly used standard
   libraries.
 
+  Parsing the builtins is fairly slow, so the parsed form of each file is
+  stored as a snapshot in a cache directory (see _GetCacheDir), and reused by
+  later processes as long as the file and the parser haven't changed. Also,
+  standard library modules are only parsed (or loaded) once they're needed.
+  See pytd.LazyModules, and Preload().
+
   Args:
     stdlib: Whether to load the standard library, too. If this is False,
       TypeDeclUnit.modules will be empty. If it's True, it'll contain modules
@@ -49,31 +215,146 @@ def GetBuiltins(stdlib=True, builtin_name="__builtin__"):
     A pytd.TypeDeclUnit instance. It'll directly contain the builtin classes
     and functions, and submodules for each of the standard library modules.
   """
-  cache_key = stdlib
+  cache_key = (stdlib, builtin_name)
   if cache_key in _cached_builtins:
     return _cached_builtins[cache_key]
-  # TODO: This can be fairly slow; suggest pickling the result and
-  #                  reusing if possible (see lib2to3.pgen2.grammar)
-
-  # We use the same parser instance to parse all builtin files. This changes
-  # the run time from 1.0423s to 0.5938s (for 21 builtins).
-  p = parser.TypeDeclParser()
-  builtins = p.Parse(
-      _FindBuiltinFile(builtin_name + ".pytd"), name=builtin_name)
-  # We list modules explicitly, because we might have to extract them out of
-  # a PAR file, which doesn't have good support for listing directories.
-  modules = ["array", "codecs", "errno", "fcntl", "gc", "itertools", "marshal",
-             "os", "posix", "pwd", "select", "signal", "_sre", "StringIO",
-             "strop", "_struct", "sys", "_warnings", "warnings", "_weakref"]
+
   if stdlib:
-    builtins = builtins.Replace(
-        modules=tuple(p.Parse(_FindBuiltinFile(mod + ".pytd"),
-                              filename=mod + ".pytd", name=mod)
-                      for mod in modules))
+    builtins = GetBuiltins(False, builtin_name).Replace(
+        modules=pytd.LazyModules(names=_STDLIB_MODULES,
+                                 loader=_LoadStdlibModule))
+  else:
+    builtins = _LoadModule(builtin_name)
+
   _cached_builtins[cache_key] = builtins
   return builtins
 
 
+def _BuildLookupIndexes(unit):
+  """Build the Lookup() indexes of a module, its classes and submodules."""
+  for item in itertools.chain(unit.constants, unit.functions, unit.classes,
+                              unit.modules):
+    unit.Lookup(item.name)
+  for cls in unit.classes:
+    for member in itertools.chain(cls.methods, cls.constants):
+      cls.Lookup(member.name)
+  for module in unit.modules:
+    _BuildLookupIndexes(module)
+
+
+def Preload(stdlib=True, builtin_name="__builtin__", freeze=False):
+  """Build all of the builtins now, instead of on demand.
+
+  This loads all of GetBuiltins() and GetResolvedBuiltins(), the Lookup()
+  indexes of all their modules and classes, and GetBuiltinsHierarchy(). Use it
+  in processes that care more about latency than about startup time.
+
+  It's also for servers that fork worker processes. If the parent calls this
+  before forking, all the workers share one copy of the builtins through
+  copy-on-write. Otherwise, each worker builds its own copy:
+
+    builtins.Preload(freeze=True)
+    for _ in range(num_workers):
+      if os.fork() == 0:
+        Serve()
+
+  Reference counting still writes to the pages of the objects a worker uses,
+  but most of the builtins are never used.
+
+  With freeze=True, all objects also move to the garbage collector's permanent
+  generation, with gc.freeze(). Then collections in the workers don't visit
+  them either. gc.freeze() needs Python 3.7 or later. On older versions, a
+  collection of the oldest generation in a worker still visits every object,
+  and gc.set_threshold() controls how often that happens.
+
+  Args:
+    stdlib: See GetBuiltins().
+    builtin_name: See GetBuiltins().
+    freeze: Whether to also freeze the garbage collector. Call this last, just
+      before forking, if you do.
+
+  Returns:
+    The result of GetBuiltins().
+  """
+  builtins = GetBuiltins(stdlib, builtin_name)
+  if isinstance(builtins.modules, pytd.LazyModules):
+    builtins.modules.Preload()
+  _BuildLookupIndexes(builtins)
+  _BuildLookupIndexes(GetResolvedBuiltins(stdlib, builtin_name))
+  if stdlib and builtin_name == "__builtin__":
+    GetBuiltinsHierarchy()
+  if freeze:
+    gc.collect()  # Don't make garbage permanent.
+    if hasattr(gc, "freeze"):
+      gc.freeze()  # pylint: disable=no-member
+  return builtins
+
+
+def GetBuiltinsVersion(stdlib=True, builtin_name="__builtin__"):
+  """Get a string that changes whenever the builtins change.
+
+  Use this in the keys of caches for results that depend on the builtins.
+
+  Args:
+    stdlib: See GetBuiltins().
+    builtin_name: See GetBuiltins().
+
+  Returns:
+    A hex string.
+  """
+  cache_key = (stdlib, builtin_name)
+  if cache_key not in _cached_versions:
+    _cached_versions[cache_key] = _SnapshotKey(
+        _Sources(stdlib, builtin_name), cache_key)
+  return _cached_versions[cache_key]
+
+
+def GetResolvedBuiltins(stdlib=True, builtin_name="__builtin__"):
+  """Get the builtins, with all ClassType pointers filled in.
+
+  This is GetBuiltins(), passed through visitors.LookupClasses. The result is
+  cached (also on disk, like for GetBuiltins), so use this instead of
+  resolving the builtins yourself. Since the result is shared, callers must not
+  modify the ClassType pointers in it (e.g. with ClearClassTypePointers).
+
+  Args:
+    stdlib: See GetBuiltins().
+    builtin_name: See GetBuiltins().
+
+  Returns:
+    A pytd.TypeDeclUnit instance, which only uses ClassType, not NamedType.
+  """
+  cache_key = (stdlib, builtin_name)
+  if cache_key in _cached_resolved_builtins:
+    return _cached_resolved_builtins[cache_key]
+
+  sources = _Sources(stdlib, builtin_name)
+  snapshot = _SnapshotFile("resolved-builtins", sources, cache_key)
+  builtins = snapshot and _LoadSnapshot(snapshot)
+  if builtins is not None and not _MatchesSources(builtins, sources):
+    builtins = None
+  if builtins is None:
+    builtins = visitors.LookupClasses(GetBuiltins(stdlib, builtin_name))
+    if snapshot and _MatchesSources(builtins, sources):
+      _SaveSnapshot(snapshot, builtins)
+  else:
+    # We only store snapshots of trees that passed visitors.VerifyLookup.
+    visitors.MarkResolved(builtins)
+
+  _cached_resolved_builtins[cache_key] = builtins
+  return builtins
+
+
 def GetBuiltinsHierarchy():
-  builtins = GetBuiltins()
-  return builtins.Visit(visitors.ExtractSuperClassesByName())
+  """Get the superclasses of all the classes in GetBuiltins(), by name.
+
+  Returns:
+    A new dictionary, mapping class names to lists of names of superclasses.
+    Callers are free to modify it.
+  """
+  global _cached_hierarchy
+  if _cached_hierarchy is None:
+    _cached_hierarchy = GetBuiltins().Visit(
+        visitors.ExtractSuperClassesByName())
+  return {name: list(superclasses)
+          for name, superclasses in _cached_hierarchy.iteritems()}
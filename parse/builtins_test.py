@@ -1,10 +1,15 @@
 """Tests for parse.builtins."""
 
+import gc
+import os
+import shutil
+import tempfile
 import unittest
 
 
 from pytypedecl import pytd
 from pytypedecl.parse import builtins
+from pytypedecl.parse import parser
 from pytypedecl.parse import visitors
 
 
@@ -36,6 +41,177 @@ class UtilsTest(unittest.TestCase):
     cls = self.builtins.Lookup("object")
     self.assertEquals(cls.parents, ())
 
+  def testGetResolvedBuiltins(self):
+    resolved = builtins.GetResolvedBuiltins()
+    self.assertIs(resolved, builtins.GetResolvedBuiltins())
+    self.assertIs(resolved, visitors.LookupClasses(resolved))
+    resolved.Visit(visitors.VerifyLookup())
+    int_cls = resolved.Lookup("int")
+    self.assertIs(resolved.Lookup("object"), int_cls.parents[0].cls)
+    self.assertMultiLineEqual(pytd.Print(self.builtins), pytd.Print(resolved))
+    # The unresolved builtins are unaffected.
+    self.assertEquals(self.builtins.Lookup("int").parents,
+                      (pytd.NamedType("object"),))
+
+  def testSnapshot(self):
+    cache_dir = tempfile.mkdtemp()
+    old_cache_dir = os.environ.get(builtins.CACHE_DIR_VARIABLE)
+    old_cached_builtins = builtins._cached_builtins.copy()
+    os.environ[builtins.CACHE_DIR_VARIABLE] = cache_dir
+    try:
+      builtins._cached_builtins.clear()
+      parsed = builtins.GetBuiltins()
+      # One snapshot per file. So far, we only needed __builtin__.
+      snapshots = os.listdir(cache_dir)
+      self.assertEquals(1, len(snapshots))
+      source = pytd.Print(parsed)
+      self.assertEquals(21, len(os.listdir(cache_dir)))
+      builtins._cached_builtins.clear()
+      loaded = builtins.GetBuiltins()
+      self.assertIsNot(parsed, loaded)
+      self.assertMultiLineEqual(source, pytd.Print(loaded))
+      # stdlib=False shares the snapshot for __builtin__.
+      builtins.GetBuiltins(stdlib=False)
+      self.assertEquals(21, len(os.listdir(cache_dir)))
+      # Corrupt snapshots are ignored, and replaced.
+      snapshot = os.path.join(cache_dir, snapshots[0])
+      with open(snapshot, "wb") as fi:
+        fi.write("garbage")
+      builtins._cached_builtins.clear()
+      reparsed = builtins.GetBuiltins()
+      self.assertMultiLineEqual(source, pytd.Print(reparsed))
+      self.assertEquals(21, len(os.listdir(cache_dir)))
+      with open(snapshot, "rb") as fi:
+        self.assertNotEquals("garbage", fi.read())
+      # Resolved builtins have their own snapshot, with pointers intact.
+      builtins._cached_resolved_builtins.clear()
+      builtins.GetResolvedBuiltins()
+      self.assertEquals(22, len(os.listdir(cache_dir)))
+      builtins._cached_resolved_builtins.clear()
+      resolved = builtins.GetResolvedBuiltins()
+      self.assertTrue(visitors.IsResolved(resolved))
+      resolved.Visit(visitors.VerifyLookup())
+    finally:
+      if old_cache_dir is None:
+        del os.environ[builtins.CACHE_DIR_VARIABLE]
+      else:
+        os.environ[builtins.CACHE_DIR_VARIABLE] = old_cache_dir
+      builtins._cached_builtins.clear()
+      builtins._cached_builtins.update(old_cached_builtins)
+      builtins._cached_resolved_builtins.clear()
+      shutil.rmtree(cache_dir)
+
+  def testLazyModules(self):
+    old_cached_builtins = builtins._cached_builtins.copy()
+    builtins._cached_builtins.clear()
+    try:
+      unit = builtins.GetBuiltins()
+      modules = unit.modules
+      self.assertIsInstance(modules, pytd.LazyModules)
+      self.assertEquals(20, len(modules))
+      self.assertEquals(20, len(modules._pending))
+      self.assertEquals("stat", unit.Lookup("os.stat").name)
+      self.assertEquals("os", unit.Lookup("os").name)
+      self.assertEquals(19, len(modules._pending))
+      self.assertEquals("array", modules[0].name)
+      self.assertEquals(18, len(modules._pending))
+      names = [m.name for m in modules]
+      self.assertEquals(builtins._STDLIB_MODULES, names)
+      self.assertFalse(modules._pending)
+      self.assertIs(unit.Lookup("sys"), modules[names.index("sys")])
+    finally:
+      builtins._cached_builtins.clear()
+      builtins._cached_builtins.update(old_cached_builtins)
+
+  def testLazyModulesAfterNewParser(self):
+    old_cached_builtins = builtins._cached_builtins.copy()
+    builtins._cached_builtins.clear()
+    try:
+      unit = builtins.GetBuiltins()
+      # PLY's state is global, so this mustn't break modules we load later.
+      parser.TypeDeclParser()
+      self.assertTrue(unit.Lookup("array").classes)
+      self.assertTrue(unit.Lookup("os").functions)
+    finally:
+      builtins._cached_builtins.clear()
+      builtins._cached_builtins.update(old_cached_builtins)
+
+  def testMatchesSources(self):
+    data = "# comment\ndef f() -> int\n"
+    unit = parser.parse_string(data, name="m")
+    sources = [("m.pytd", data)]
+    self.assertTrue(builtins._MatchesSources(unit, sources))
+    empty = pytd.TypeDeclUnit("m", (), (), (), ())
+    self.assertFalse(builtins._MatchesSources(empty, sources))
+    self.assertTrue(builtins._MatchesSources(empty, [("m.pytd", "# x\n")]))
+
+  def testPreload(self):
+    old_cached_builtins = builtins._cached_builtins.copy()
+    builtins._cached_builtins.clear()
+    try:
+      unit = builtins.Preload()
+      self.assertIs(unit, builtins.GetBuiltins())
+      self.assertFalse(unit.modules._pending)
+      self.assertIn("_name2item", unit.Lookup("os").__dict__)
+      self.assertIn("_name2item", unit.Lookup("int").__dict__)
+      self.assertIsNot(builtins.GetBuiltinsHierarchy(),
+                       builtins.GetBuiltinsHierarchy())
+    finally:
+      builtins._cached_builtins.clear()
+      builtins._cached_builtins.update(old_cached_builtins)
+
+  def _RunInChild(self, work):
+    """Run work() in a child process, and return what it returned, or raised."""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+      try:
+        try:
+          result = repr(work())
+        except Exception as e:  # pylint: disable=broad-except
+          result = "%s: %s" % (type(e).__name__, e)
+        os.write(write_fd, result)
+      finally:
+        os._exit(0)  # pylint: disable=protected-access
+    os.close(write_fd)
+    chunks = []
+    while True:
+      chunk = os.read(read_fd, 4096)
+      if not chunk:
+        break
+      chunks.append(chunk)
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+    return "".join(chunks)
+
+  @unittest.skipUnless(hasattr(os, "fork"), "needs fork()")
+  def testPreloadFreeze(self):
+    # Freezing affects the whole process, so do this in a child.
+    def Work():
+      builtins._cached_builtins.clear()
+      builtins._cached_resolved_builtins.clear()
+      unit = builtins.Preload(freeze=True)
+      resolved = builtins.GetResolvedBuiltins()
+      return (not unit.modules._pending,
+              all("_name2item" in m.__dict__ for m in unit.modules),
+              "_name2item" in resolved.Lookup("dict").__dict__,
+              "_name2item" in resolved.Lookup("os").__dict__,
+              resolved.Lookup("os.stat").name,
+              not hasattr(gc, "freeze") or gc.get_freeze_count() > 0)
+    self.assertEquals(repr((True, True, True, True, "stat", True)),
+                      self._RunInChild(Work))
+
+  def testSnapshotDisabled(self):
+    old_cache_dir = os.environ.get(builtins.CACHE_DIR_VARIABLE)
+    os.environ[builtins.CACHE_DIR_VARIABLE] = ""
+    try:
+      self.assertIsNone(builtins._GetCacheDir())
+    finally:
+      if old_cache_dir is None:
+        del os.environ[builtins.CACHE_DIR_VARIABLE]
+      else:
+        os.environ[builtins.CACHE_DIR_VARIABLE] = old_cache_dir
+
 
 if __name__ == "__main__":
   unittest.main()
@@ -0,0 +1,135 @@
+# -*- coding:utf-8; python-indent:2; indent-tabs-mode:nil -*-
+
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Loading collections of modules that share identical definitions.
+
+Stub corpora tend to declare the same classes and functions in many modules
+(e.g., builtins/os.pytd and builtins/posix.pytd are identical). An Interner
+detects such top-level definitions, by their contents, and makes all modules
+share a single instance of each of them.
+
+Example:
+  units = LoadCorpus(glob.glob("stubs/*.pytd"))
+"""
+
+import os
+
+
+from pytypedecl import pytd
+from pytypedecl.parse import parser
+from pytypedecl.parse import pytdb
+
+
+class Interner(object):
+  """Makes modules share structurally identical top-level definitions.
+
+  Attributes:
+    hits: How many definitions were replaced by an existing instance.
+    misses: How many definitions we hadn't seen before.
+  """
+
+  def __init__(self):
+    self._definitions = {}  # _DefinitionKey(item) -> Class, Function, Constant
+    self.hits = 0
+    self.misses = 0
+
+  def Intern(self, unit):
+    """Intern the classes, functions and constants of a module.
+
+    Args:
+      unit: A pytd.TypeDeclUnit. Submodules are processed, too.
+
+    Returns:
+      A pytd.TypeDeclUnit with the same contents as unit, but with every
+      definition replaced by the first instance with the same contents that
+      this Interner has seen. If that doesn't change anything, unit itself.
+    """
+    changes = {}
+    for field in ("constants", "functions", "classes"):
+      items = getattr(unit, field)
+      new_items = tuple(self._InternDefinition(item) for item in items)
+      if any(new is not old for new, old in zip(new_items, items)):
+        changes[field] = new_items
+    if unit.modules:
+      new_modules = tuple(self.Intern(module) for module in unit.modules)
+      if any(new is not old for new, old in zip(new_modules, unit.modules)):
+        changes["modules"] = new_modules
+    return unit.Replace(**changes) if changes else unit
+
+  def _InternDefinition(self, item):
+    existing = self._definitions.setdefault(_DefinitionKey(item), item)
+    if existing is item:
+      self.misses += 1
+    else:
+      self.hits += 1
+    return existing
+
+
+def _DefinitionKey(item):
+  """Compute a key that's only the same for interchangeable definitions.
+
+  Nodes compare equal in cases where they're not interchangeable: Unions ignore
+  the order of their types (which changes how they print), and ClassTypes
+  ignore what class they point to. So key definitions by their fingerprint
+  (which depends on the order), and the classes their ClassTypes point to.
+
+  Args:
+    item: A pytd.Class, pytd.Function or pytd.Constant.
+
+  Returns:
+    A tuple.
+  """
+  pointers = []
+  stack = [item]
+  while stack:
+    n = stack.pop()
+    if isinstance(n, pytd.ClassType):
+      # Either a "cls" pointer, or a symbol in a ResolutionContext.
+      state = n.__dict__
+      pointers.append((id(state.get("cls")), id(state.get("_context")),
+                       state.get("_symbol")))
+    elif isinstance(n, tuple):
+      stack.extend(n)
+  # The interned item keeps the objects we took the id() of alive.
+  return pytd.Fingerprint(item), tuple(pointers)
+
+
+def LoadCorpus(filenames, interner=None):
+  """Load a set of modules, sharing identical definitions between them.
+
+  Args:
+    filenames: A list of .pytd or .pytdb (see pytdb.py) files. The module name
+      is derived from the file name.
+    interner: Optionally, the Interner to use. Pass the same Interner to
+      multiple calls to share definitions between them.
+
+  Returns:
+    A list of pytd.TypeDeclUnit, one for every file.
+  """
+  interner = interner or Interner()
+  pytd_parser = None
+  units = []
+  for filename in filenames:
+    name, extension = os.path.splitext(os.path.basename(filename))
+    with open(filename, "rb") as fi:
+      data = fi.read()
+    if extension == ".pytdb":
+      unit = pytdb.Load(data)
+    else:
+      pytd_parser = pytd_parser or parser.TypeDeclParser()
+      unit = pytd_parser.Parse(data, name=name, filename=filename)
+    units.append(interner.Intern(unit))
+  return units
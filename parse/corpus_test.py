@@ -0,0 +1,112 @@
+"""Tests for parse.corpus."""
+
+import os
+import shutil
+import tempfile
+import textwrap
+import unittest
+
+
+from pytypedecl import pytd
+from pytypedecl.parse import builtins
+from pytypedecl.parse import corpus
+from pytypedecl.parse import parser
+from pytypedecl.parse import pytdb
+from pytypedecl.parse import visitors
+
+
+class CorpusTest(unittest.TestCase):
+
+  def setUp(self):
+    self.parser = parser.TypeDeclParser()
+
+  def Parse(self, src, name):
+    return self.parser.Parse(textwrap.dedent(src), name=name)
+
+  def testIntern(self):
+    a = self.Parse("""
+        x: int
+        def f(x: int) -> float
+        class A:
+            def g(self) -> A
+    """, "a")
+    b = self.Parse("""
+        x: int
+        def f(x: int) -> int
+        class A:
+            def g(self) -> A
+    """, "b")
+    interner = corpus.Interner()
+    self.assertIs(a, interner.Intern(a))
+    new_b = interner.Intern(b)
+    self.assertIs(a.Lookup("x"), new_b.Lookup("x"))
+    self.assertIs(a.Lookup("A"), new_b.Lookup("A"))
+    self.assertIs(b.Lookup("f"), new_b.Lookup("f"))
+    self.assertMultiLineEqual(pytd.Print(b), pytd.Print(new_b))
+    self.assertEquals((2, 4), (interner.hits, interner.misses))
+
+  def testInternSubmodules(self):
+    src = """
+        class A:
+            pass
+    """
+    a = self.Parse(src, "a")
+    b = self.Parse(src, "b")
+    unit = pytd.TypeDeclUnit("unit", (), (), (), (a, b))
+    new_unit = corpus.Interner().Intern(unit)
+    self.assertIs(new_unit.Lookup("a.A"), new_unit.Lookup("b.A"))
+    self.assertEquals(["a", "b"], [m.name for m in new_unit.modules])
+
+  def testInternKeepsUnionOrder(self):
+    a = self.Parse("def f(x: int or str) -> ?", "a")
+    b = self.Parse("def f(x: str or int) -> ?", "b")
+    interner = corpus.Interner()
+    interner.Intern(a)
+    new_b = interner.Intern(b)
+    self.assertIs(b, new_b)
+    self.assertMultiLineEqual(pytd.Print(b), pytd.Print(new_b))
+    self.assertEquals(0, interner.hits)
+
+  def testInternKeepsClassPointers(self):
+    src = """
+        class object:
+            pass
+        class A:
+            def f(self) -> A
+    """
+    a = visitors.LookupClasses(self.Parse(src, "a"))
+    b = visitors.LookupClasses(self.Parse(src, "b"))
+    interner = corpus.Interner()
+    interner.Intern(a)
+    new_b = interner.Intern(b)
+    cls = new_b.Lookup("A")
+    self.assertIs(cls, cls.Lookup("f").signatures[0].return_type.cls)
+    self.assertIsNot(a.Lookup("A"), cls)
+    # Same pointers, so this one is interned:
+    c = interner.Intern(a.Replace(name="c"))
+    self.assertIs(a.Lookup("A"), c.Lookup("A"))
+
+  def testLoadCorpus(self):
+    tmpdir = tempfile.mkdtemp()
+    try:
+      unit = self.Parse("def f() -> int", "foo")
+      filenames = [os.path.join(tmpdir, "foo.pytd"),
+                   os.path.join(tmpdir, "bar.pytdb")]
+      with open(filenames[0], "w") as fi:
+        fi.write("def f() -> int\n")
+      with open(filenames[1], "wb") as fi:
+        fi.write(pytdb.Dump(unit.Replace(name="bar")))
+      foo, bar = corpus.LoadCorpus(filenames)
+      self.assertEquals("foo", foo.name)
+      self.assertEquals("bar", bar.name)
+      self.assertIs(foo.Lookup("f"), bar.Lookup("f"))
+    finally:
+      shutil.rmtree(tmpdir)
+
+  def testBuiltins(self):
+    unit = builtins.GetBuiltins()
+    self.assertIs(unit.Lookup("os.stat"), unit.Lookup("posix.stat"))
+
+
+if __name__ == "__main__":
+  unittest.main()
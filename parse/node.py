@@ -52,6 +52,11 @@ The Node "class" differs from namedtuple in the following ways:
 2.) Visitor interface. See documentation of Visit() below.
 3.) Subclassed __str__ function that uses the current class name instead of
     the name of the tuple this class is based on.
+4.) No per-instance __dict__. Node classes (and their subclasses, as long as
+    they also declare "__slots__ = ()") are as small as the tuple holding their
+    children. CPython doesn't allow non-empty __slots__ on tuple subclasses, so
+    a node type that needs to carry extra state has to leave out __slots__,
+    and will get a __dict__ back.
 
 See http://bugs.python.org/issue16279 for why it is unlikely for any these
 functionalities to be made part of collections.namedtuple.
@@ -81,6 +86,8 @@ def Node(*child_names):
   class NamedTupleNode(namedtuple_type):
     """A Node class based on namedtuple."""
 
+    __slots__ = ()
+
     def __eq__(self, other):
       """Compare two nodes for equality.
 
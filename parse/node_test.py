@@ -150,6 +150,16 @@ class TestNode(unittest.TestCase):
     with self.assertRaises(AttributeError):
       n2.x.b = 3
 
+  def testSlots(self):
+    """Test that node.Node doesn't allocate a __dict__ per instance."""
+
+    class Slotted(node.Node("a", "b")):
+      __slots__ = ()
+
+    n = Slotted(1, 2)
+    with self.assertRaises(AttributeError):
+      n.c = 3
+
   def testVisitor1(self):
     """Test node.Node.Visit() for a visitor that modifies leaf nodes."""
     data = Data(42, 43, 44)
@@ -0,0 +1,246 @@
+# -*- coding:utf-8; python-indent:2; indent-tabs-mode:nil -*-
+
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Incremental conversion of ASTs back to pytd source code.
+
+This produces the same output as visitors.PrintVisitor, but instead of
+building up strings for every level of the tree and joining them together, it
+generates the output as a sequence of chunks (one per top-level definition),
+which can be written to a file as they're generated. Also, a Printer instance
+remembers the printed form of classes, functions and constants, so printing a
+tree that shares most of its nodes with a previously printed one is cheap.
+
+Example:
+  printer = Printer()
+  with open("foo.pytd", "w") as fi:
+    printer.Write(unit, fi)
+"""
+
+from pytypedecl import pytd
+from pytypedecl.parse import visitors
+
+
+class Printer(object):
+  """Converts ASTs back to pytd source code. See module docstring."""
+
+  INDENT = visitors.PrintVisitor.INDENT
+
+  # Node types whose printed form is memoized.
+  _CACHED_TYPES = (pytd.Class, pytd.Function, pytd.Constant)
+
+  def __init__(self):
+    # Maps (id(node), class name) to (node, printed form). We store the node
+    # itself to keep it alive, so that its id stays valid.
+    self._cache = {}
+
+  def Print(self, node):
+    """Convert a node to a string."""
+    return "".join(self.Chunks(node))
+
+  def Write(self, node, out):
+    """Write the printed form of a node to a file-like object."""
+    for chunk in self.Chunks(node):
+      out.write(chunk)
+
+  def Chunks(self, node):
+    """Generate the printed form of a node, in chunks.
+
+    Args:
+      node: A pytd node. Typically a TypeDeclUnit.
+
+    Yields:
+      Strings. Concatenated, they're the same as pytd.Print(node).
+    """
+    if isinstance(node, pytd.TypeDeclUnit):
+      for chunk in self._UnitChunks(node):
+        yield chunk
+    else:
+      yield self._Print(node, None)
+
+  def _UnitChunks(self, unit):
+    """Generate the contents of a module, and, recursively, its submodules."""
+    need_separator = False
+    for section in (unit.constants, unit.functions, unit.classes,
+                    unit.modules):
+      if not section:
+        continue
+      if need_separator:
+        yield "\n\n"
+      need_separator = True
+      for i, item in enumerate(section):
+        if i:
+          yield "\n"
+        if isinstance(item, pytd.TypeDeclUnit):
+          for chunk in self._UnitChunks(item):
+            yield chunk
+        else:
+          yield self._Print(item, None)
+
+  def _Print(self, node, class_name):
+    """Convert a node to a string.
+
+    Args:
+      node: A pytd node.
+      class_name: The (printed) name of the class we're in, or None.
+
+    Returns:
+      A string.
+
+    Raises:
+      AssertionError: If we don't know how to print this type of node.
+    """
+    if isinstance(node, self._CACHED_TYPES):
+      key = (id(node), class_name)
+      entry = self._cache.get(key)
+      if entry is None:
+        entry = self._cache[key] = (node, self._Dispatch(node, class_name))
+      return entry[1]
+    return self._Dispatch(node, class_name)
+
+  def _Dispatch(self, node, class_name):
+    # Like node.Visit, we go by the *actual* class of the node.
+    node_class_name = node.__class__.__name__
+    method = getattr(self, "_Print" + node_class_name, None)
+    if method is None:
+      raise AssertionError("Unimplemented visitor: " + node_class_name)
+    return method(node, class_name)
+
+  def _SafeName(self, name):
+    if not visitors.PrintVisitor._VALID_NAME.match(name):  # pylint: disable=protected-access
+      return r"`" + name + r"`"
+    else:
+      return name
+
+  def _Join(self, separator, nodes, class_name=None):
+    return separator.join(self._Print(n, class_name) for n in nodes)
+
+  def _PrintTypeDeclUnit(self, node, unused_class_name):
+    return "".join(self._UnitChunks(node))
+
+  def _PrintConstant(self, node, unused_class_name):
+    return self._SafeName(node.name) + ": " + self._Print(node.type, None)
+
+  def _PrintClass(self, node, unused_class_name):
+    """Print a class, as a multi-line, properly indented string."""
+    template = self._Join(", ", node.template)
+    class_name = self._SafeName(node.name)
+    if template:
+      class_name += "<" + template + ">"
+    parents = [self._Print(p, class_name) for p in node.parents]
+    if parents == ["object"]:
+      parents = ""  # object is the default superclass
+    elif parents:
+      parents = "(" + ", ".join(parents) + ")"
+    else:
+      parents = "(nothing)"
+    lines = ["class " + class_name + parents + ":"]
+    if node.methods or node.constants:
+      lines.extend(self.INDENT + self._Print(c, class_name)
+                   for c in node.constants)
+      for m in node.methods:
+        # Indent every line of every signature. (Lines that are empty stay
+        # empty - we don't want trailing whitespace.)
+        lines.extend(self.INDENT + line if line else line
+                     for line in self._Print(m, class_name).splitlines())
+    else:
+      lines.append(self.INDENT + "pass")
+    return "\n".join(lines) + "\n"
+
+  def _PrintFunction(self, node, class_name):
+    """Print a function, one line (or more) per signature."""
+    prefix = "def " + self._SafeName(node.name)
+    return "\n".join(prefix + self._Print(sig, class_name)
+                     for sig in node.signatures)
+
+  def _PrintSignature(self, node, class_name):
+    """Print a signature, without the function name."""
+    template = self._Join(", ", node.template)
+    if template:
+      template = "<" + template + ">"
+    params = [self._Print(p, class_name) for p in node.params]
+    if node.has_optional:
+      params.append("...")
+    ret = " -> " + self._Print(node.return_type, class_name)
+    if node.exceptions:
+      exc = " raises " + self._Join(", ", node.exceptions, class_name)
+    else:
+      exc = ""
+    body = "".join("\n{indent}{name} := {new_type}".format(
+        indent=self.INDENT, name=p.name,
+        new_type=self._Print(p.new_type, None))
+                   for p in node.params
+                   if isinstance(p, pytd.MutableParameter))
+    if body:
+      body = ":" + body
+    return "{template}({params}){ret}{exc}{body}".format(
+        template=template, params=", ".join(params),
+        ret=ret, exc=exc, body=body)
+
+  def _PrintParameter(self, node, class_name):
+    param_type = self._Print(node.type, class_name)
+    if param_type == "object":
+      # Abbreviated form. "object" is the default.
+      return node.name
+    elif node.name == "self" and class_name and param_type == class_name:
+      return self._SafeName(node.name)
+    else:
+      return self._SafeName(node.name) + ": " + param_type
+
+  def _PrintMutableParameter(self, node, class_name):
+    return self._PrintParameter(node, class_name)
+
+  def _PrintTemplateItem(self, node, unused_class_name):
+    type_param = self._Print(node.type_param, None)
+    within_type = self._Print(node.within_type, None)
+    if within_type == "object":
+      return type_param
+    else:
+      return type_param + " extends " + within_type
+
+  def _PrintNamedType(self, node, unused_class_name):
+    return self._SafeName(node.name)
+
+  def _PrintNativeType(self, node, unused_class_name):
+    return self._SafeName(node.python_type.__name__)
+
+  def _PrintAnythingType(self, unused_node, unused_class_name):
+    return "?"
+
+  def _PrintNothingType(self, unused_node, unused_class_name):
+    return "nothing"
+
+  def _PrintClassType(self, node, unused_class_name):
+    return self._SafeName(node.name)
+
+  def _PrintTypeParameter(self, node, unused_class_name):
+    return self._SafeName(node.name)
+
+  def _PrintHomogeneousContainerType(self, node, class_name):
+    return (self._Print(node.base_type, class_name) + "<" +
+            self._Print(node.element_type, class_name) + ">")
+
+  def _PrintGenericType(self, node, class_name):
+    # The syntax for a parameterized type with one parameter is "X<T,>"
+    # (E.g. "tuple<int,>")
+    params = [self._Print(p, class_name) for p in node.parameters]
+    return (self._Print(node.base_type, class_name) + "<" +
+            params[0] + ", " + ", ".join(params[1:]) + ">")
+
+  def _PrintUnionType(self, node, class_name):
+    return self._Join(" or ", node.type_list, class_name)
+
+  def _PrintIntersectionType(self, node, class_name):
+    return self._Join(" and ", node.type_list, class_name)
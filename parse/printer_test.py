@@ -0,0 +1,90 @@
+"""Tests for parse.printer."""
+
+import re
+import StringIO
+import textwrap
+import unittest
+
+
+from pytypedecl import pytd
+from pytypedecl.parse import builtins
+from pytypedecl.parse import parser
+from pytypedecl.parse import printer
+from pytypedecl.parse import visitors
+
+
+def _PrintWithVisitor(node):
+  """The reference implementation."""
+  res = node.Visit(visitors.PrintVisitor())
+  return re.sub(r" +\n", "\n", res)
+
+
+class PrinterTest(unittest.TestCase):
+
+  def setUp(self):
+    self.parser = parser.TypeDeclParser()
+
+  def Parse(self, src):
+    return self.parser.Parse(textwrap.dedent(src))
+
+  def testSameAsVisitor(self):
+    unit = self.Parse("""
+        x: int
+        y: list<int>
+        def foo(a, b: int or float, ...) -> tuple<int,> raises X, Y
+        def foo<T>(a: T) -> T
+        def `foo-bar`(self) -> ?
+        class A(nothing):
+            pass
+        class B<T extends float>(A, list<T>):
+            c: nothing
+            def bar(self) -> int
+            def bar(self: B<T>, x: T) -> B<T>:
+                self := B<T or int>
+        class C:
+            def baz(self, x: int and float) -> C
+    """)
+    self.assertMultiLineEqual(_PrintWithVisitor(unit),
+                              printer.Printer().Print(unit))
+    for node in unit.constants + unit.functions + unit.classes:
+      self.assertMultiLineEqual(_PrintWithVisitor(node),
+                                printer.Printer().Print(node))
+
+  def testBuiltinsSameAsVisitor(self):
+    unit = builtins.GetBuiltins()
+    self.assertMultiLineEqual(_PrintWithVisitor(unit), pytd.Print(unit))
+
+  def testWrite(self):
+    unit = self.Parse("""
+        x: int
+        def foo() -> int
+        class A:
+            pass
+    """)
+    out = StringIO.StringIO()
+    pytd.Print(unit, out)
+    self.assertMultiLineEqual(pytd.Print(unit), out.getvalue())
+    self.assertGreater(len(list(printer.Printer().Chunks(unit))), 1)
+
+  def testMemoize(self):
+    unit = self.Parse("""
+        def foo() -> int
+        class A:
+            def bar(self) -> float
+    """)
+    p = printer.Printer()
+    old = p.Print(unit)
+    new_function = unit.functions[0].Replace(name="foo2")
+    new_unit = unit.Replace(functions=(new_function,))
+    self.assertMultiLineEqual(old.replace("foo", "foo2"), p.Print(new_unit))
+    # The class was only printed once, since it's shared between old and new.
+    self.assertEquals(1, sum(1 for node, _ in p._cache.values()
+                             if node is unit.classes[0]))
+
+  def testUnimplemented(self):
+    self.assertRaises(AssertionError, printer.Printer().Print,
+                      pytd.Scalar(42))
+
+
+if __name__ == "__main__":
+  unittest.main()
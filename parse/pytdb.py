@@ -0,0 +1,440 @@
+# -*- coding:utf-8; python-indent:2; indent-tabs-mode:nil -*-
+
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compact binary serialization of pytd trees (.pytdb files).
+
+Loading a .pytdb file is much faster than parsing the corresponding .pytd
+file. Unlike pickle, the format preserves ClassType pointers, and stores every
+distinct subtree only once.
+
+File layout:
+  MAGIC
+  varint: FORMAT_VERSION
+  varint + bytes: GRAMMAR_VERSION (identifies the pytd node definitions)
+  varint + bytes: string table (all strings, concatenated)
+  varints, until the end of the file:
+    number of strings, followed by the length of each string
+    number of records, index of the root record
+    number of fix-ups, followed by (ClassType record, Class record) pairs
+    the records
+
+Every value in the tree (nodes, strings, tuples, etc.) is a record, consisting
+of a tag (see _TAG_* and _NODE_TYPES) followed by tag-specific data. For nodes
+and sequences, that's the indices of the child records, which always precede
+their parent. Structurally identical records are only stored once.
+
+ClassType.cls can't be stored as a child, since it makes the tree cyclic.
+Instead, we record it in the fix-up table, and fill it in after all records
+have been loaded. If a ClassType points to a class outside of the tree being
+stored (e.g. into the builtins), that class is stored, too.
+
+This module can also be used as a command-line tool, for compiling .pytd
+files:
+  python -m pytypedecl.parse.pytdb [-o OUTPUT_DIR] DIR_OR_FILE...
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+
+
+from pytypedecl import pytd
+from pytypedecl.parse import parser
+
+
+MAGIC = "PYTDB"
+FORMAT_VERSION = 1
+
+# Tags for values that aren't nodes.
+_TAG_NONE = 0
+_TAG_FALSE = 1
+_TAG_TRUE = 2
+_TAG_INT = 3
+_TAG_STR = 4
+_TAG_UNICODE = 5
+_TAG_FLOAT = 6
+_TAG_TUPLE = 7
+_TAG_LIST = 8
+_TAG_TYPE = 9  # A Python type, as used in NativeType
+_FIRST_NODE_TAG = 16
+
+# All node types we can store. Only ever append to this list: The position in
+# the list determines the tag.
+_NODE_TYPES = (
+    pytd.TypeDeclUnit, pytd.Constant, pytd.Class, pytd.Function,
+    pytd.Signature, pytd.Parameter, pytd.MutableParameter,
+    pytd.TypeParameter, pytd.TemplateItem, pytd.NamedType, pytd.NativeType,
+    pytd.ClassType, pytd.AnythingType, pytd.NothingType, pytd.Scalar,
+    pytd.UnionType, pytd.IntersectionType, pytd.GenericType,
+    pytd.HomogeneousContainerType)
+
+# Changes whenever a node type gets added, renamed, or gets different fields.
+GRAMMAR_VERSION = hashlib.sha1(";".join(
+    "%s(%s)" % (cls.__name__, ",".join(cls._fields))
+    for cls in _NODE_TYPES)).hexdigest()[:16]
+
+_NODE_TAGS = {cls: _FIRST_NODE_TAG + i for i, cls in enumerate(_NODE_TYPES)}
+
+# Python types that can be stored as values (e.g. in NativeType), by their
+# qualified name. Loading never imports modules, so no other types can be
+# stored.
+_PYTHON_TYPES = {t.__module__ + "." + t.__name__: t
+                 for t in (bool, complex, float, int, long, str, unicode,
+                           type(None)) + _NODE_TYPES}
+
+# Records whose identity matters (because they're mutable, or compare by
+# identity). These are never merged with other records that have the same
+# contents.
+_IDENTITY_TYPES = (pytd.TypeDeclUnit, pytd.ClassType, list)
+
+
+class LoadError(Exception):
+  """Raised if a .pytdb file is corrupt or was written by a different version."""
+
+
+def _HasPlainConstructor(cls):
+  """Whether cls(*args) is the same as tuple.__new__(cls, args)."""
+  for c in cls.__mro__:
+    if "__new__" in c.__dict__:
+      # The namedtuple base class of nodes defines both _fields and __new__.
+      return "_fields" in c.__dict__
+  return False
+
+
+# Maps tags to (node type, number of children, plain constructor?).
+_NODE_INFO = [(cls, len(cls._fields), _HasPlainConstructor(cls))
+              for cls in _NODE_TYPES]
+
+
+def _WriteVarint(out, n):
+  """Append a non-negative integer to a bytearray, in LEB128 encoding."""
+  while n >= 0x80:
+    out.append((n & 0x7f) | 0x80)
+    n >>= 7
+  out.append(n)
+
+
+def _ReadVarint(data, pos):
+  """Read a varint from a bytearray. Returns (value, new position)."""
+  value = shift = 0
+  while True:
+    b = data[pos]
+    pos += 1
+    value |= (b & 0x7f) << shift
+    if b < 0x80:
+      return value, pos
+    shift += 7
+
+
+def _DecodeVarints(data):
+  """Decode a bytearray consisting only of varints into a list of ints."""
+  result = []
+  append = result.append
+  value = shift = 0
+  for b in data:
+    if b < 0x80:
+      append(value | (b << shift))
+      value = shift = 0
+    else:
+      value |= (b & 0x7f) << shift
+      shift += 7
+  if shift:
+    raise LoadError("Truncated data")
+  return result
+
+
+class _Dumper(object):
+  """Converts a tree to records. Used by Dump()."""
+
+  def __init__(self):
+    self.strings = []
+    self.string_index = {}
+    self.records = []  # a flat list of ints: tags and data
+    self.record_count = 0
+    self.identity_memo = {}  # id(value) -> (value, record index)
+    self.content_memo = {}  # (tag, data...) -> record index
+    self.pending_fixups = []  # (record index of ClassType, Class)
+    self.fixups = []  # (record index of ClassType, record index of Class)
+
+  def String(self, s):
+    index = self.string_index.get(s)
+    if index is None:
+      index = self.string_index[s] = len(self.strings)
+      self.strings.append(s)
+    return index
+
+  def Add(self, value):
+    """Add a value, and all its children, and return its record index."""
+    entry = self.identity_memo.get(id(value))
+    if entry is not None:
+      return entry[1]
+    record = self._Encode(value)
+    if isinstance(value, _IDENTITY_TYPES):
+      index = None
+    else:
+      index = self.content_memo.get(record)
+    if index is None:
+      index = self.record_count
+      self.record_count += 1
+      self.records.extend(record)
+      self.content_memo[record] = index
+    self.identity_memo[id(value)] = (value, index)
+    if isinstance(value, pytd.ClassType) and value.cls is not None:
+      self.pending_fixups.append((index, value.cls))
+    return index
+
+  def AddFixups(self):
+    """Add the classes ClassTypes point to. This might add more fixups."""
+    while self.pending_fixups:
+      index, cls = self.pending_fixups.pop()
+      self.fixups.append((index, self.Add(cls)))
+
+  def _Encode(self, value):
+    """Convert a value to a tuple of ints, adding its children if necessary."""
+    tag = _NODE_TAGS.get(value.__class__)
+    if tag is not None:
+      return (tag,) + tuple(self.Add(child) for child in value)
+    elif value is None:
+      return (_TAG_NONE,)
+    elif value is False:
+      return (_TAG_FALSE,)
+    elif value is True:
+      return (_TAG_TRUE,)
+    elif isinstance(value, (int, long)):
+      # Zigzag encoding, so that negative numbers have short encodings, too.
+      return (_TAG_INT, value * 2 if value >= 0 else -value * 2 - 1)
+    elif isinstance(value, str):
+      return (_TAG_STR, self.String(value))
+    elif isinstance(value, unicode):
+      return (_TAG_UNICODE, self.String(value.encode("utf-8")))
+    elif isinstance(value, float):
+      return (_TAG_FLOAT, self.String(repr(value)))
+    elif isinstance(value, (tuple, list)):
+      # LazyModules stands in for a tuple.
+      tag = (_TAG_TUPLE if isinstance(value, (tuple, pytd.LazyModules))
+             else _TAG_LIST)
+      return (tag, len(value)) + tuple(self.Add(child) for child in value)
+    elif (isinstance(value, type) and _PYTHON_TYPES.get(
+        value.__module__ + "." + value.__name__) is value):
+      return (_TAG_TYPE, self.String(value.__module__ + "." + value.__name__))
+    else:
+      raise TypeError("Can't serialize %r" % (value,))
+
+  def Serialize(self, root_index):
+    """Produce the .pytdb file contents, as a string."""
+    out = bytearray(MAGIC)
+    _WriteVarint(out, FORMAT_VERSION)
+    _WriteVarint(out, len(GRAMMAR_VERSION))
+    out.extend(GRAMMAR_VERSION)
+    blob = "".join(self.strings)
+    _WriteVarint(out, len(blob))
+    out.extend(blob)
+    _WriteVarint(out, len(self.strings))
+    for s in self.strings:
+      _WriteVarint(out, len(s))
+    _WriteVarint(out, self.record_count)
+    _WriteVarint(out, root_index)
+    _WriteVarint(out, len(self.fixups))
+    for classtype_index, cls_index in self.fixups:
+      _WriteVarint(out, classtype_index)
+      _WriteVarint(out, cls_index)
+    for n in self.records:
+      _WriteVarint(out, n)
+    return str(out)
+
+
+def Dump(node):
+  """Serialize a pytd tree.
+
+  Args:
+    node: A pytd node, typically a TypeDeclUnit.
+
+  Returns:
+    A string, in .pytdb format.
+
+  Raises:
+    TypeError: If the tree contains values we can't store.
+  """
+  dumper = _Dumper()
+  root = dumper.Add(node)
+  dumper.AddFixups()
+  return dumper.Serialize(root)
+
+
+def _LoadType(qualified_name):
+  try:
+    return _PYTHON_TYPES[qualified_name]
+  except KeyError:
+    raise LoadError("Unsupported type %s" % qualified_name)
+
+
+def Load(data):
+  """Deserialize a pytd tree.
+
+  Args:
+    data: A string, as produced by Dump().
+
+  Returns:
+    A pytd node.
+
+  Raises:
+    LoadError: If the data isn't in .pytdb format, or if it was written by an
+      incompatible version of this module or of pytd.
+  """
+  data = bytearray(data)
+  if len(data) <= len(MAGIC) or data[:len(MAGIC)] != MAGIC:
+    raise LoadError("Not a .pytdb file")
+  try:
+    return _Decode(data)
+  except LoadError:
+    raise
+  except Exception as e:  # pylint: disable=broad-except
+    # Corrupt data can make any part of the decoding fail, including the
+    # constructors of the nodes.
+    raise LoadError("Corrupt data: %s: %s" % (type(e).__name__, e))
+
+
+def _Decode(data):
+  """Implementation of Load(), after checking the magic number."""
+  try:
+    version, pos = _ReadVarint(data, len(MAGIC))
+    if version != FORMAT_VERSION:
+      raise LoadError("Unsupported format version %d" % version)
+    length, pos = _ReadVarint(data, pos)
+    grammar = str(data[pos:pos + length])
+    if grammar != GRAMMAR_VERSION:
+      raise LoadError("Written for different pytd grammar %s" % grammar)
+    length, pos = _ReadVarint(data, pos + length)
+    blob = str(data[pos:pos + length])
+    ints = _DecodeVarints(data[pos + length:])
+  except IndexError:
+    raise LoadError("Truncated data")
+
+  records = []
+  append = records.append
+  new_tuple = tuple.__new__
+  node_info = _NODE_INFO
+  try:
+    num_strings = ints[0]
+    strings = []
+    pos = 0
+    for length in ints[1:1 + num_strings]:
+      strings.append(blob[pos:pos + length])
+      pos += length
+
+    pos = 1 + num_strings
+    num_records, root, num_fixups = ints[pos:pos + 3]
+    pos += 3
+    fixups = ints[pos:pos + 2 * num_fixups]
+    pos += 2 * num_fixups
+
+    for _ in xrange(num_records):
+      tag = ints[pos]
+      if tag >= _FIRST_NODE_TAG:
+        cls, arity, plain = node_info[tag - _FIRST_NODE_TAG]
+        children = [records[i] for i in ints[pos + 1:pos + 1 + arity]]
+        pos += 1 + arity
+        append(new_tuple(cls, children) if plain else cls(*children))
+      elif tag == _TAG_STR:
+        append(strings[ints[pos + 1]])
+        pos += 2
+      elif tag == _TAG_TUPLE or tag == _TAG_LIST:
+        length = ints[pos + 1]
+        children = [records[i] for i in ints[pos + 2:pos + 2 + length]]
+        pos += 2 + length
+        append(tuple(children) if tag == _TAG_TUPLE else children)
+      elif tag <= _TAG_TRUE:
+        append((None, False, True)[tag])
+        pos += 1
+      elif tag == _TAG_INT:
+        n = ints[pos + 1]
+        append(n >> 1 if not n & 1 else -(n >> 1) - 1)
+        pos += 2
+      elif tag == _TAG_UNICODE:
+        append(strings[ints[pos + 1]].decode("utf-8"))
+        pos += 2
+      elif tag == _TAG_FLOAT:
+        append(float(strings[ints[pos + 1]]))
+        pos += 2
+      elif tag == _TAG_TYPE:
+        append(_LoadType(strings[ints[pos + 1]]))
+        pos += 2
+      else:
+        raise LoadError("Invalid tag %d" % tag)
+    if pos != len(ints):
+      raise LoadError("Wrong number of records")
+    for i in xrange(0, len(fixups), 2):
+      records[fixups[i]].cls = records[fixups[i + 1]]
+    return records[root]
+  except (IndexError, ValueError):
+    raise LoadError("Corrupt data")
+
+
+def CompileFile(src, dst, name=None, pytd_parser=None):
+  """Compile a .pytd file to a .pytdb file.
+
+  Args:
+    src: Name of the .pytd file.
+    dst: Name of the .pytdb file to write.
+    name: Module name. Defaults to the base name of src, without extension.
+    pytd_parser: Optional parser.TypeDeclParser to use. Reusing the same
+      parser for multiple files is faster.
+  """
+  pytd_parser = pytd_parser or parser.TypeDeclParser()
+  name = name or os.path.splitext(os.path.basename(src))[0]
+  with open(src) as fi:
+    unit = pytd_parser.Parse(fi.read(), name=name, filename=src)
+  with open(dst, "wb") as fi:
+    fi.write(Dump(unit))
+
+
+def main(argv=None):
+  """Compile .pytd files, or directories of .pytd files, to .pytdb files."""
+  argument_parser = argparse.ArgumentParser(
+      description="Compile .pytd files to .pytdb files.")
+  argument_parser.add_argument(
+      "inputs", nargs="+", metavar="DIR_OR_FILE",
+      help=".pytd files, or directories to search for .pytd files")
+  argument_parser.add_argument(
+      "-o", "--output-dir", default=None,
+      help="Where to write the .pytdb files. Default: next to the .pytd files")
+  args = argument_parser.parse_args(argv)
+
+  sources = []  # (source file, path relative to the output directory)
+  for path in args.inputs:
+    if os.path.isdir(path):
+      for dirpath, _, filenames in os.walk(path):
+        sources.extend((os.path.join(dirpath, f),
+                        os.path.relpath(os.path.join(dirpath, f), path))
+                       for f in sorted(filenames) if f.endswith(".pytd"))
+    else:
+      sources.append((path, os.path.basename(path)))
+
+  pytd_parser = parser.TypeDeclParser()
+  for src, relative in sources:
+    if args.output_dir:
+      dst = os.path.join(args.output_dir, relative) + "b"
+      if not os.path.isdir(os.path.dirname(dst)):
+        os.makedirs(os.path.dirname(dst))
+    else:
+      dst = src + "b"
+    CompileFile(src, dst, pytd_parser=pytd_parser)
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,141 @@
+"""Tests for parse.pytdb."""
+
+import os
+import shutil
+import tempfile
+import textwrap
+import unittest
+
+
+from pytypedecl import pytd
+from pytypedecl.parse import builtins
+from pytypedecl.parse import parser
+from pytypedecl.parse import pytdb
+from pytypedecl.parse import visitors
+
+
+class PytdbTest(unittest.TestCase):
+
+  def setUp(self):
+    self.parser = parser.TypeDeclParser()
+
+  def Parse(self, src):
+    return self.parser.Parse(textwrap.dedent(src), name="test")
+
+  def testRoundTrip(self):
+    unit = self.Parse("""
+        x: int
+        def foo(a, b: int or float, ...) -> tuple<int,> raises X
+        def foo<T>(a: T) -> list<T>
+        class A<T extends float>(list<T>):
+            c: nothing
+            def bar(self, x: int and float) -> ?:
+                self := A<T or int>
+    """)
+    loaded = pytd.Load(pytd.Dump(unit))
+    self.assertEquals(unit.name, loaded.name)
+    self.assertEquals(unit.constants, loaded.constants)
+    self.assertEquals(unit.functions, loaded.functions)
+    self.assertEquals(unit.classes, loaded.classes)
+    self.assertMultiLineEqual(pytd.Print(unit), pytd.Print(loaded))
+
+  def testBuiltins(self):
+    unit = builtins.GetBuiltins()
+    loaded = pytd.Load(pytd.Dump(unit))
+    self.assertMultiLineEqual(pytd.Print(unit), pytd.Print(loaded))
+    self.assertEquals([m.name for m in unit.modules],
+                      [m.name for m in loaded.modules])
+
+  def testValues(self):
+    values = (None, True, False, 0, 1, -1, 2**70, -2**70, 3.25, "foo",
+              u"b\xe4r", [1, 2], (), pytd.NativeType(int))
+    loaded = pytd.Load(pytd.Dump(pytd.Scalar(values)))
+    self.assertEquals(pytd.Scalar(values), loaded)
+    self.assertIsInstance(loaded.value[10], unicode)
+    self.assertIsInstance(loaded.value[11], list)
+
+  def testSharing(self):
+    t = pytd.UnionType((pytd.NamedType("int"), pytd.NamedType("float")))
+    f = pytd.Constant("x", t)
+    g = pytd.Constant("y", pytd.UnionType((pytd.NamedType("int"),
+                                           pytd.NamedType("float"))))
+    loaded = pytd.Load(pytd.Dump((f, g)))
+    self.assertIs(loaded[0].type, loaded[1].type)
+    self.assertEquals(t, loaded[0].type)
+
+  def testClassTypePointers(self):
+    unit = self.Parse("""
+        class A:
+            def foo(self) -> A
+        class B(A):
+            def bar(self, x: B) -> int
+    """)
+    unit = visitors.LookupClasses(unit, global_module=builtins.GetBuiltins())
+    loaded = pytd.Load(pytd.Dump(unit))
+    loaded.Visit(visitors.VerifyLookup())
+    a, b = loaded.classes
+    self.assertIs(a, a.Lookup("foo").signatures[0].return_type.cls)
+    self.assertIs(a, b.parents[0].cls)
+    self.assertIs(b, b.Lookup("bar").signatures[0].params[1].type.cls)
+    # Pointers into the builtins are preserved, too.
+    self.assertEquals("int",
+                      b.Lookup("bar").signatures[0].return_type.cls.name)
+
+  def testLoadErrors(self):
+    data = pytdb.Dump(pytd.NamedType("int"))
+    self.assertRaises(pytdb.LoadError, pytdb.Load, "garbage")
+    self.assertRaises(pytdb.LoadError, pytdb.Load, data[:-1])
+    self.assertRaises(pytdb.LoadError, pytdb.Load,
+                      data.replace(pytdb.GRAMMAR_VERSION, "0" * 16))
+    bad_version = bytearray(data)
+    bad_version[len(pytdb.MAGIC)] = pytdb.FORMAT_VERSION + 1
+    self.assertRaises(pytdb.LoadError, pytdb.Load, str(bad_version))
+
+  def testLoadTruncatedOrCorrupt(self):
+    unit = self.Parse("""
+        x: float
+        def f(x: int or float) -> list<int>
+        class A:
+            def g(self) -> A
+    """)
+    data = pytdb.Dump(unit)
+    for i in xrange(len(data)):
+      self.assertRaises(pytdb.LoadError, pytdb.Load, data[:i])
+      for value in (0, 1, 3, 0x7f, 0x80, 0xff):
+        corrupt = bytearray(data)
+        corrupt[i] = value
+        try:
+          pytdb.Load(str(corrupt))
+        except pytdb.LoadError:
+          pass
+
+  def testDumpError(self):
+    self.assertRaises(TypeError, pytdb.Dump, pytd.Scalar(object()))
+    self.assertRaises(TypeError, pytdb.Dump, pytd.NativeType(object))
+
+  def testLoadUnknownType(self):
+    data = pytdb.Dump(pytd.NativeType(int))
+    self.assertIn("__builtin__.int", data)
+    for name in ("os.path.getsize", "no_such_mod.xyz", "__builtin__.map"):
+      self.assertRaises(pytdb.LoadError, pytdb.Load,
+                        data.replace("__builtin__.int", name))
+
+  def testMain(self):
+    src_dir = tempfile.mkdtemp()
+    out_dir = tempfile.mkdtemp()
+    try:
+      os.mkdir(os.path.join(src_dir, "sub"))
+      with open(os.path.join(src_dir, "sub", "foo.pytd"), "w") as fi:
+        fi.write("def f() -> int\n")
+      self.assertEquals(0, pytdb.main([src_dir, "-o", out_dir]))
+      with open(os.path.join(out_dir, "sub", "foo.pytdb"), "rb") as fi:
+        unit = pytdb.Load(fi.read())
+      self.assertEquals("foo", unit.name)
+      self.assertEquals("def f() -> int", pytd.Print(unit))
+    finally:
+      shutil.rmtree(src_dir)
+      shutil.rmtree(out_dir)
+
+
+if __name__ == "__main__":
+  unittest.main()
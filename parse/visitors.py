@@ -19,6 +19,7 @@
 # pylint: disable=g-importing-member
 
 import collections
+import itertools
 import re
 from pytypedecl import pytd
 
@@ -211,56 +212,12 @@ class StripSelf(object):
     return node.Replace(params=node.params[1:])
 
 
-class _FillInClasses(object):
-  """Fill in ClassType pointers using a symbol table.
-
-  This is an in-place visitor! It modifies the original tree. This is
-  necessary because we introduce loops.
-  """
-
-  def __init__(self, local_lookup, global_lookup):
-    """Create this visitor.
-
-    You're expected to then pass this instance to node.Visit().
-
-    Args:
-      local_lookup: Usually, the local module. Tried first when looking up
-        names.
-      global_lookup: Global symbols. Tried if a name doesn't exist locally.
-    """
-    self._local_lookup = local_lookup
-    self._global_lookup = global_lookup
-
-  def VisitClassType(self, node):
-    """Fills in a class type.
-
-    Args:
-      node: A ClassType. This node will have a name, which we use for lookup.
-
-    Returns:
-      The same ClassType. We will have filled in its "cls" attribute.
-
-    Raises:
-      KeyError: If we can't find a given class.
-    """
-    if node.cls is None:
-      try:
-        node.cls = self._local_lookup.Lookup(node.name)
-      except KeyError:
-        try:  # TODO: Remove this try/pass
-          node.cls = (self._global_lookup.Lookup and
-                      self._global_lookup.Lookup(node.name))
-        except KeyError:
-          if self._global_lookup.Lookup:
-            pass  # TODO: Shouldn't be needed
-          else:
-            raise
-    return node
-
-
 class ClearClassTypePointers(object):
   """For ClassType nodes: Set their cls pointer to None."""
 
+  def EnterTypeDeclUnit(self, node):
+    node._resolved = False  # pylint: disable=protected-access
+
   def EnterClassType(self, node):
     node.cls = None
 
@@ -297,7 +254,227 @@ class ClassTypeToNamedType(object):
     return pytd.NamedType(node.name)
 
 
-def FillInClasses(target, global_module=None):
+class UnresolvedNameError(ValueError):
+  """Raised by LookupClasses() if types refer to names that don't exist.
+
+  Attributes:
+    unresolved: A list of (name, context) tuples. "context" describes where
+      the name was used, e.g. "parameter x of os.stat".
+  """
+
+  def __init__(self, unresolved):
+    super(UnresolvedNameError, self).__init__(
+        "Unresolved name(s): " + ", ".join("%s (%s)" % (name, context)
+                                           for name, context in unresolved))
+    self.unresolved = unresolved
+
+
+class _CollectTypeReferences(object):
+  """Visitor that records all type references that need to be filled in.
+
+  This optionally also replaces NamedType nodes with (empty) ClassType nodes.
+  The "cls" pointers can't be filled in during the traversal: Visit() creates
+  the (new) classes they point to only after it has processed their contents.
+  """
+
+  def __init__(self, convert, overwrite):
+    self._convert = convert
+    self._overwrite = overwrite
+    self._scopes = ()  # Prefixes of the enclosing modules, like "os.path."
+    self._path = ()  # Names of the enclosing modules and definitions
+    self._parameter = None
+    self.references = []  # (ClassType, scopes, path, parameter)
+
+  def EnterTypeDeclUnit(self, node):
+    if self._scopes:
+      self._scopes += (self._scopes[-1] + node.name + ".",)
+      self._path += (node.name,)
+    else:
+      self._scopes = ("",)
+
+  def LeaveTypeDeclUnit(self, unused_node):
+    self._scopes = self._scopes[:-1]
+    if self._scopes:
+      self._path = self._path[:-1]
+
+  def _EnterDefinition(self, node):
+    self._path += (node.name,)
+
+  def _LeaveDefinition(self, unused_node):
+    self._path = self._path[:-1]
+
+  EnterClass = EnterFunction = EnterConstant = _EnterDefinition
+  LeaveClass = LeaveFunction = LeaveConstant = _LeaveDefinition
+
+  def _EnterParameter(self, node):
+    self._parameter = node.name
+
+  def _LeaveParameter(self, unused_node):
+    self._parameter = None
+
+  EnterParameter = EnterMutableParameter = _EnterParameter
+  LeaveParameter = LeaveMutableParameter = _LeaveParameter
+
+  def VisitNamedType(self, node):
+    if self._convert:
+      node = pytd.ClassType(node.name)
+      self.references.append((node, self._scopes, self._path, self._parameter))
+    return node
+
+  def VisitClassType(self, node):
+    if node.cls is None or self._overwrite:
+      self.references.append((node, self._scopes, self._path, self._parameter))
+    return node
+
+
+class Resolver(object):
+  """Resolves type references to classes, in a single traversal.
+
+  The tree is traversed once, to convert NamedType nodes and collect all the
+  ClassType nodes that need to be filled in. All the names are then looked up
+  in one symbol table that contains every constant, function, class and
+  submodule of the tree, under its dotted name (e.g. "os.stat").
+
+  A name used in a submodule is looked up in that submodule first, then in the
+  global module, and then in the enclosing modules, innermost first.
+  """
+
+  def __init__(self, global_module=None):
+    """Create a resolver.
+
+    Args:
+      global_module: Global symbols (e.g. builtins). Anything that has a
+        Lookup() method, like a TypeDeclUnit or an archive.Archive. Tried if a
+        name doesn't exist locally. If this is None, the top-level module of
+        the resolved tree is used. Lookups are cached, so if you resolve
+        several trees against the same global_module, reuse the Resolver.
+    """
+    self._global_module = global_module
+    self._global_symbols = {}  # name -> item, or None if it doesn't exist
+
+  def _LookupGlobal(self, name):
+    try:
+      return self._global_symbols[name]
+    except KeyError:
+      try:
+        item = self._global_module.Lookup(name)
+      except KeyError:
+        item = None
+      self._global_symbols[name] = item
+      return item
+
+  @staticmethod
+  def _BuildSymbolTable(node):
+    """Map the dotted names of all items in a tree to the items.
+
+    Args:
+      node: A TypeDeclUnit.
+
+    Returns:
+      A tuple (symbols, units). "symbols" maps dotted names to constants,
+      functions, classes and modules, "units" maps the prefixes used in
+      "symbols" (like "" or "os.") to the TypeDeclUnit they stand for.
+    """
+    symbols = {}
+    units = {}
+    stack = [("", node)]
+    while stack:
+      prefix, unit = stack.pop()
+      units[prefix] = unit
+      # Same precedence as TypeDeclUnit.Lookup(): Later sections win.
+      for section in (unit.constants, unit.functions, unit.classes,
+                      unit.modules):
+        for item in section:
+          symbols[prefix + item.name] = item
+      stack.extend((prefix + module.name + ".", module)
+                   for module in unit.modules)
+    return symbols, units
+
+  def Resolve(self, node, convert=True, overwrite=False, strict=True,
+              context=None):
+    """Fill in the "cls" pointers of all the ClassType nodes of a tree.
+
+    Args:
+      node: The pytd node to process. If this is a TypeDeclUnit, its contents
+        are used for lookups.
+      convert: If True, NamedType nodes are replaced with ClassType nodes
+        first. Otherwise they're left alone.
+      overwrite: If we should overwrite the "cls" pointer of existing ClassType
+        nodes. Otherwise, they're only written if they are None.
+      strict: If True, raise an error if a name doesn't exist. Otherwise,
+        leave the "cls" pointer of such ClassType nodes at None.
+      context: Optionally, a pytd.ResolutionContext. If given, ClassType nodes
+        store symbol IDs into this context, instead of "cls" pointers, and the
+        context is bound to the new tree.
+
+    Returns:
+      The new tree. Existing ClassType nodes are modified in-place.
+
+    Raises:
+      UnresolvedNameError: If strict is True, and we can't find a name.
+    """
+    collector = _CollectTypeReferences(convert, overwrite)
+    node = node.Visit(collector)
+    if isinstance(node, pytd.TypeDeclUnit):
+      symbols, units = self._BuildSymbolTable(node)
+    else:
+      symbols, units = {}, {}
+
+    def LookupLocal(prefix, name):
+      item = symbols.get(prefix + name)
+      if item is None and "." in name and prefix in units:
+        try:  # E.g. a constant within a class.
+          item = units[prefix].Lookup(name)
+        except KeyError:
+          pass
+      return item
+
+    if self._global_module is None:
+      lookup_global = lambda name: LookupLocal("", name)
+    else:
+      lookup_global = self._LookupGlobal
+
+    if context is not None:
+      context.Bind(node if isinstance(node, pytd.TypeDeclUnit) else None,
+                   self._global_module)
+
+    unresolved = []
+    for t, scopes, path, parameter in collector.references:
+      name = t.name
+      cls = None
+      if scopes:
+        prefix = scopes[-1]
+        cls = LookupLocal(prefix, name)
+      if cls is None:
+        prefix = None
+        cls = lookup_global(name)
+      if cls is None:
+        for prefix in reversed(scopes[:-1]):
+          cls = LookupLocal(prefix, name)
+          if cls is not None:
+            break
+      if cls is not None:
+        if context is None:
+          t.cls = cls
+        elif prefix is None:
+          t.SetSymbol(context, context.Add(
+              name, cls, is_global=self._global_module is not None))
+        else:
+          t.SetSymbol(context, context.Add(prefix + name, cls))
+      else:
+        t.cls = None
+        if strict:
+          where = ".".join(path) or "top level"
+          if parameter:
+            unresolved.append((name, "parameter %s of %s" % (parameter, where)))
+          else:
+            unresolved.append((name, "in " + where))
+    if unresolved:
+      raise UnresolvedNameError(unresolved)
+    return node
+
+
+def FillInClasses(target, global_module=None, context=None):
   """Fill in class pointers in ClassType nodes for a PyTD object.
 
   This will adjust the "cls" pointer for existing ClassType nodes so that they
@@ -305,31 +482,21 @@ def FillInClasses(target, global_module=None):
   None, otherwise it will keep the old value.  Use the NamedTypeToClassType
   visitor to create the ClassType nodes in the first place. Use the
   ClearClassTypePointers visitor to set the "cls" pointers for already existing
-  ClassType nodes back to None.
+  ClassType nodes back to None. Names that can't be found are left at None.
 
   Args:
     target: The PyTD object to operate on. Changes will happen in-place. If this
       is a TypeDeclUnit it will also be used for lookups.
     global_module: Global symbols. Tried if a name doesn't exist locally. This
       is required if target is not a TypeDeclUnit.
+    context: Optionally, a pytd.ResolutionContext. If given, the ClassType
+      nodes will refer to their classes through it. See LookupClasses().
   """
-  if global_module is None:
-    global_module = target
-
-  if hasattr(target, "modules"):
-    for submodule in target.modules:
-      FillInClasses(submodule, global_module)
-
-  # Fill in classes for this module, bottom up.
-  # TODO: Node.Visit() should support blacklisting of attributes so
-  # we don't recurse into submodules multiple times.
-  if isinstance(target, pytd.TypeDeclUnit):
-    target.Visit(_FillInClasses(target, global_module))
-  else:
-    target.Visit(_FillInClasses(global_module, global_module))
+  Resolver(global_module).Resolve(target, convert=False, strict=False,
+                                  context=context)
 
 
-def LookupClasses(module, global_module=None, overwrite=False):
+def LookupClasses(module, global_module=None, overwrite=False, context=None):
   """Converts a module from one using NamedType to ClassType.
 
   Args:
@@ -338,23 +505,46 @@ def LookupClasses(module, global_module=None, overwrite=False):
     overwrite: If we should overwrite the "cls" pointer of existing ClassType
       nodes. Otherwise, "cls" pointers of existing ClassType nodes will only
       be written if they are None.
+    context: Optionally, a new pytd.ResolutionContext. If given, ClassType nodes
+      refer to their classes through this context, instead of pointing to them
+      directly, so the new module doesn't contain reference cycles. The caller
+      needs to keep the context alive.
 
   Returns:
     A new module that only uses ClassType. All ClassType instances will point
     to concrete classes.
 
-  Throws:
-    KeyError: If we can't find a class.
+  Raises:
+    UnresolvedNameError: If we can't find a class. This is a ValueError.
   """
-  module = module.Visit(NamedTypeToClassType())
-  if overwrite:
-    # Set cls pointers to None so that FillInClasses is allowed to set them.
-    module = module.Visit(ClearClassTypePointers())
-  FillInClasses(module, global_module)
-  module.Visit(VerifyLookup())
+  if IsResolved(module) and not overwrite:
+    # Nothing to do. E.g., this is the result of builtins.GetResolvedBuiltins().
+    return module
+  module = Resolver(global_module).Resolve(module, overwrite=overwrite,
+                                           context=context)
+  if isinstance(module, pytd.TypeDeclUnit):
+    MarkResolved(module)
   return module
 
 
+def IsResolved(module):
+  """Whether all ClassType nodes of a module are known to be filled in.
+
+  Args:
+    module: A pytd node. Only TypeDeclUnits are ever marked as resolved.
+
+  Returns:
+    True if LookupClasses() has processed this module (or it was passed to
+    MarkResolved()), and its ClassType pointers haven't been cleared since.
+  """
+  return getattr(module, "_resolved", False)
+
+
+def MarkResolved(module):
+  """Mark a TypeDeclUnit as having all its ClassType pointers filled in."""
+  module._resolved = True  # pylint: disable=protected-access
+
+
 class VerifyLookup(object):
   """Utility class for testing visitors.LookupClasses."""
 
@@ -761,6 +951,49 @@ class VerifyVisitor(object):
     pass
 
 
+# Sorting a few types with "<" is cheaper than computing their full keys.
+_MAX_TYPES_WITHOUT_KEYS = 8
+
+
+def _ShallowSortKey(n):
+  """A prefix of pytd.SortKey(n) that's cheap to compute: Class and name."""
+  if n and isinstance(n[0], basestring):
+    return (n.__class__.__name__, n[0])
+  else:
+    return (n.__class__.__name__,)
+
+
+def _Sorted(nodes, use_keys=False):
+  """Sort nodes like sorted() would, but faster.
+
+  Most nodes differ in their class or name, so sort by those first, and only
+  compare the nodes that are the same in that regard. Comparing nodes with "<"
+  is usually cheap, since it stops at the first difference. But e.g. union
+  members are often long, distinct, chains of generic types that only differ
+  at the innermost level, and comparing those over and over again is slow. So
+  for bigger groups of those, use pytd.SortKey(), which only walks every node
+  once.
+
+  Args:
+    nodes: A sequence of nodes.
+    use_keys: Whether to use full sort keys for larger groups.
+
+  Returns:
+    A sorted tuple.
+  """
+  result = []
+  for _, group in itertools.groupby(sorted(nodes, key=_ShallowSortKey),
+                                    key=_ShallowSortKey):
+    group = list(group)
+    if use_keys and len(group) > _MAX_TYPES_WITHOUT_KEYS:
+      memo = {}
+      group.sort(key=lambda n: pytd.SortKey(n, memo))
+    elif len(group) > 1:
+      group.sort()
+    result.extend(group)
+  return tuple(result)
+
+
 class CanonicalOrderingVisitor(object):
   """Visitor for converting ASTs back to canonical (sorted) ordering.
   """
@@ -774,16 +1007,16 @@ class CanonicalOrderingVisitor(object):
 
   def VisitTypeDeclUnit(self, node):
     return pytd.TypeDeclUnit(name=node.name,
-                             constants=tuple(sorted(node.constants)),
-                             functions=tuple(sorted(node.functions)),
-                             classes=tuple(sorted(node.classes)),
-                             modules=tuple(sorted(node.modules)))
+                             constants=_Sorted(node.constants),
+                             functions=_Sorted(node.functions),
+                             classes=_Sorted(node.classes),
+                             modules=_Sorted(node.modules))
 
   def VisitClass(self, node):
     return pytd.Class(name=node.name,
                       parents=node.parents,
-                      methods=tuple(sorted(node.methods)),
-                      constants=tuple(sorted(node.constants)),
+                      methods=_Sorted(node.methods),
+                      constants=_Sorted(node.constants),
                       template=node.template)
 
   def VisitFunction(self, node):
@@ -791,7 +1024,7 @@ class CanonicalOrderingVisitor(object):
     # determines lookup order. But some pytd (e.g., inference output) doesn't
     # have that property, in which case self.sort_signatures will be True.
     if self.sort_signatures:
-      return node.Replace(signatures=tuple(sorted(node.signatures)))
+      return node.Replace(signatures=_Sorted(node.signatures))
     else:
       return node
 
@@ -802,7 +1035,7 @@ class CanonicalOrderingVisitor(object):
     return node
 
   def VisitUnionType(self, node):
-    return pytd.UnionType(tuple(sorted(node.type_list)))
+    return pytd.UnionType(_Sorted(node.type_list, use_keys=True))
 
   def VisitIntersectionType(self, node):
-    return pytd.IntersectionType(tuple(sorted(node.type_list)))
+    return pytd.IntersectionType(_Sorted(node.type_list, use_keys=True))
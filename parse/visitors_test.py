@@ -14,6 +14,7 @@
 # limitations under the License.
 
 
+import gc
 import re
 import sys
 import textwrap
@@ -46,6 +47,80 @@ class TestVisitors(parser_test.ParserTest):
     new_tree = visitors.LookupClasses(tree)
     self.AssertSourceEquals(new_tree, src)
     new_tree.Visit(visitors.VerifyLookup())
+    self.assertFalse(visitors.IsResolved(tree))
+    self.assertTrue(visitors.IsResolved(new_tree))
+    self.assertIs(new_tree, visitors.LookupClasses(new_tree))
+    new_tree.Visit(visitors.ClearClassTypePointers())
+    self.assertFalse(visitors.IsResolved(new_tree))
+    self.assertRaises(ValueError, new_tree.Visit, visitors.VerifyLookup())
+
+  def testLookupClassesInSubmodules(self):
+    os = self.Parse(textwrap.dedent("""
+        class stat_result:
+            pass
+        def stat(path: str) -> stat_result
+    """)).Replace(name="os")
+    tree = self.Parse(textwrap.dedent("""
+        class object:
+            pass
+        class str:
+            pass
+        class stat_result:
+            pass
+        def f(x: os.stat_result) -> str
+    """)).Replace(modules=(os,))
+    new_tree = visitors.LookupClasses(tree)
+    new_tree.Visit(visitors.VerifyLookup())
+    new_os = new_tree.Lookup("os")
+    f = new_tree.Lookup("f").signatures[0]
+    stat = new_os.Lookup("stat").signatures[0]
+    self.assertIs(new_os.Lookup("stat_result"), f.params[0].type.cls)
+    self.assertIs(new_os.Lookup("stat_result"), stat.return_type.cls)
+    self.assertIs(new_tree.Lookup("str"), stat.params[0].type.cls)
+    self.assertIs(new_tree.Lookup("str"), f.return_type.cls)
+
+  def testLookupClassesWithContext(self):
+    src = textwrap.dedent("""
+        class object:
+            pass
+
+        class A:
+            def a(self, a: A, b: B) -> A or B raises A, B
+
+        class B:
+            def b(self, a: A, b: B) -> A or B raises A, B
+    """)
+    tree = self.Parse(src)
+    gc.collect()
+    context = pytd.ResolutionContext()
+    new_tree = visitors.LookupClasses(tree, context=context)
+    self.AssertSourceEquals(new_tree, src)
+    new_tree.Visit(visitors.VerifyLookup())
+    a = new_tree.Lookup("A")
+    self.assertIs(a, a.methods[0].signatures[0].return_type.type_list[0].cls)
+    self.assertIs(new_tree, context.module)
+    self.assertEquals(3, len(context))
+    # The tree doesn't have cycles, so it can be freed without the gc.
+    del context, new_tree, a
+    self.assertEquals(0, gc.collect())
+
+  def testUnresolvedNameError(self):
+    src = textwrap.dedent("""
+        class object:
+            pass
+        class A:
+            def a(self, x: T) -> A
+        def f() -> U
+    """)
+    tree = self.Parse(src)
+    try:
+      visitors.LookupClasses(tree)
+      self.fail("Expected an UnresolvedNameError")
+    except visitors.UnresolvedNameError as e:
+      self.assertIsInstance(e, ValueError)
+      self.assertItemsEqual([("T", "parameter x of A.a"), ("U", "in f")],
+                            e.unresolved)
+      self.assertIn("T (parameter x of A.a)", str(e))
 
   def testMaybeFillInClasses(self):
     src = textwrap.dedent("""
@@ -237,5 +312,31 @@ class TestVisitors(parser_test.ParserTest):
     tree2 = tree2.Visit(visitors.CanonicalOrderingVisitor(sort_signatures=True))
     self.AssertSourceEquals(tree1, tree2)
 
+  def testCanonicalOrderingOfLongUnions(self):
+    # Enough similar members for the visitor to sort them by pytd.SortKey().
+    types = [pytd.NamedType("int"), pytd.NamedType("float")]
+    for name in "zyxwvutsrqponm":
+      t = pytd.NamedType(name)
+      for base in ("list", "tuple", "list"):
+        t = pytd.GenericType(pytd.NamedType(base), (types[len(name) % 2], t))
+      types.append(t)
+    union = pytd.UnionType(tuple(types))
+    ordered = union.Visit(visitors.CanonicalOrderingVisitor())
+    self.assertEquals(tuple(sorted(types)), ordered.type_list)
+    unit = pytd.TypeDeclUnit("test", (pytd.Constant("x", union),), (), (), ())
+    self.assertEquals(
+        (pytd.Constant("x", ordered),),
+        unit.Visit(visitors.CanonicalOrderingVisitor()).constants)
+
+  def testCanonicalOrderingOfUnicodeNames(self):
+    constants = (pytd.Constant(u"c", pytd.NamedType("int")),
+                 pytd.Constant("b", pytd.NamedType("int")),
+                 pytd.Constant(u"a", pytd.NamedType("int")),
+                 pytd.Constant("d", pytd.NamedType("int")))
+    unit = pytd.TypeDeclUnit("test", constants, (), (), ())
+    ordered = unit.Visit(visitors.CanonicalOrderingVisitor()).constants
+    self.assertEquals(tuple(sorted(constants)), ordered)
+    self.assertEquals(["a", "b", "c", "d"], [c.name for c in ordered])
+
 if __name__ == "__main__":
   unittest.main()
@@ -20,8 +20,10 @@
 """AST representation of a pytd file."""
 
 
+import collections
+import hashlib
 import itertools
-import re
+import weakref
 from pytypedecl.parse import node
 
 
@@ -40,30 +42,65 @@ class TypeDeclUnit(node.Node('name', 'constants', 'classes', 'functions',
     classes: Iterable of classes defined in this type decl unit.
     modules: Iterable of submodules of the current module.
   """
-  __slots__ = ()
+  # No __slots__: Lookup() stores its index in the instance __dict__. There are
+  # only few instances of this class, so the extra dictionary is cheap.
 
   def Lookup(self, name):
     """Convenience function: Look up a given name in the global namespace.
 
-    Tries to find a constant, function or class by this name.
+    Tries to find a constant, function, class or submodule by this name. Names
+    within submodules (or classes) can be looked up using dotted names, e.g.
+    "os.stat".
 
     Args:
       name: Name to look up.
 
     Returns:
-      A Constant, Function or Class.
+      A Constant, Function, Class or TypeDeclUnit.
 
     Raises:
       KeyError: if this identifier doesn't exist.
     """
-    # TODO: Remove. Change constants, classes and functions to dict.
     try:
       return self._name2item[name]
     except AttributeError:
-      self._name2item = {}
-      for x in self.constants + self.functions + self.classes + self.modules:
-        self._name2item[x.name] = x
-      return self._name2item[name]
+      if (isinstance(self.modules, LazyModules) and
+          len(self.modules.LazyNames()) == len(self.modules)):
+        # Don't load all the modules just for building the index. Instead,
+        # modules are added to the index (below) once they're looked up. Until
+        # then, make sure their names don't map to anything else, since modules
+        # take precedence.
+        self._name2item = _BuildIndex(
+            self.constants, self.functions, self.classes)
+        for module_name in self.modules.LazyNames():
+          self._name2item.pop(module_name, None)
+      else:
+        self._name2item = _BuildIndex(
+            self.constants, self.functions, self.classes, self.modules)
+      return self.Lookup(name)
+    except KeyError:
+      if isinstance(self.modules, LazyModules):
+        module = self.modules.Get(name)
+        if module is not None:
+          self._name2item[name] = module
+          return module
+      prefix, dot, remainder = name.rpartition(".")
+      if not dot:
+        raise KeyError(name)
+    try:
+      container = self.Lookup(prefix)
+      if isinstance(container, (TypeDeclUnit, Class)):
+        return container.Lookup(remainder)
+    except KeyError:
+      pass
+    raise KeyError(name)
+
+  def Replace(self, **kwargs):
+    """Like node.Replace, but keeps the Lookup() index if it's still valid."""
+    new_unit = super(TypeDeclUnit, self).Replace(**kwargs)
+    _CopyIndex(self, new_unit,
+               ("constants", "functions", "classes", "modules"))
+    return new_unit
 
   def __hash__(self):
     return id(self)
@@ -75,6 +112,139 @@ class TypeDeclUnit(node.Node('name', 'constants', 'classes', 'functions',
     return id(self) != id(other)
 
 
+class LazyModules(list):
+  """A list of modules that are only loaded once they're needed.
+
+  This can be used for TypeDeclUnit.modules. Indexing it, or iterating over it,
+  loads the modules one by one, as they're reached. TypeDeclUnit.Lookup() only
+  loads the module it's looking up. All other operations load all the modules
+  first. Like the rest of the tree, this is meant to be immutable.
+
+  Other code expects TypeDeclUnit.modules to be a tuple, so this behaves like
+  one: Slicing, "+" and "*" return tuples, and it compares and hashes like the
+  tuple of its modules. When pickled or serialized (see pytdb.py), it turns
+  into a tuple.
+  """
+
+  _NOT_LOADED = object()
+
+  def __init__(self, iterable=(), names=(), loader=None):
+    """Create a list of modules.
+
+    Args:
+      iterable: Modules that are already loaded. (This is the same signature
+        as list(), so that e.g. Node.Visit() can create new instances.)
+      names: Names of the modules to load on demand. These come after the
+        modules in iterable.
+      loader: A function that, given a module name, returns a TypeDeclUnit.
+    """
+    super(LazyModules, self).__init__(iterable)
+    self._positions = {}
+    self._pending = {}
+    for name in names:
+      self._positions[name] = len(self)
+      self._pending[len(self)] = name
+      list.append(self, self._NOT_LOADED)
+    self._loader = loader
+
+  def LazyNames(self):
+    """Return the names of all the modules that were (or are) loaded lazily."""
+    return self._positions.keys()
+
+  def Get(self, name):
+    """Return the lazily loaded module with the given name, or None."""
+    position = self._positions.get(name)
+    if position is None:
+      return None
+    return self[position]
+
+  def Preload(self):
+    """Load all the modules now."""
+    for position in sorted(self._pending):
+      self[position]  # pylint: disable=pointless-statement
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return tuple(self)[index]
+    module = list.__getitem__(self, index)
+    if module is self._NOT_LOADED:
+      if index < 0:
+        index += len(self)
+      module = self._loader(self._pending.pop(index))
+      list.__setitem__(self, index, module)
+    return module
+
+  def __iter__(self):
+    for i in xrange(len(self)):
+      yield self[i]
+
+  def __getslice__(self, i, j):
+    return tuple(self)[i:j]
+
+  def __add__(self, other):
+    return tuple(self) + _AsTuple(other)
+
+  def __radd__(self, other):
+    return _AsTuple(other) + tuple(self)
+
+  def __mul__(self, n):
+    return tuple(self) * n
+
+  __rmul__ = __mul__
+
+  def __hash__(self):
+    return hash(tuple(self))
+
+  def __eq__(self, other):
+    return isinstance(other, (tuple, LazyModules)) and (
+        tuple(self) == _AsTuple(other))
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __lt__(self, other):
+    return tuple(self) < _AsTuple(other)
+
+  def __le__(self, other):
+    return tuple(self) <= _AsTuple(other)
+
+  def __gt__(self, other):
+    return tuple(self) > _AsTuple(other)
+
+  def __ge__(self, other):
+    return tuple(self) >= _AsTuple(other)
+
+  def __repr__(self):
+    return repr(tuple(self))
+
+  def __reduce__(self):
+    # Pickle (and copy) as a tuple, which is what TypeDeclUnit.modules usually
+    # is.
+    return tuple, (tuple(self),)
+
+
+def _AsTuple(modules):
+  """Convert a LazyModules instance to a tuple. Leave other values alone."""
+  return tuple(modules) if isinstance(modules, LazyModules) else modules
+
+
+def _Preloading(method):
+  """Wrap a list method so that it loads all modules first."""
+  def Wrapper(self, *args, **kwargs):
+    self.Preload()
+    return method(self, *args, **kwargs)
+  Wrapper.__name__ = method.__name__
+  return Wrapper
+
+
+for _method in ("__contains__", "__delitem__", "__delslice__", "__iadd__",
+                "__imul__", "__reversed__", "__setitem__", "__setslice__",
+                "append", "count", "extend", "index", "insert", "pop", "remove",
+                "reverse", "sort"):
+  setattr(LazyModules, _method, _Preloading(getattr(list, _method)))
+del _method
+
+
 class Constant(node.Node('name', 'type')):
   __slots__ = ()
 
@@ -94,15 +264,18 @@ class Class(node.Node('name', 'parents', 'methods', 'constants', 'template')):
   # TODO: Rename "parents" to "bases". "Parents" is confusing since we're
   #              in a tree.
 
-  __slots__ = ()
+  # No __slots__: Lookup() stores its index in the instance __dict__. (See
+  # TypeDeclUnit)
 
-  def Lookup(self, name):
+  def Lookup(self, name, inherited=False):
     """Convenience function: Look up a given name in the class namespace.
 
     Tries to find a method or constant by this name in the class.
 
     Args:
       name: Name to look up.
+      inherited: If True, also search the base classes of this class, in method
+        resolution order. (See MRO())
 
     Returns:
       A Constant or Function instance.
@@ -110,15 +283,156 @@ class Class(node.Node('name', 'parents', 'methods', 'constants', 'template')):
     Raises:
       KeyError: if this identifier doesn't exist in this class.
     """
-    # TODO: Remove this. Make methods and constants dictionaries.
+    if inherited:
+      for cls in self.MRO():
+        try:
+          return cls.Lookup(name)
+        except KeyError:
+          pass
+      raise KeyError(name)
     try:
       return self._name2item[name]
     except AttributeError:
-      self._name2item = {}
-      for x in self.methods + self.constants:
-        self._name2item[x.name] = x
+      self._name2item = _BuildIndex(self.methods, self.constants)
       return self._name2item[name]
 
+  def MRO(self):
+    """Compute the method resolution order of this class, using C3.
+
+    This only knows about base classes that are resolved (see
+    visitors.LookupClasses), either directly or as base type of a generic type.
+    Other base classes are ignored.
+
+    The result is cached, and recomputed if the base classes of this class or
+    of one of its ancestors changed (e.g. after LookupClasses(overwrite=True)).
+
+    Returns:
+      A tuple of Class instances, starting with this class.
+
+    Raises:
+      ValueError: If the class hierarchy doesn't allow a consistent ordering.
+    """
+    mro = _CachedMRO(self)
+    if mro is not None:
+      return mro
+    # Compute the MROs of the ancestors first, in post-order. Iteratively, so
+    # that deep hierarchies don't run into the recursion limit.
+    bases = {}  # id(cls) -> base classes, for classes we've expanded
+    open_ids = set()  # Classes we've expanded, but not computed yet.
+    stack = [self]
+    while stack:
+      cls = stack[-1]
+      if id(cls) not in bases:
+        bases[id(cls)] = cls_bases = _ResolvedBases(cls)
+        open_ids.add(id(cls))
+        for base in cls_bases:
+          if id(base) in open_ids:
+            raise ValueError("Cyclic class hierarchy: " + base.name)
+          if id(base) not in bases and _CachedMRO(base) is None:
+            stack.append(base)
+        continue
+      stack.pop()
+      if id(cls) not in open_ids:
+        continue  # Pushed more than once, and computed already.
+      open_ids.remove(id(cls))
+      cls_bases = bases[id(cls)]
+      base_entries = [base.__dict__["_mro"] for base in cls_bases]
+      # Also remember the bases the ancestors had, to know when to recompute.
+      if len(base_entries) == 1:
+        # Single inheritance. (What _MergeMROs would do, but faster.)
+        base_mro, base_bases = base_entries[0]
+        entry = ((cls,) + base_mro, (cls_bases,) + base_bases)
+      else:
+        mro = (cls,) + _MergeMROs([list(mro) for mro, _ in base_entries] +
+                                  [list(cls_bases)])
+        all_bases = {id(cls): cls_bases}
+        for base_mro, base_bases in base_entries:
+          all_bases.update(itertools.izip(map(id, base_mro), base_bases))
+        entry = (mro, tuple(all_bases[id(c)] for c in mro))
+      cls.__dict__["_mro"] = entry
+    return self.__dict__["_mro"][0]
+
+  def Replace(self, **kwargs):
+    """Like node.Replace, but keeps the Lookup() index if it's still valid."""
+    new_cls = super(Class, self).Replace(**kwargs)
+    _CopyIndex(self, new_cls, ("methods", "constants"))
+    return new_cls
+
+
+def _BuildIndex(*sections):
+  """Build a dictionary mapping names to items, for Lookup()."""
+  return {item.name: item for item in itertools.chain(*sections)}
+
+
+def _CopyIndex(old_node, new_node, fields):
+  """Copy the Lookup() index to a new node, if it indexes the same items."""
+  index = old_node.__dict__.get("_name2item")
+  if index is not None and all(getattr(old_node, field) is
+                               getattr(new_node, field) for field in fields):
+    new_node._name2item = index  # pylint: disable=protected-access
+
+
+def _ResolvedBases(cls):
+  """Get the base classes of a class that are resolved, as a tuple."""
+  bases = []
+  for parent in cls.parents:
+    if isinstance(parent, GenericType):
+      parent = parent.base_type
+    if isinstance(parent, ClassType) and parent.cls is not None:
+      bases.append(parent.cls)
+  return tuple(bases)
+
+
+def _CachedMRO(cls):
+  """Get the MRO that MRO() cached, or None if it's missing or outdated."""
+  entry = cls.__dict__.get("_mro")
+  if entry is None:
+    return None
+  mro, bases = entry
+  for c, c_bases in itertools.izip(mro, bases):
+    new_bases = _ResolvedBases(c)
+    if len(new_bases) != len(c_bases) or any(
+        new is not old for new, old in itertools.izip(new_bases, c_bases)):
+      return None
+  return mro
+
+
+def _MergeMROs(sequences):
+  """Merge lists of classes, as in C3 linearization.
+
+  Args:
+    sequences: A list of lists of classes.
+
+  Returns:
+    A tuple of classes.
+
+  Raises:
+    ValueError: If there's no consistent ordering.
+  """
+  result = []
+  sequences = [seq[::-1] for seq in sequences if seq]  # heads at the end
+  # How often each class appears in the tail (all but the head) of a sequence.
+  # Classes are compared by identity. Comparing by value would be slow, and
+  # two different classes with the same contents would be confused.
+  in_tails = collections.Counter(id(cls) for seq in sequences
+                                 for cls in seq[:-1])
+  while sequences:
+    for seq in sequences:
+      head = seq[-1]
+      if not in_tails[id(head)]:
+        break
+    else:
+      raise ValueError("Can't create a consistent method resolution order "
+                       "for " + ", ".join(seq[-1].name for seq in sequences))
+    result.append(head)
+    for seq in sequences:
+      if seq[-1] is head:
+        seq.pop()
+        if seq:
+          in_tails[id(seq[-1])] -= 1
+    sequences = [seq for seq in sequences if seq]
+  return tuple(result)
+
 
 class Function(node.Node('name', 'signatures')):
   """A function or a method.
@@ -239,6 +553,23 @@ class NativeType(node.Node('python_type')):
   __slots__ = ()
 
 
+class _ClassFromSymbol(object):
+  """Descriptor for ClassType.cls, for types that store a symbol ID.
+
+  This is a non-data descriptor, so a "cls" in the instance __dict__ (i.e., a
+  direct pointer to the class) takes precedence.
+  """
+
+  def __get__(self, t, unused_type=None):
+    if t is None:
+      return self
+    context = t._context()  # pylint: disable=protected-access
+    if context is None:
+      raise ReferenceError("The ResolutionContext of %s no longer exists" %
+                           t.name)
+    return context.Lookup(t._symbol)  # pylint: disable=protected-access
+
+
 class ClassType(node.Node('name')):
   """A type specified through an existing class node."""
 
@@ -250,14 +581,47 @@ class ClassType(node.Node('name')):
   # (c) Visitors will not process the "children" of this node. Since we point
   #     to classes that are back at the top of the tree, that would generate
   #     cycles.
+  # (d) Unlike all other types, it has no __slots__, since the "cls" pointer
+  #     lives in the instance __dict__. (Tuple subclasses can't have non-empty
+  #     __slots__.)
+  # (e) Instead of a "cls" pointer, it can store a symbol ID, which the
+  #     "cls" attribute then looks up in a ResolutionContext. See there.
 
-  __slots__ = ()
+  cls = _ClassFromSymbol()
 
   def __new__(cls, name, clsref=None):
     self = super(ClassType, cls).__new__(cls, name)
     self.cls = clsref  # potentially filled in later (by visitors.FillInClasses)
     return self
 
+  @classmethod
+  def _make(cls, iterable):
+    # Used by Replace(). Make sure it goes through __new__, too.
+    return cls(*iterable)
+
+  def SetSymbol(self, context, symbol_id):
+    """Make this type refer to its class through a ResolutionContext.
+
+    This replaces the "cls" pointer, if there is one.
+
+    Args:
+      context: A ResolutionContext.
+      symbol_id: A symbol ID, as returned by context.Add().
+    """
+    self.__dict__.pop('cls', None)
+    self._context = context._ref  # pylint: disable=protected-access
+    self._symbol = symbol_id
+
+  def __getstate__(self):
+    # "cls" pointers aren't pickled: Following them would make pickle recurse
+    # into the classes they point to. Symbol IDs are fine.
+    if '_symbol' in self.__dict__:
+      return {'context': self._context(), 'symbol': self._symbol}
+    return None
+
+  def __setstate__(self, state):
+    self.SetSymbol(state['context'], state['symbol'])
+
   # __eq__ is inherited (using tuple equality + requiring the two classes
   #                      be the same)
 
@@ -270,6 +634,105 @@ class ClassType(node.Node('name')):
         cls='<unresolved>' if self.cls is None else '')
 
 
+class ResolutionContext(object):
+  """A symbol table for ClassType nodes that refer to their class by number.
+
+  ClassType nodes that point to their class through their "cls" attribute make
+  the tree cyclic, since the class contains types that point back to it. That
+  keeps the cyclic garbage collector busy, and means such trees can't be
+  pickled. Alternatively, a ClassType can store a symbol ID, which is an index
+  into the table of a ResolutionContext (see visitors.LookupClasses). The types
+  only hold a weak reference to their context, and the context holds on to the
+  module, so the tree stays free of cycles. Keep the context alive for as long
+  as you use the types that refer to it.
+
+  A context is pickled together with the types that refer to it, but only
+  stores the names of its symbols. Pickle the context and the module together,
+  and call Bind() after unpickling, to tell the context where to look up these
+  names again.
+  """
+
+  def __init__(self):
+    self._ref = weakref.ref(self)
+    self._names = []  # symbol ID -> (is_global, name)
+    self._items = []  # symbol ID -> item, or None if not looked up yet
+    self._ids = {}  # (is_global, name) -> symbol ID
+    self.module = None
+    self.global_module = None
+
+  def Bind(self, module, global_module=None):
+    """Set the modules that names are looked up in.
+
+    Args:
+      module: The TypeDeclUnit the local names refer to.
+      global_module: Anything with a Lookup() method. The global names refer
+        to this.
+    """
+    if module is not self.module or global_module is not self.global_module:
+      # The names might refer to different items now.
+      self._items = [None] * len(self._names)
+    self.module = module
+    self.global_module = global_module
+
+  def Add(self, name, item=None, is_global=False):
+    """Get the symbol ID for a name.
+
+    Args:
+      name: The (dotted) name of an item in the module, or in the global module.
+      item: What the name resolves to, if already known. Otherwise, this is
+        looked up once it's needed.
+      is_global: Whether name refers to the global module.
+
+    Returns:
+      An int.
+    """
+    key = (is_global, name)
+    symbol_id = self._ids.get(key)
+    if symbol_id is None:
+      symbol_id = self._ids[key] = len(self._names)
+      self._names.append(key)
+      self._items.append(item)
+    return symbol_id
+
+  def Lookup(self, symbol_id):
+    """Get the item a symbol ID refers to.
+
+    Args:
+      symbol_id: An int, as returned by Add().
+
+    Returns:
+      A Class, usually.
+
+    Raises:
+      KeyError: If the name doesn't exist (anymore).
+    """
+    item = self._items[symbol_id]
+    if item is None:
+      is_global, name = self._names[symbol_id]
+      module = self.global_module if is_global else self.module
+      if module is None:
+        raise KeyError(name)
+      item = self._items[symbol_id] = module.Lookup(name)
+    return item
+
+  def __len__(self):
+    return len(self._names)
+
+  def __getstate__(self):
+    return {'names': self._names}
+
+  def __setstate__(self, state):
+    self.__init__()
+    for is_global, name in state['names']:
+      self.Add(name, is_global=is_global)
+
+  def __copy__(self):
+    return self
+
+  def __deepcopy__(self, unused_memo):
+    return self
+
+
 class AnythingType(node.Node()):
   """A type we know nothing about yet ('?' in pytd)."""
   __slots__ = ()
@@ -289,40 +752,66 @@ class Scalar(node.Node('value')):
 
 
 class UnionType(node.Node('type_list')):
-  """A union type that contains all types in self.type_list."""
-  __slots__ = ()
+  """A union type that contains all types in self.type_list.
+
+  Attributes:
+    type_list: Tuple of types, in their original order. Never contains
+      UnionTypes itself.
+    members: The same types, as a frozenset.
+  """
+  # No __slots__: The canonical form (see below) is stored in the instance
+  # __dict__.
 
   # NOTE: type_list is kept as a tuple, to preserve the original order
   #       even though in most respects it acts like a frozenset.
   #       It also flattens the input, such that printing without
   #       parentheses gives the same result.
+  #       Comparisons, hashing and membership tests ("t in union") use the
+  #       canonical form, a frozenset of the (flattened) types that is
+  #       computed once, when the union is created.
 
   def __new__(cls, type_list):
     assert type_list  # Disallow empty unions. Use NothingType for these.
     flattened = itertools.chain.from_iterable(
         t.type_list if isinstance(t, UnionType) else [t] for t in type_list)
-    return super(UnionType, cls).__new__(cls, tuple(flattened))
+    self = super(UnionType, cls).__new__(cls, tuple(flattened))
+    self.members = frozenset(self.type_list)
+    self._hash = hash(self.members)
+    return self
+
+  @classmethod
+  def _make(cls, iterable):
+    # Used by Replace(). Make sure it goes through __new__, too.
+    return cls(*iterable)
+
+  def __reduce__(self):
+    # For pickle and copy. Protocols 0 and 1 would otherwise bypass __new__,
+    # and not store the instance __dict__ either.
+    return (self.__class__, (self.type_list,))
 
   def __hash__(self):
-    # See __eq__ - order doesn't matter, so use frozenset
-    return hash(frozenset(self.type_list))
+    return self._hash
 
   def __eq__(self, other):
     if self is other:
       return True
     if isinstance(other, UnionType):
       # equality doesn't care about the ordering of the type_list
-      return frozenset(self.type_list) == frozenset(other.type_list)
+      return self._hash == other._hash and self.members == other.members
     return NotImplemented
 
   def __ne__(self, other):
     return not self == other
 
+  def __contains__(self, t):
+    return t in self.members
+
 
 # TODO: Do we still need this?
 class IntersectionType(node.Node('type_list')):
   """An intersection type that contains all types in self.type_list."""
-  __slots__ = ()
+  # No __slots__: The canonical form (see UnionType) is stored in the instance
+  # __dict__.
 
   # NOTE: type_list is kept as a tuple, to preserve the original order
   #       even though in most respects it acts like a frozenset.
@@ -333,23 +822,38 @@ class IntersectionType(node.Node('type_list')):
     flattened = itertools.chain.from_iterable(
         t.type_list if isinstance(t, IntersectionType) else [t]
         for t in type_list)
-    return super(IntersectionType, cls).__new__(cls, tuple(flattened))
+    self = super(IntersectionType, cls).__new__(cls, tuple(flattened))
+    self.members = frozenset(self.type_list)
+    self._hash = hash(self.members)
+    return self
+
+  @classmethod
+  def _make(cls, iterable):
+    # Used by Replace(). Make sure it goes through __new__, too.
+    return cls(*iterable)
+
+  def __reduce__(self):
+    # For pickle and copy. Protocols 0 and 1 would otherwise bypass __new__,
+    # and not store the instance __dict__ either.
+    return (self.__class__, (self.type_list,))
 
   def __hash__(self):
-    # See __eq__ - order doesn't matter, so use frozenset
-    return hash(frozenset(self.type_list))
+    return self._hash
 
   def __eq__(self, other):
     if self is other:
       return True
     if isinstance(other, IntersectionType):
       # equality doesn't care about the ordering of the type_list
-      return frozenset(self.type_list) == frozenset(other.type_list)
+      return self._hash == other._hash and self.members == other.members
     return NotImplemented
 
   def __ne__(self, other):
     return not self == other
 
+  def __contains__(self, t):
+    return t in self.members
+
 
 class GenericType(node.Node('base_type', 'parameters')):
   """Generic type. Takes a base type and type paramters.
@@ -382,11 +886,142 @@ TYPE = (NamedType, NativeType, ClassType, AnythingType, UnionType,
         IntersectionType, Scalar)
 
 
-def Print(n):
-  """Convert a PYTD node to a string."""
+def Print(n, out=None):
+  """Convert a PYTD node to a string.
+
+  Args:
+    n: A PYTD node.
+    out: Optional file-like object. If given, the output is written to it
+      incrementally, and nothing is returned. Use parse.printer.Printer
+      directly if you need to print a tree repeatedly.
+
+  Returns:
+    The printed form of n, if out is None.
+  """
+  # TODO: fix circular import
+  from pytypedecl.parse import printer
+  if out is None:
+    return printer.Printer().Print(n)
+  else:
+    printer.Printer().Write(n, out)
+
+
+def Dump(n):
+  """Serialize a PYTD node to a string. See parse/pytdb.py."""
   # TODO: fix circular import
-  from pytypedecl.parse import visitors
-  res = n.Visit(visitors.PrintVisitor())
-  # Remove trailing blanks on lines (*not* \s which includes \n) -- these come
-  # from indents that have no other code on them.
-  return re.sub(r" +\n", "\n", res)
+  from pytypedecl.parse import pytdb
+  return pytdb.Dump(n)
+
+
+def Load(data):
+  """Deserialize a PYTD node from a string produced by Dump()."""
+  # TODO: fix circular import
+  from pytypedecl.parse import pytdb
+  return pytdb.Load(data)
+
+
+def Fingerprint(n, memo=None):
+  """Compute a stable fingerprint of a PYTD node.
+
+  Unlike hash(), the fingerprint only depends on the contents of the tree, and
+  is the same across processes and Python versions. This makes it suitable
+  as a key for caching results derived from a tree, e.g. on disk.
+  The fingerprint is computed bottom-up, so subtrees that are shared (or
+  fingerprinted before, using the same memo) are only processed once.
+
+  Two nodes with the same fingerprint have the same contents. (The converse
+  isn't always true: E.g. "int or float" and "float or int" compare equal, but,
+  since they print differently, have different fingerprints.) The "cls" pointer
+  of ClassType is not part of the fingerprint.
+
+  Args:
+    n: A node, or a tuple/list/dict of nodes, or a primitive value.
+    memo: Optional dictionary used for memoizing fingerprints of subtrees. Pass
+      in the same dictionary to repeated calls to share their work. This
+      dictionary will keep the nodes it has seen alive.
+
+  Returns:
+    A hex string.
+  """
+  if memo is None:
+    memo = {}
+  return _Fingerprint(n, memo)
+
+
+def _Fingerprint(n, memo):
+  """Implementation of Fingerprint()."""
+  entry = memo.get(id(n))
+  if entry is not None:
+    return entry[1]
+  if isinstance(n, tuple):
+    if isinstance(n, ClassType):
+      children = [_Fingerprint(n.name, memo)]
+    else:
+      children = [_Fingerprint(child, memo) for child in n]
+    # Tuples and lists are distinguished from nodes by their class name.
+    data = "%s(%s)" % (n.__class__.__name__, ",".join(children))
+  elif isinstance(n, list):
+    data = "list(%s)" % ",".join(_Fingerprint(child, memo) for child in n)
+  elif isinstance(n, dict):
+    data = "dict(%s)" % ",".join(
+        sorted(_Fingerprint(k, memo) + ":" + _Fingerprint(v, memo)
+               for k, v in n.items()))
+  elif isinstance(n, basestring):
+    value = n.encode("utf-8") if isinstance(n, unicode) else n
+    data = "%s:%d:%s" % (type(n).__name__, len(value), value)
+  elif isinstance(n, type):
+    data = "type:%s.%s" % (n.__module__, n.__name__)
+  else:
+    data = "%s:%r" % (type(n).__name__, n)
+  fingerprint = hashlib.sha1(data).hexdigest()
+  memo[id(n)] = (n, fingerprint)  # store n, to make sure id(n) stays valid
+  return fingerprint
+
+
+def SortKey(n, memo=None):
+  """Compute a key that sorts PYTD nodes like their "<" operator does.
+
+  "<" compares the class names of two nodes, and, if those are the same, their
+  children, recursively. Every comparison starts over, so sorting nodes with
+  big subtrees is slow. This instead computes a nested tuple that compares the
+  same way, bottom-up, so that every subtree is only processed once:
+    sorted(nodes, key=lambda n: SortKey(n, memo))
+
+  The one difference: Unions with the same types, in a different order,
+  compare as equal, but have different keys. (They're ordered by their types,
+  from left to right.)
+
+  Args:
+    n: A node, or a tuple/list of nodes, or a primitive value.
+    memo: Optional dictionary used for memoizing the keys of subtrees. Pass in
+      the same dictionary to repeated calls to share their work. This
+      dictionary will keep the nodes it has seen alive.
+
+  Returns:
+    A tuple, or, for primitive values, the value itself.
+  """
+  if not isinstance(n, (tuple, list)):
+    return n
+  if memo is None:
+    memo = {}
+  return _SortKey(n, memo)
+
+
+def _SortKey(n, memo):
+  """Implementation of SortKey()."""
+  if isinstance(n, list):
+    # Lists are mutable, so don't memoize these.
+    return [_SortKey(child, memo) if isinstance(child, (tuple, list)) else child
+            for child in n]
+  entry = memo.get(id(n))
+  if entry is not None:
+    return entry[1]
+  children = tuple([_SortKey(child, memo)
+                    if isinstance(child, (tuple, list)) else child
+                    for child in n])
+  if n.__class__ is tuple:
+    key = children
+  else:
+    key = (n.__class__.__name__, children)
+  memo[id(n)] = (n, key)  # store n, to make sure id(n) stays valid
+  return key
@@ -1,6 +1,8 @@
 """Tests for pytd."""
 
+import copy
 import itertools
+import pickle
 import unittest
 from pytypedecl import pytd
 
@@ -30,6 +32,221 @@ class TestPytd(unittest.TestCase):
     self.assertEqual(u1.type_list, (self.int, self.float))
     self.assertEqual(u2.type_list, (self.float, self.int, self.none_type))
 
+  def testUnionTypeMembers(self):
+    u = pytd.UnionType((self.int, pytd.UnionType((self.float, self.int))))
+    self.assertEqual(u.type_list, (self.int, self.float, self.int))
+    self.assertEqual(u.members, frozenset([self.int, self.float]))
+    self.assertIn(self.float, u)
+    self.assertNotIn(self.list, u)
+    self.assertEqual(u, pytd.UnionType((self.float, self.int)))
+    self.assertEqual(u.Replace(type_list=(self.list,)).members,
+                     frozenset([self.list]))
+
+  def testUnionTypeHash(self):
+    u1 = pytd.UnionType((self.int, self.float))
+    u2 = pytd.UnionType((self.float, self.int))
+    self.assertEqual(hash(u1), hash(u2))
+    self.assertEqual(hash(u1), hash(u1))  # cached
+    self.assertEqual(len({u1, u2}), 1)
+
+  def testUnionTypePickle(self):
+    u = pytd.UnionType((self.int, self.float))
+    i = pytd.IntersectionType((self.int, self.float))
+    for protocol in (0, 1, 2):
+      for t in (u, i):
+        new_t = pickle.loads(pickle.dumps(t, protocol))
+        self.assertEqual(t.type_list, new_t.type_list)
+        self.assertEqual(t, new_t)
+        self.assertEqual(hash(t), hash(new_t))
+        self.assertIn(self.int, new_t)
+    self.assertEqual(u, copy.copy(u))
+    self.assertEqual(hash(u), hash(copy.deepcopy(u)))
+
+  def testFingerprint(self):
+    sig1 = pytd.Signature((pytd.Parameter("x", self.int),), self.float, (), (),
+                          False)
+    sig2 = pytd.Signature((pytd.Parameter("x", self.int),), self.float, (), (),
+                          False)
+    sig3 = pytd.Signature((pytd.Parameter("x", self.int),), self.int, (), (),
+                          False)
+    self.assertEqual(pytd.Fingerprint(sig1), pytd.Fingerprint(sig2))
+    self.assertNotEqual(pytd.Fingerprint(sig1), pytd.Fingerprint(sig3))
+    # Node types are part of the fingerprint:
+    self.assertNotEqual(pytd.Fingerprint(pytd.NamedType("int")),
+                        pytd.Fingerprint(self.int))
+    self.assertNotEqual(pytd.Fingerprint(pytd.NamedType("int")),
+                        pytd.Fingerprint(pytd.TypeParameter("int")))
+    # Class pointers are not:
+    cls = pytd.Class("int", (), (), (), ())
+    self.assertEqual(pytd.Fingerprint(self.int),
+                     pytd.Fingerprint(pytd.ClassType("int", cls)))
+
+  def testFingerprintIsStable(self):
+    # This value must not change between runs or platforms.
+    self.assertEqual(pytd.Fingerprint(pytd.NamedType("int")),
+                     "5139a959b216712da3c3739965dbe767e5d3c1de")
+
+  def testFingerprintMemo(self):
+    memo = {}
+    f = pytd.Function("f", (pytd.Signature((), self.int, (), (), False),))
+    fingerprint = pytd.Fingerprint(f, memo)
+    self.assertIn(id(f), memo)
+    self.assertEqual(pytd.Fingerprint(f, memo), fingerprint)
+
+  def testSlots(self):
+    # Nodes are immutable and don't have a __dict__ to store attributes in.
+    with self.assertRaises(AttributeError):
+      pytd.NamedType("int").foo = 42
+    with self.assertRaises(AttributeError):
+      pytd.GenericType(self.list, (self.int,)).foo = 42
+    # ClassType is mutable, and stores its class pointer in __dict__:
+    cls = pytd.Class("int", (), (), (), ())
+    self.assertIs(pytd.ClassType("int", cls).cls, cls)
+
+  def _MakeClass(self, name, bases, method_names):
+    methods = tuple(pytd.Function(m, (pytd.Signature((), self.int, (), (),
+                                                     False),))
+                    for m in method_names)
+    parents = tuple(pytd.ClassType(base.name, base) for base in bases)
+    return pytd.Class(name, parents, methods, (), ())
+
+  def testClassLookup(self):
+    cls = self._MakeClass("A", [], ["f", "g"])
+    self.assertEqual(cls.Lookup("g").name, "g")
+    self.assertRaises(KeyError, cls.Lookup, "h")
+    # Replacing other fields keeps the index:
+    renamed = cls.Replace(name="B")
+    self.assertIs(renamed.Lookup("f"), cls.Lookup("f"))
+    shrunk = cls.Replace(methods=cls.methods[:1])
+    self.assertRaises(KeyError, shrunk.Lookup, "g")
+
+  def testMRO(self):
+    a = self._MakeClass("A", [], ["f", "g"])
+    b = self._MakeClass("B", [a], ["f"])
+    c = self._MakeClass("C", [a], ["g"])
+    d = self._MakeClass("D", [b, c], [])
+    self.assertEqual([cls.name for cls in d.MRO()], ["D", "B", "C", "A"])
+    self.assertIs(d.Lookup("f", inherited=True), b.Lookup("f"))
+    self.assertIs(d.Lookup("g", inherited=True), c.Lookup("g"))
+    self.assertRaises(KeyError, d.Lookup, "f")
+    self.assertRaises(KeyError, d.Lookup, "h", inherited=True)
+    inconsistent = self._MakeClass("E", [a, b], [])
+    self.assertRaises(ValueError, inconsistent.MRO)
+
+  def testMROIsCached(self):
+    a = self._MakeClass("A", [], ["f"])
+    b = self._MakeClass("B", [a], [])
+    c = self._MakeClass("C", [b], [])
+    self.assertIs(c.MRO(), c.MRO())
+    self.assertIs(b.MRO(), b.MRO())
+    # Changing the pointers of an ancestor invalidates the cache.
+    other_a = self._MakeClass("A", [], ["g"])
+    b.parents[0].cls = other_a
+    self.assertEqual([c, b, other_a], list(c.MRO()))
+    self.assertIs(other_a.Lookup("g"), c.Lookup("g", inherited=True))
+
+  def testMROOfDeepHierarchy(self):
+    cls = self._MakeClass("C0", [], ["f"])
+    # Deeper than the recursion limit.
+    for i in range(1, 1500):
+      cls = self._MakeClass("C%d" % i, [cls], [])
+    self.assertEqual(1500, len(cls.MRO()))
+    self.assertEqual("f", cls.Lookup("f", inherited=True).name)
+
+  def testMROOfCycle(self):
+    a = self._MakeClass("A", [], [])
+    b = self._MakeClass("B", [a], [])
+    a = a.Replace(parents=(pytd.ClassType("B", b),))
+    b.parents[0].cls = a
+    self.assertRaises(ValueError, a.MRO)
+
+  def testUnitLookup(self):
+    cls = self._MakeClass("A", [], ["f"])
+    module = pytd.TypeDeclUnit("foo.bar", (), (cls,), (), ())
+    unit = pytd.TypeDeclUnit("unit", (), (), (), (module,))
+    self.assertIs(unit.Lookup("foo.bar"), module)
+    self.assertIs(unit.Lookup("foo.bar.A"), cls)
+    self.assertIs(unit.Lookup("foo.bar.A.f"), cls.Lookup("f"))
+    self.assertRaises(KeyError, unit.Lookup, "foo.bar.B")
+    self.assertRaises(KeyError, unit.Lookup, "foo.A")
+
+  def testResolutionContext(self):
+    a = self._MakeClass("A", [], [])
+    unit = pytd.TypeDeclUnit("unit", (), (a,), (), ())
+    context = pytd.ResolutionContext()
+    context.Bind(unit)
+    t = pytd.ClassType("A")
+    t.SetSymbol(context, context.Add("A"))
+    self.assertIs(a, t.cls)
+    self.assertEqual(1, len(context))
+    self.assertEqual(0, context.Add("A"))
+    self.assertIs(t.cls, copy.deepcopy(t).cls)
+    new_unit, new_t, new_context = pickle.loads(
+        pickle.dumps((unit, t, context), pickle.HIGHEST_PROTOCOL))
+    self.assertRaises(KeyError, getattr, new_t, "cls")
+    new_context.Bind(new_unit)
+    self.assertIs(new_unit.Lookup("A"), new_t.cls)
+    # A "cls" pointer takes precedence.
+    new_t.cls = None
+    self.assertIsNone(new_t.cls)
+    # Binding to a different module looks up the names again.
+    other_a = self._MakeClass("A", [], [])
+    context.Bind(pytd.TypeDeclUnit("unit", (), (other_a,), (), ()))
+    self.assertIs(other_a, t.cls)
+    del context, new_context
+    self.assertRaises(ReferenceError, getattr, t, "cls")
+
+  def testLazyModules(self):
+    loaded = []
+    def Load(name):
+      loaded.append(name)
+      return pytd.TypeDeclUnit(name, (), (), (), ())
+    modules = pytd.LazyModules(names=["a", "b", "c"], loader=Load)
+    unit = pytd.TypeDeclUnit("unit", (), (self._MakeClass("a", [], []),), (),
+                             modules)
+    self.assertEquals(3, len(modules))
+    self.assertIs(unit.Lookup("b"), modules[1])  # modules win over classes
+    self.assertIs(unit.Lookup("a"), modules[-3])
+    self.assertEquals(["b", "a"], loaded)
+    self.assertRaises(KeyError, unit.Lookup, "d")
+    self.assertEquals(["a", "b", "c"], [m.name for m in modules[:]])
+    self.assertEquals(["b", "a", "c"], loaded)
+    self.assertIn(modules[2], modules)
+    self.assertEquals(tuple(modules), modules + ())
+    # Eager copies, e.g. as created by visitors:
+    copy = pytd.LazyModules(modules)
+    self.assertEquals(list(modules), list(copy))
+    self.assertIs(unit.Replace(modules=copy).Lookup("c"), modules[2])
+    # Pickled and serialized as a tuple.
+    for new_modules in (pickle.loads(pickle.dumps(modules)),
+                        pytd.Load(pytd.Dump(unit)).modules):
+      self.assertIsInstance(new_modules, tuple)
+      self.assertEquals(["a", "b", "c"], [m.name for m in new_modules])
+
+  def testLazyModulesAsTuple(self):
+    def Load(name):
+      return pytd.TypeDeclUnit(name, (), (), (), ())
+    modules = pytd.LazyModules(names=["a", "b"], loader=Load)
+    a, b = modules
+    self.assertEquals((a, b), modules + ())
+    self.assertEquals((a, b), () + modules)
+    self.assertEquals((a, b, a, b), modules + modules)
+    self.assertEquals((a, b, a, b), 2 * modules)
+    self.assertEquals((b,), modules[1:])
+    self.assertRaises(TypeError, lambda: modules + [])
+    self.assertEquals((a, b), modules)
+    self.assertEquals(modules, (a, b))
+    self.assertNotEquals(modules, [a, b])
+    self.assertNotEquals(modules, (b, a))
+    self.assertLess(modules, (b,))
+    self.assertEquals(hash((a, b)), hash(modules))
+    self.assertEquals(repr((a, b)), repr(modules))
+    # Units compare by identity, but their fields compare like tuples.
+    unit = pytd.TypeDeclUnit("unit", (), (), (), modules)
+    plain = unit.Replace(modules=tuple(modules))
+    self.assertEquals(tuple(unit), tuple(plain))
+    self.assertEquals(hash(tuple(unit)), hash(tuple(plain)))
+
   def testOrder(self):
     # pytd types' primary sort key is the class name, second sort key is
     # the contents when interpreted as a (named)tuple.
@@ -47,5 +264,23 @@ class TestPytd(unittest.TestCase):
     for p in itertools.permutations(nodes):
       self.assertEquals(list(sorted(p)), nodes)
 
+  def testSortKey(self):
+    memo = {}
+    sig = pytd.Signature((pytd.Parameter("x", self.int),), self.float, (), (),
+                         False)
+    nodes = [pytd.AnythingType(),
+             pytd.GenericType(self.list, (self.int,)),
+             pytd.GenericType(self.list, (self.float, self.int)),
+             pytd.NamedType("int"),
+             pytd.Function("f", (sig,)),
+             pytd.Function("f", (sig, sig)),
+             pytd.UnionType((self.float, self.int)),
+             pytd.UnionType((self.int,))]
+    for p in itertools.permutations(nodes[:6]):
+      self.assertEquals(sorted(p, key=lambda n: pytd.SortKey(n, memo)),
+                        sorted(p))
+    self.assertEquals(sorted(nodes, key=pytd.SortKey), sorted(nodes))
+    self.assertIn(id(sig), memo)
+
 if __name__ == "__main__":
   unittest.main()
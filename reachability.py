@@ -0,0 +1,218 @@
+# -*- coding:utf-8; python-indent:2; indent-tabs-mode:nil -*-
+
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Find out which definitions of a module are needed, and drop the others.
+
+Example:
+  user_stub = parser.parse_string(src)
+  small_builtins = Prune(builtins.GetBuiltins(), GetReferencedNames(user_stub))
+"""
+
+import collections
+
+
+from pytypedecl.parse import visitors
+
+
+class _CollectReferences(object):
+  """Visitor that records the names each top-level definition refers to."""
+
+  def __init__(self):
+    self._scopes = ()  # Prefixes of the enclosing modules, like "os.path."
+    self._definition = None  # Dotted name of the current top-level definition
+    self._depth = 0
+    self.references = []  # (definition, scopes, name)
+
+  def EnterTypeDeclUnit(self, node):
+    if self._scopes:
+      self._scopes += (self._scopes[-1] + node.name + ".",)
+    else:
+      self._scopes = ("",)
+
+  def LeaveTypeDeclUnit(self, unused_node):
+    self._scopes = self._scopes[:-1]
+
+  def _EnterDefinition(self, node):
+    if not self._depth and self._scopes:
+      self._definition = self._scopes[-1] + node.name
+    self._depth += 1
+
+  def _LeaveDefinition(self, unused_node):
+    self._depth -= 1
+    if not self._depth:
+      self._definition = None
+
+  EnterClass = EnterFunction = EnterConstant = _EnterDefinition
+  LeaveClass = LeaveFunction = LeaveConstant = _LeaveDefinition
+
+  def _VisitType(self, node):
+    self.references.append((self._definition, self._scopes, node.name))
+    return node
+
+  VisitNamedType = VisitClassType = _VisitType
+
+
+def GetReferencedNames(node):
+  """Get the names of all the types a pytd node uses.
+
+  Args:
+    node: A pytd node, e.g. a TypeDeclUnit.
+
+  Returns:
+    A set of (possibly dotted) names, as they're written in the node.
+  """
+  collector = _CollectReferences()
+  node.Visit(collector)
+  return {name for _, _, name in collector.references}
+
+
+class DependencyGraph(object):
+  """Which definitions of a module refer to which other definitions.
+
+  The nodes of this graph are the dotted names of the constants, functions,
+  classes and submodules of a TypeDeclUnit and its submodules, like
+  "os.path.join". Every definition depends on the definitions whose names it
+  uses anywhere, e.g. in its parents, the parameter and return types of its
+  methods, or the bounds of its templates. A submodule depends on all of its
+  definitions. Names are looked up like LookupClasses() does, and names that
+  don't exist in the module (e.g. because they're builtins) are ignored. Both
+  resolved and unresolved modules can be used.
+  """
+
+  def __init__(self, unit):
+    self._symbols = set()
+    self._edges = collections.defaultdict(set)  # name -> set of names
+    stack = [("", unit)]
+    while stack:
+      prefix, module = stack.pop()
+      for section in (module.constants, module.functions, module.classes,
+                      module.modules):
+        for item in section:
+          self._symbols.add(prefix + item.name)
+      for submodule in module.modules:
+        name = prefix + submodule.name
+        self._edges[name].update(
+            name + "." + item.name
+            for section in (submodule.constants, submodule.functions,
+                            submodule.classes, submodule.modules)
+            for item in section)
+        stack.append((name + ".", submodule))
+    collector = _CollectReferences()
+    unit.Visit(collector)
+    for definition, scopes, name in collector.references:
+      target = self._Lookup(scopes, name)
+      if target is not None and target != definition:
+        self._edges[definition].add(target)
+
+  def _LookupLocal(self, prefix, name):
+    """Find the definition that prefix + name is (or is part of)."""
+    full_name = prefix + name
+    while full_name not in self._symbols:
+      if "." not in full_name[len(prefix):]:
+        return None
+      # E.g. a constant within a class.
+      full_name = full_name.rsplit(".", 1)[0]
+    return full_name
+
+  def _Lookup(self, scopes, name):
+    """Look up a name used in a (sub)module, like visitors.Resolver does."""
+    target = self._LookupLocal(scopes[-1], name)
+    if target is None:
+      target = self._LookupLocal("", name)
+    for prefix in reversed(scopes[:-1]):
+      if target is not None:
+        break
+      target = self._LookupLocal(prefix, name)
+    return target
+
+  def GetReachable(self, seeds):
+    """Get everything that the given names depend on, directly or indirectly.
+
+    Args:
+      seeds: An iterable of names, like "int" or "os.path.join". They're
+        looked up at the top level of the module.
+
+    Returns:
+      A set of dotted names of definitions and submodules, including the ones
+      of the seeds.
+    """
+    stack = [target for target in (self._Lookup(("",), name) for name in seeds)
+             if target is not None]
+    reachable = set(stack)
+    while stack:
+      for target in self._edges.get(stack.pop(), ()):
+        if target not in reachable:
+          reachable.add(target)
+          stack.append(target)
+    return reachable
+
+
+def GetDependencyGraph(unit):
+  """Get the DependencyGraph of a TypeDeclUnit.
+
+  This is cached: There's one instance per unit.
+
+  Args:
+    unit: A pytd.TypeDeclUnit.
+
+  Returns:
+    A DependencyGraph.
+  """
+  graph = unit.__dict__.get("_dependency_graph")
+  if graph is None:
+    graph = unit.__dict__["_dependency_graph"] = DependencyGraph(unit)
+  return graph
+
+
+def _PruneModule(module, prefix, reachable):
+  """Keep the definitions of a module whose dotted names are in reachable."""
+  modules = []
+  for submodule in module.modules:
+    name = prefix + submodule.name
+    submodule = _PruneModule(submodule, name + ".", reachable)
+    if (name in reachable or submodule.constants or submodule.functions or
+        submodule.classes or submodule.modules):
+      modules.append(submodule)
+  return module.Replace(
+      constants=tuple(c for c in module.constants
+                      if prefix + c.name in reachable),
+      functions=tuple(f for f in module.functions
+                      if prefix + f.name in reachable),
+      classes=tuple(c for c in module.classes if prefix + c.name in reachable),
+      modules=tuple(modules))
+
+
+def Prune(unit, seeds):
+  """Remove everything from a module that the given names don't depend on.
+
+  For example, to only keep the builtins a stub uses:
+    Prune(builtins.GetBuiltins(), GetReferencedNames(stub))
+
+  Args:
+    unit: A pytd.TypeDeclUnit. If its classes are resolved, so are the ones of
+      the result, since everything they refer to is kept.
+    seeds: An iterable of names, like "int" or "os.path.join". Names that don't
+      exist in unit are ignored.
+
+  Returns:
+    A new pytd.TypeDeclUnit, with the definitions that the seeds depend on.
+    Submodules that end up empty are removed, too.
+  """
+  reachable = GetDependencyGraph(unit).GetReachable(seeds)
+  new_unit = _PruneModule(unit, "", reachable)
+  if visitors.IsResolved(unit):
+    visitors.MarkResolved(new_unit)
+  return new_unit
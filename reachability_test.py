@@ -0,0 +1,86 @@
+"""Tests for reachability.py."""
+
+import textwrap
+import unittest
+
+
+from pytypedecl import pytd
+from pytypedecl import reachability
+from pytypedecl.parse import builtins
+from pytypedecl.parse import parser_test
+from pytypedecl.parse import visitors
+
+
+class TestReachability(parser_test.ParserTest):
+  """Test DependencyGraph and Prune."""
+
+  def setUp(self):
+    super(TestReachability, self).setUp()
+    self.unit = self.Parse(textwrap.dedent("""
+        x: A
+        class A(B):
+            def f(self, y: C) -> list<D>
+        class B(nothing):
+            pass
+        class C(nothing):
+            c: E
+        class D(nothing):
+            pass
+        class E(nothing):
+            pass
+        class T<K extends F>(nothing):
+            pass
+        class F(nothing):
+            pass
+        def g(a: A.c) -> ?
+        class Unused(A):
+            pass
+    """))
+    submodule = self.Parse(textwrap.dedent("""
+        class X(A):
+            pass
+        class A(nothing):
+            pass
+        def h(x: X) -> E
+    """)).Replace(name="m")
+    self.unit = self.unit.Replace(modules=(submodule,))
+
+  def testGetReachable(self):
+    graph = reachability.DependencyGraph(self.unit)
+    self.assertItemsEqual(["x", "A", "B", "C", "D", "E"],
+                          graph.GetReachable(["x"]))
+    self.assertItemsEqual(["T", "F"], graph.GetReachable(["T", "unknown"]))
+    self.assertItemsEqual(["g", "A", "B", "C", "D", "E"],
+                          graph.GetReachable(["g"]))
+    # Names in submodules are looked up there first.
+    self.assertItemsEqual(["m.h", "m.X", "m.A", "E"],
+                          graph.GetReachable(["m.h"]))
+    self.assertItemsEqual(["m", "m.h", "m.X", "m.A", "E"],
+                          graph.GetReachable(["m"]))
+
+  def testPrune(self):
+    pruned = reachability.Prune(self.unit, ["T", "m.X"])
+    self.assertEquals(["F", "T"], sorted(c.name for c in pruned.classes))
+    self.assertEquals((), pruned.functions)
+    self.assertEquals((), pruned.constants)
+    module, = pruned.modules
+    self.assertEquals(["X", "A"], [c.name for c in module.classes])
+    self.assertEquals((), reachability.Prune(self.unit, ["unknown"]).modules)
+
+  def testPruneBuiltins(self):
+    stub = self.Parse(textwrap.dedent("""
+        def f(x: bool) -> str
+    """))
+    resolved = builtins.GetResolvedBuiltins()
+    pruned = reachability.Prune(resolved, reachability.GetReferencedNames(stub))
+    self.assertTrue(visitors.IsResolved(pruned))
+    self.assertLess(len(pruned.classes), len(resolved.classes))
+    for name in ("bool", "int", "str", "object"):
+      self.assertIsInstance(pruned.Lookup(name), pytd.Class)
+    self.assertRaises(KeyError, pruned.Lookup, "file")
+    self.assertIs(reachability.GetDependencyGraph(resolved),
+                  reachability.GetDependencyGraph(resolved))
+
+
+if __name__ == "__main__":
+  unittest.main()
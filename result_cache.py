@@ -0,0 +1,216 @@
+# -*- coding:utf-8; python-indent:2; indent-tabs-mode:nil -*-
+
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A cache for pytd trees computed from other pytd trees.
+
+Example:
+  cache = ResultCache(directory=os.path.expanduser("~/.cache/optimize"))
+  unit = optimize.Optimize(unit, cache=cache)
+  print cache.Stats()
+"""
+
+import collections
+import os
+import tempfile
+import time
+
+
+from pytypedecl.parse import pytdb
+
+
+_SUFFIX = ".pytdb"
+
+
+class ResultCache(object):
+  """Stores pytd nodes under string keys, like fingerprints of their inputs.
+
+  Values are stored in serialized form (see pytdb.py), which is compact, and
+  means that every Get() returns a new copy, which callers are free to modify
+  (e.g. by filling in ClassType pointers). There are two tiers:
+    (1) In memory, at most max_memory_bytes. If there's more, the least
+        recently used entries are dropped.
+    (2) Optionally, a directory with one file per entry, of at most
+        max_disk_bytes in total. If there's more, the least recently used files
+        are deleted. Several processes can share a directory.
+
+  Attributes:
+    memory_hits: How many Get() calls found an entry in memory.
+    disk_hits: How many Get() calls found an entry on disk.
+    misses: How many Get() calls didn't find an entry.
+    time_saved: The time (in seconds) it took to compute all the entries that
+      Get() returned, minus the time it took to load them.
+  """
+
+  def __init__(self, directory=None, max_memory_bytes=64 << 20,
+               max_disk_bytes=1 << 30):
+    """Create a cache.
+
+    Args:
+      directory: The directory for the on-disk tier, or None to only cache in
+        memory. It's created if it doesn't exist.
+      max_memory_bytes: The size limit of the in-memory tier.
+      max_disk_bytes: The size limit of the on-disk tier.
+    """
+    self.directory = directory
+    self.max_memory_bytes = max_memory_bytes
+    self.max_disk_bytes = max_disk_bytes
+    self._memory = collections.OrderedDict()  # key -> (seconds, data)
+    self._memory_bytes = 0
+    self._disk_bytes = None  # estimate, or None if we haven't looked yet
+    self.memory_hits = 0
+    self.disk_hits = 0
+    self.misses = 0
+    self.time_saved = 0.0
+
+  def Get(self, key):
+    """Look up an entry.
+
+    Args:
+      key: A string. Only use characters that are valid in file names.
+
+    Returns:
+      A pytd node, or None if there is no entry for this key.
+    """
+    start = time.time()
+    entry = self._memory.pop(key, None)
+    if entry is not None:
+      self._memory[key] = entry  # most recently used
+      from_disk = False
+    else:
+      entry = self._ReadFile(key)
+      if entry is None:
+        self.misses += 1
+        return None
+      self._Remember(key, entry)
+      from_disk = True
+    seconds, data = entry
+    try:
+      node = pytdb.Load(data)
+    except pytdb.LoadError:
+      # E.g. written by a different version of pytd.
+      if self._memory.pop(key, None) is not None:
+        self._memory_bytes -= len(data)
+      self.misses += 1
+      return None
+    if from_disk:
+      self.disk_hits += 1
+    else:
+      self.memory_hits += 1
+    self.time_saved += max(0.0, seconds - (time.time() - start))
+    return node
+
+  def Put(self, key, node, seconds=0.0):
+    """Add an entry.
+
+    Args:
+      key: A string. Only use characters that are valid in file names.
+      node: A pytd node.
+      seconds: How long it took to compute node. For the statistics.
+    """
+    entry = (seconds, pytdb.Dump(node))
+    self._Remember(key, entry)
+    self._WriteFile(key, entry)
+
+  def Stats(self):
+    """Return a dictionary with the statistics of this cache."""
+    hits = self.memory_hits + self.disk_hits
+    lookups = hits + self.misses
+    return {
+        "hits": hits,
+        "memory_hits": self.memory_hits,
+        "disk_hits": self.disk_hits,
+        "misses": self.misses,
+        "hit_rate": float(hits) / lookups if lookups else 0.0,
+        "time_saved": self.time_saved,
+    }
+
+  def _Remember(self, key, entry):
+    old_entry = self._memory.pop(key, None)
+    if old_entry is not None:
+      self._memory_bytes -= len(old_entry[1])
+    self._memory[key] = entry
+    self._memory_bytes += len(entry[1])
+    while self._memory_bytes > self.max_memory_bytes:
+      _, (_, data) = self._memory.popitem(last=False)
+      self._memory_bytes -= len(data)
+
+  def _Filename(self, key):
+    return os.path.join(self.directory, key + _SUFFIX)
+
+  def _ReadFile(self, key):
+    """Read an entry from disk. Returns None if it's missing or unreadable."""
+    if not self.directory:
+      return None
+    filename = self._Filename(key)
+    try:
+      with open(filename, "rb") as fi:
+        seconds, _, data = fi.read().partition("\n")
+      entry = (float(seconds), data)
+      os.utime(filename, None)  # For evicting the least recently used files.
+    except (IOError, OSError, ValueError):
+      return None
+    return entry
+
+  def _WriteFile(self, key, entry):
+    """Store an entry on disk, atomically. Failures are silently ignored."""
+    if not self.directory:
+      return
+    contents = "%r\n%s" % entry
+    try:
+      if not os.path.isdir(self.directory):
+        os.makedirs(self.directory)
+      fd, tmp_filename = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+    except (IOError, OSError):
+      return
+    try:
+      with os.fdopen(fd, "wb") as fi:
+        fi.write(contents)
+      os.rename(tmp_filename, self._Filename(key))
+    except (IOError, OSError):
+      try:
+        os.unlink(tmp_filename)
+      except OSError:
+        pass
+      return
+    if self._disk_bytes is not None:
+      self._disk_bytes += len(contents)
+    if self._disk_bytes is None or self._disk_bytes > self.max_disk_bytes:
+      self._Evict()
+
+  def _Evict(self):
+    """Delete the least recently used files, until we're below the limit."""
+    files = []
+    for name in os.listdir(self.directory):
+      if name.endswith(_SUFFIX):
+        filename = os.path.join(self.directory, name)
+        try:
+          stat = os.stat(filename)
+        except OSError:
+          continue  # deleted by another process
+        files.append((stat.st_mtime, stat.st_size, filename))
+    total = sum(size for _, size, _ in files)
+    if total > self.max_disk_bytes:
+      # Make some room, so that we don't have to do this on every Put().
+      limit = self.max_disk_bytes * 3 // 4
+      for _, size, filename in sorted(files):
+        if total <= limit:
+          break
+        try:
+          os.unlink(filename)
+        except OSError:
+          pass
+        total -= size
+    self._disk_bytes = total
@@ -0,0 +1,91 @@
+"""Tests for result_cache.py."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+
+from pytypedecl import pytd
+from pytypedecl import result_cache
+
+
+class TestResultCache(unittest.TestCase):
+  """Test the memory and disk tiers of ResultCache."""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def _Function(self, name):
+    return pytd.Function(name, (pytd.Signature(
+        (), pytd.NamedType("int"), (), (), False),))
+
+  def testMemory(self):
+    cache = result_cache.ResultCache()
+    self.assertIsNone(cache.Get("a"))
+    f = self._Function("f")
+    cache.Put("a", f, seconds=1.0)
+    self.assertEquals(f, cache.Get("a"))
+    self.assertIsNot(cache.Get("a"), cache.Get("a"))
+    stats = cache.Stats()
+    self.assertEquals((3, 3, 0, 1), (stats["hits"], stats["memory_hits"],
+                                     stats["disk_hits"], stats["misses"]))
+    self.assertAlmostEqual(0.75, stats["hit_rate"])
+    self.assertGreater(stats["time_saved"], 2.0)
+
+  def testMemoryLimit(self):
+    size = len(pytd.Dump(self._Function("f")))
+    cache = result_cache.ResultCache(max_memory_bytes=2 * size)
+    cache.Put("f", self._Function("f"))
+    cache.Put("g", self._Function("g"))
+    cache.Get("f")
+    cache.Put("h", self._Function("h"))  # drops g, the least recently used
+    self.assertIsNotNone(cache.Get("f"))
+    self.assertIsNone(cache.Get("g"))
+    self.assertIsNotNone(cache.Get("h"))
+
+  def testDisk(self):
+    cache = result_cache.ResultCache(directory=self.directory)
+    cache.Put("a", self._Function("f"), seconds=1.0)
+    new_cache = result_cache.ResultCache(directory=self.directory)
+    self.assertEquals(self._Function("f"), new_cache.Get("a"))
+    self.assertEquals(1, new_cache.disk_hits)
+    self.assertEquals(self._Function("f"), new_cache.Get("a"))
+    self.assertEquals(1, new_cache.memory_hits)
+
+  def testDiskLimit(self):
+    cache = result_cache.ResultCache(directory=self.directory,
+                                     max_memory_bytes=0, max_disk_bytes=1000)
+    for i in range(100):
+      cache.Put("f%d" % i, self._Function("f%d" % i))
+    total = sum(os.path.getsize(os.path.join(self.directory, name))
+                for name in os.listdir(self.directory))
+    self.assertLessEqual(total, 1000)
+    self.assertIsNotNone(cache.Get("f99"))
+    self.assertIsNone(cache.Get("f0"))
+
+  def testCorruptFile(self):
+    cache = result_cache.ResultCache(directory=self.directory)
+    with open(os.path.join(self.directory, "a.pytdb"), "wb") as fi:
+      fi.write("0.5\nxyz")
+    self.assertIsNone(cache.Get("a"))
+    self.assertEquals(1, cache.misses)
+
+  def testEmptyOrTruncatedFile(self):
+    cache = result_cache.ResultCache(directory=self.directory)
+    cache.Put("a", self._Function("f"), seconds=1.0)
+    filename = os.path.join(self.directory, "a.pytdb")
+    with open(filename, "rb") as fi:
+      contents = fi.read()
+    for data in ("", contents[:len(contents) // 2], contents[:-1]):
+      with open(filename, "wb") as fi:
+        fi.write(data)
+      self.assertIsNone(result_cache.ResultCache(
+          directory=self.directory).Get("a"))
+
+
+if __name__ == "__main__":
+  unittest.main()
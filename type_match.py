@@ -28,6 +28,7 @@ signatures against new inference results.
 
 
 from pytypedecl import booleq
+from pytypedecl import class_hierarchy
 from pytypedecl import optimize
 from pytypedecl import pytd
 from pytypedecl import utils
@@ -78,14 +79,68 @@ class StrictType(node.Node("name")):
   For example, "int" is considered a valid argument for a function that accepts
   "object", but StrictType("int") is not.
   """
-  pass
+  __slots__ = ()
+
+
+def _ClassKey(t):
+  """Identify the class of a ClassType: Names aren't unique across modules."""
+  cls = t.cls
+  return t.name if cls is None else id(cls)
+
+
+class _ParentKeys(object):
+  """Maps classes to their parents, using ClassType pointers.
+
+  Used as the "superclasses" of a class_hierarchy.ClassHierarchy, with
+  _ClassKey() as class names. Classes are added (to "types") as they're
+  encountered.
+  """
+
+  def __init__(self, types):
+    self.types = types  # _ClassKey(t) -> (t, t.cls)
+
+  def __contains__(self, key):
+    return key in self.types
+
+  def get(self, key, default=()):
+    entry = self.types.get(key)
+    if entry is None or entry[1] is None:
+      return default
+    keys = []
+    for parent in entry[1].parents:
+      if not isinstance(parent, pytd.ClassType):
+        raise NotImplementedError("Can't extract superclasses from %s",
+                                  type(parent))
+      parent_key = _ClassKey(parent)
+      # Also store the class, so that its id() stays valid.
+      self.types.setdefault(parent_key, (parent, parent.cls))
+      keys.append(parent_key)
+    return keys
 
 
 class TypeMatch(utils.TypeMatcher):
   """Class for matching types against other types."""
 
-  def __init__(self, direct_subclasses=None):
+  def __init__(self, direct_subclasses=None, max_expanded_signatures=256):
+    """Create a matcher.
+
+    Args:
+      direct_subclasses: A dictionary, mapping pytd.TYPE to lists of pytd.Class.
+      max_expanded_signatures: When matching a signature against a function,
+        expand the signature to at most this many signatures. The unions of
+        the remaining parameters are matched as a whole, which is less precise.
+    """
     self.direct_subclasses = direct_subclasses or {}
+    self.max_expanded_signatures = max_expanded_signatures
+    self._types = {}  # _ClassKey(t) -> (t, t.cls)
+    subclass_keys = {}
+    for t, subclasses in self.direct_subclasses.items():
+      self._types.setdefault(_ClassKey(t), (t, t.cls))
+      subclass_keys[_ClassKey(t)] = [id(c) for c in subclasses]
+      for c in subclasses:
+        self._types.setdefault(id(c), (pytd.ClassType(c.name, c), c))
+    self._hierarchy = class_hierarchy.ClassHierarchy(
+        _ParentKeys(self._types), subclass_keys)
 
   def default_match(self, t1, t2):
     # Don't allow utils.TypeMatcher to do default matching.
@@ -102,7 +157,10 @@ class TypeMatch(utils.TypeMatcher):
         A list of pytd.TYPE.
     """
     if isinstance(t, pytd.ClassType):
-      return sum((self.get_superclasses(c) for c in t.cls.parents), [t])
+      key = _ClassKey(t)
+      self._types.setdefault(key, (t, t.cls))
+      return [t] + [self._types[k][0]
+                    for k in self._hierarchy.GetAncestors(key)[1:]]
     else:
       raise NotImplementedError("Can't extract superclasses from %s", type(t))
 
@@ -115,9 +173,8 @@ class TypeMatch(utils.TypeMatcher):
         A list of pytd.TYPE.
     """
     if isinstance(t, pytd.ClassType):
-      subclasses = self.direct_subclasses.get(t, [])
-      return sum((self.get_subclasses(pytd.ClassType(c.name, c))
-                  for c in subclasses), [t])
+      return [t] + [self._types[k][0]
+                    for k in self._hierarchy.GetDescendants(_ClassKey(t))[1:]]
     else:
       raise NotImplementedError("Can't extract subclasses from %s", type(t))
 
@@ -324,11 +381,17 @@ class TypeMatch(utils.TypeMatcher):
     #                     invalidate the first matching signature, so we need
     #                     a way to preserve the alternatives and backtrack
     #                     through them if necessary
-    return booleq.And(
-        booleq.Or(
-            self.match_signature_against_signature(sig, s, subst, skip_self)
-            for s in f.signatures)
-        for inner_sig in sig.Visit(optimize.ExpandSignatures()))
+    implications = []
+    for inner_sig in optimize.ExpandSignature(
+        sig, self.max_expanded_signatures, keep_unions=True):
+      implication = booleq.Or(
+          self.match_signature_against_signature(inner_sig, s, subst,
+                                                 skip_self)
+          for s in f.signatures)
+      implications.append(implication)
+      if implication is booleq.FALSE:
+        break  # No need to expand the rest.
+    return booleq.And(implications)
 
   def match_function_against_function(self, f1, f2, subst, skip_self=False):
     return booleq.And(
@@ -80,6 +80,21 @@ class TestTypeMatch(unittest.TestCase):
     self.assertEquals(m.match(ast.Lookup("left"), ast.Lookup("right"), {}),
                       booleq.TRUE)
 
+  def testExpandedSignatures(self):
+    ast = parser.parse_string(textwrap.dedent("""
+      def left(a: int or float, b: int or float) -> int
+      def right(a: int, b: int) -> int
+      def right(a: int, b: float) -> int
+      def right(a: float, b: int) -> int
+      def right(a: float, b: float) -> int
+    """))
+    left, right = ast.Lookup("left"), ast.Lookup("right")
+    m = type_match.TypeMatch()
+    self.assertEquals(m.match(left, right, {}), booleq.TRUE)
+    # Unions that aren't expanded have to match a single signature.
+    m = type_match.TypeMatch(max_expanded_signatures=2)
+    self.assertEquals(m.match(left, right, {}), booleq.FALSE)
+
   def testGeneric(self):
     ast = parser.parse_string(textwrap.dedent("""
       class A<T extends nothing>(nothing):
@@ -123,6 +138,45 @@ class TestTypeMatch(unittest.TestCase):
     self.assertEquals(m.match(left, right, {}), booleq.TRUE)
     self.assertNotEquals(m.match(right, left, {}), booleq.TRUE)
 
+  def testSubclassesWithSymbols(self):
+    ast = parser.parse_string(textwrap.dedent("""
+      class A(nothing):
+        pass
+      class B(A):
+        pass
+      def left(a: B) -> B
+      def right(a: A) -> A
+    """))
+    context = pytd.ResolutionContext()
+    ast = visitors.LookupClasses(ast, context=context)
+    m = type_match.TypeMatch()
+    left, right = ast.Lookup("left"), ast.Lookup("right")
+    self.assertEquals(m.match(left, right, {}), booleq.TRUE)
+    self.assertNotEquals(m.match(right, left, {}), booleq.TRUE)
+
+  def testSameNameInDifferentModules(self):
+    def Parse(src, name):
+      return visitors.LookupClasses(
+          parser.parse_string(textwrap.dedent(src), name=name))
+    m1 = Parse("""
+      class X(nothing):
+        pass
+      class A(X):
+        pass
+    """, "m1")
+    m2 = Parse("""
+      class Y(nothing):
+        pass
+      class A(Y):
+        pass
+    """, "m2")
+    m = type_match.TypeMatch()
+    a1 = pytd.ClassType("A", m1.Lookup("A"))
+    a2 = pytd.ClassType("A", m2.Lookup("A"))
+    self.assertEquals(["A", "X"], [t.name for t in m.get_superclasses(a1)])
+    self.assertEquals(["A", "Y"], [t.name for t in m.get_superclasses(a2)])
+    self.assertIs(m2.Lookup("Y"), m.get_superclasses(a2)[1].cls)
+
 
 if __name__ == "__main__":
   unittest.main()
@@ -20,7 +20,6 @@ This provides a utility function to access data files in a way that works either
 locally or within a larger repository.
 """
 
-import collections
 import os
 
 
@@ -68,18 +67,29 @@ def JoinTypes(types):
   Returns:
     A type that represents the union of the types passed in. Order is preserved.
   """
-  queue = collections.deque(types)
+  types = tuple(types)
+  if types and isinstance(types[0], pytd.UnionType):
+    # Optimization: If everything we're joining is already part of the first
+    # union, and it doesn't need any cleaning up, we can return it as-is.
+    union = types[0]
+    if (len(union.members) == len(union.type_list) and
+        pytd.NothingType() not in union and
+        pytd.AnythingType() not in union and
+        all(t in union or
+            isinstance(t, pytd.UnionType) and t.members <= union.members
+            for t in types[1:])):
+      return union
+
   seen = set()
   new_types = []
-  while queue:
-    t = queue.popleft()
-    if isinstance(t, pytd.UnionType):
-      queue.extendleft(reversed(t.type_list))
-    elif isinstance(t, pytd.NothingType):
-      pass
-    elif t not in seen:
-      new_types.append(t)
-      seen.add(t)
+  for t in types:
+    # UnionTypes are already flattened, so we only need to look one level deep.
+    for member in (t.type_list if isinstance(t, pytd.UnionType) else (t,)):
+      if isinstance(member, pytd.NothingType):
+        pass
+      elif member not in seen:
+        new_types.append(member)
+        seen.add(member)
 
   if len(new_types) == 1:
     return new_types.pop()
@@ -18,6 +18,7 @@ import textwrap
 import unittest
 from pytypedecl import pytd
 from pytypedecl import utils
+from pytypedecl.parse import builtins
 from pytypedecl.parse import parser_test
 
 
@@ -75,6 +76,15 @@ class TestUtils(parser_test.ParserTest):
     combined = utils.Concat(ast1, ast2)
     self.AssertSourceEquals(combined, expected)
 
+  def testConcatBuiltins(self):
+    ast = self.Parse("def f() -> int")
+    unit = builtins.GetBuiltins()
+    for combined in (utils.Concat(ast, unit), utils.Concat(unit, ast)):
+      self.assertIsInstance(combined.modules, tuple)
+      self.assertEquals(len(unit.modules), len(combined.modules))
+      self.assertIsNotNone(combined.Lookup("f"))
+      self.assertIsNotNone(combined.Lookup("os.stat"))
+
   def testJoinTypes(self):
     """Test that JoinTypes() does recursive flattening."""
     n1, n2, n3, n4, n5, n6 = [pytd.NamedType("n%d" % i) for i in xrange(6)]
@@ -104,6 +114,20 @@ class TestUtils(parser_test.ParserTest):
     """Test that JoinTypes() simplifies empty unions to 'nothing'."""
     self.assertIsInstance(utils.JoinTypes([]), pytd.NothingType)
 
+  def testJoinUnionReusesUnion(self):
+    """Test that JoinTypes() doesn't rebuild unions that are already joined."""
+    a, b, c = [pytd.NamedType(name) for name in "abc"]
+    union = pytd.UnionType((a, b, c))
+    self.assertIs(utils.JoinTypes([union]), union)
+    self.assertIs(utils.JoinTypes([union, b, pytd.UnionType((c, a))]), union)
+    # Unions that need cleaning up are rebuilt:
+    self.assertEquals(utils.JoinTypes([pytd.UnionType((a, b, a))]).type_list,
+                      (a, b))
+    self.assertEquals(
+        utils.JoinTypes([pytd.UnionType((a, pytd.NothingType()))]), a)
+    self.assertEquals(utils.JoinTypes([union, pytd.NamedType("d")]).type_list,
+                      (a, b, c, pytd.NamedType("d")))
+
   def testJoinAnythingTypes(self):
     """Test that JoinTypes() simplifies unions containing '?'."""
     types = [pytd.AnythingType(), pytd.NamedType("a")]